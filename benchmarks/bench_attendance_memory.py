@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Memory and time to decode and save an attendance log as Attendance objects
+(DownloadService.persist_stream) against an AttendanceBatch
+(DownloadService.persist_batches), with tracemalloc.
+
+    python -m benchmarks.bench_attendance_memory [--records 1000000] [--users 1000]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from zk.base import UserIndex, iter_attendance_records, decode_attendance_batch
+from zk.user import User
+from benchmarks.emulator import make_attendance
+
+
+def measure(fct):
+    """
+    :return: (result, seconds, peak bytes allocated while running fct),
+        timed on a first run, traced on a second one (tracemalloc slows
+        allocations down several times)
+    """
+    started = time.time()
+    fct()
+    elapsed = time.time() - started
+    tracemalloc.start()
+    try:
+        result = fct()
+        return result, elapsed, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def save(path, fct):
+    from unittest.mock import patch
+    from data.db import init_db
+    from data.repositories import AttendanceRepository
+    from services.download_service import DownloadService
+    with patch('data.db._DB_PATH', path):
+        init_db()
+        service = DownloadService(None, AttendanceRepository())
+        return measure(lambda: fct(service))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='attendance objects vs AttendanceBatch memory benchmark')
+    parser.add_argument('--records', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--chunk', type=int, default=0xFFc0, help='bytes per received chunk [65472]')
+    args = parser.parse_args()
+
+    data = make_attendance(args.records, users=args.users)[4:]
+    index = UserIndex(User(uid, 'User %i' % uid, 0, user_id=str(uid)) for uid in range(1, args.users + 1))
+    step = args.chunk - args.chunk % 8
+    chunks = [data[offset:offset + step] for offset in range(0, len(data), step)]
+
+    print ('{} records of 8 bytes, {} users'.format(args.records, args.users))
+    objects, elapsed, peak = measure(lambda: list(iter_attendance_records(data, 8, index)))
+    print ('{:<28} {:7.2f} s  {:8.1f} MB  {:6.1f} bytes/record'.format(
+        'decode Attendance list', elapsed, peak / 1e6, peak / float(args.records)))
+    del objects
+    batch, elapsed, peak = measure(lambda: decode_attendance_batch(data, 8, index))
+    print ('{:<28} {:7.2f} s  {:8.1f} MB  {:6.1f} bytes/record'.format(
+        'decode AttendanceBatch', elapsed, peak / 1e6, peak / float(args.records)))
+    del batch
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        modes = [
+            ('save persist_stream', lambda service: service.persist_stream(
+                1, (a for chunk in chunks for a in iter_attendance_records(chunk, 8, index)))),
+            ('save persist_batches', lambda service: service.persist_batches(
+                1, (decode_attendance_batch(chunk, 8, index) for chunk in chunks))),
+        ]
+        for name, fct in modes:
+            saved, elapsed, peak = save(path, fct)
+            assert saved == args.records, saved
+            print ('{:<28} {:7.2f} s  {:8.1f} MB  {:8.0f} records/s'.format(
+                name, elapsed, peak / 1e6, saved / elapsed))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Packet checksum cost from 8 bytes to 64 KB, word by word loop (as in
+zkemsdk.c) against zk.base.create_checksum.
+
+    python -m benchmarks.bench_checksum [--loop-max 16384]
+"""
+import argparse
+import os
+import timeit
+
+from zk import base
+
+SIZES = [8, 16, 64, 256, 1024, 1032, 4096, 16384, 65472, 65536]
+
+
+def per_call(fct, data, budget=0.2):
+    """
+    seconds per call, repeating for about budget seconds
+    """
+    timer = timeit.Timer(lambda: fct(data))
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * budget / max(elapsed, 1e-9)))
+    return min(timer.repeat(3, number)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description='checksum microbenchmark')
+    parser.add_argument('--loop-max', type=int, default=16384,
+                        help='largest size timed with the quadratic loop [16384]')
+    args = parser.parse_args()
+
+    numpy = base.numpy
+    print ('numpy: {}'.format(numpy.__version__ if numpy is not None else 'not installed'))
+    print ('{:>8} {:>12} {:>12} {:>12} {:>9}'.format('bytes', 'loop us', 'int us', 'numpy us', 'speedup'))
+    for size in SIZES:
+        data = os.urandom(size)
+        expected = base.create_checksum_loop(tuple(bytearray(data)))
+        # int.from_bytes path only, then the default (numpy above the threshold)
+        base.numpy = None
+        assert base.create_checksum(data) == expected, size
+        fast = per_call(base.create_checksum, data)
+        base.numpy = numpy
+        vector = None
+        if numpy is not None:
+            assert base.create_checksum(data) == expected, size
+            minimum, base._NUMPY_MIN_SIZE = base._NUMPY_MIN_SIZE, 0
+            vector = per_call(base.create_checksum, data)
+            base._NUMPY_MIN_SIZE = minimum
+        loop = None
+        if size <= args.loop_max:
+            words = tuple(bytearray(data))
+            loop = per_call(base.create_checksum_loop, words)
+        print ('{:>8} {:>12} {:>12.2f} {:>12} {:>9}'.format(
+            size,
+            '{:.2f}'.format(loop * 1e6) if loop else '-',
+            fast * 1e6,
+            '{:.2f}'.format(vector * 1e6) if vector else '-',
+            '{:.0f}x'.format(loop / min(fast, vector or fast)) if loop else '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Memory per object and construction time of the slotted User, Finger and
+Attendance against the former __dict__ classes (eager Finger.mark), for
+the objects of a backup with 50k templates.
+
+    python -m benchmarks.bench_models [--templates 50000] [--size 1024]
+"""
+import argparse
+import codecs
+import os
+import time
+import tracemalloc
+from datetime import datetime
+
+from zk.user import User
+from zk.finger import Finger
+from zk.attendance import Attendance
+
+
+class DictUser(object):
+    def __init__(self, uid, name, privilege, password='', group_id='', user_id='', card=0):
+        self.uid = uid
+        self.name = u'{0}'.format(name)
+        self.privilege = privilege
+        self.password = str(password)
+        self.group_id = str(group_id)
+        self.user_id = user_id
+        self.card = int(card)
+
+
+class DictFinger(object):
+    def __init__(self, uid, fid, valid, template):
+        self.size = len(template)
+        self.uid = int(uid)
+        self.fid = int(fid)
+        self.valid = int(valid)
+        self.template = template
+        self.mark = codecs.encode(template[:8], 'hex') + b'...' + codecs.encode(template[-8:], 'hex')
+
+
+class DictAttendance(object):
+    def __init__(self, user_id, timestamp, status, punch=0, uid=0):
+        self.uid = uid
+        self.user_id = user_id
+        self.timestamp = timestamp
+        self.status = status
+        self.punch = punch
+
+
+def measure(build, count):
+    """
+    :return: (seconds, bytes per object) of building count objects, the
+        arguments (templates, names...) allocated before and not counted
+    """
+    started = time.time()
+    build()
+    elapsed = time.time() - started
+    tracemalloc.start()
+    try:
+        objects = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    assert len(objects) == count
+    return elapsed, size / float(count)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='slotted models benchmark')
+    parser.add_argument('--templates', type=int, default=50000)
+    parser.add_argument('--size', type=int, default=1024, help='template size [1024] bytes')
+    args = parser.parse_args()
+
+    users = [{'uid': uid, 'name': 'User %i' % uid, 'privilege': 0, 'password': '', 'group_id': '',
+              'user_id': str(uid), 'card': 0} for uid in range(1, args.templates // 2 + 1)]
+    templates = [(n // 2 + 1, n % 2, 1, os.urandom(args.size)) for n in range(args.templates)]
+    when = datetime(2024, 1, 1, 8, 0, 0)
+    records = [(str(n % 1000), when, 1, 0, n % 1000) for n in range(args.templates)]
+
+    cases = [
+        ('User', len(users), lambda: [DictUser(**u) for u in users], lambda: [User(**u) for u in users]),
+        ('Finger', len(templates), lambda: [DictFinger(*t) for t in templates], lambda: [Finger(*t) for t in templates]),
+        ('Attendance', len(records), lambda: [DictAttendance(*r) for r in records], lambda: [Attendance(*r) for r in records]),
+    ]
+    print ('{} templates of {} bytes, {} users'.format(args.templates, args.size, len(users)))
+    print ('{:<11} {:>12} {:>12} {:>10} {:>10} {:>8}'.format(
+        'model', '__dict__ B', '__slots__ B', 'dict ms', 'slots ms', 'speedup'))
+    for name, count, old, new in cases:
+        old_time, old_size = measure(old, count)
+        new_time, new_size = measure(new, count)
+        print ('{:<11} {:>12.0f} {:>12.0f} {:>10.1f} {:>10.1f} {:>7.1f}x'.format(
+            name, old_size, new_size, old_time * 1000, new_time * 1000, old_time / new_time))
+
+
+if __name__ == '__main__':
+    main()
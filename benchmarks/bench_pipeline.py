@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Attendance download throughput with serial and pipelined chunk reads,
+against the local emulator with a simulated round trip time.
+
+    python -m benchmarks.bench_pipeline [--records 200000] [--rtt 0.08]
+"""
+import argparse
+import time
+
+from zk import ZK
+from benchmarks.emulator import ZKEmulator
+
+
+def download(port, pipeline):
+    zk = ZK('127.0.0.1', port=port, timeout=10, ommit_ping=True, read_pipeline=pipeline)
+    conn = zk.connect()
+    try:
+        started = time.time()
+        count = len(conn.get_attendance())
+        return count, time.time() - started
+    finally:
+        conn.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pipelined read_with_buffer benchmark')
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--rtt', type=float, default=0.08, help='simulated round trip [0.08] seconds')
+    parser.add_argument('--depths', default='0,2,4,8', help='pipeline depths to test [0,2,4,8]')
+    args = parser.parse_args()
+
+    with ZKEmulator(records=args.records, latency=args.rtt) as device:
+        size = len(device.attendance)
+        print ('{} records, {} bytes, rtt {:.0f} ms'.format(args.records, size, args.rtt * 1000))
+        baseline = None
+        for depth in [int(d) for d in args.depths.split(',')]:
+            count, elapsed = download(device.port, depth)
+            assert count == args.records, count
+            baseline = baseline or elapsed
+            print ('pipeline {:>2}: {:6.2f} s  {:8.1f} KB/s  x{:.1f}'.format(
+                depth, elapsed, size / 1024.0 / elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
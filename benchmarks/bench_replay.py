@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Offline profiling of the download decoders: record a session once (from a
+terminal, or from the local emulator when no --ip is given), then replay
+it with no device attached and time or profile the calls.
+
+    python -m benchmarks.bench_replay record t1.zkcap [--ip 192.168.1.201] [--calls get_users,get_attendance]
+    python -m benchmarks.bench_replay replay t1.zkcap [--calls get_users,get_attendance] [--repeat 5] [--profile]
+
+the replay must make the calls of the recording, in the same order.
+"""
+import argparse
+import cProfile
+import os
+import pstats
+import time
+
+from zk import ZK
+from zk.transport import Recorder, Replayer
+from benchmarks.emulator import ZKEmulator
+
+
+def session(args, transport, port=None):
+    return ZK(args.ip or '127.0.0.1', port=port or args.port, timeout=30, password=args.password,
+              force_udp=args.udp, ommit_ping=True, transport=transport).connect()
+
+
+def run_calls(conn, calls):
+    """
+    :return: list of (call, records)
+    """
+    counts = []
+    for call in calls:
+        counts.append((call, len(getattr(conn, call)())))
+    conn.disconnect()
+    return counts
+
+
+def record(args, calls):
+    with Recorder(args.capture) as recorder:
+        if args.ip:
+            counts = run_calls(session(args, recorder), calls)
+        else:
+            with ZKEmulator(records=args.records, users=args.users, templates=args.templates) as device:
+                counts = run_calls(session(args, recorder, device.port), calls)
+    print ('{} ({} bytes): {}'.format(args.capture, os.path.getsize(args.capture),
+                                      ', '.join('%s %i' % count for count in counts)))
+
+
+def replay(args, calls):
+    best = None
+    for _ in range(args.repeat):
+        transport = Replayer(args.capture) # loaded before timing
+        started = time.time()
+        counts = run_calls(session(args, transport), calls)
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print ('{}: best of {} replays {:.3f} s ({})'.format(
+        args.capture, args.repeat, best, ', '.join('%s %i' % count for count in counts)))
+    if args.profile:
+        transport = Replayer(args.capture)
+        profile = cProfile.Profile()
+        profile.runcall(lambda: run_calls(session(args, transport), calls))
+        pstats.Stats(profile).sort_stats('cumulative').print_stats(25)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='record and replay ZK sessions')
+    parser.add_argument('action', choices=['record', 'replay'])
+    parser.add_argument('capture', help='capture file (.gz: compressed)')
+    parser.add_argument('--calls', default='get_users,get_attendance', help='ZK methods called [get_users,get_attendance]')
+    parser.add_argument('--ip', help='terminal to record, the emulator when not given')
+    parser.add_argument('--port', type=int, default=4370)
+    parser.add_argument('--password', type=int, default=0)
+    parser.add_argument('--udp', action='store_true', help='force UDP')
+    parser.add_argument('--records', type=int, default=200000, help='emulator attendance records [200000]')
+    parser.add_argument('--users', type=int, default=1000, help='emulator users [1000]')
+    parser.add_argument('--templates', type=int, default=0, help='emulator templates per user [0]')
+    parser.add_argument('--repeat', type=int, default=3, help='replays, the best is kept [3]')
+    parser.add_argument('--profile', action='store_true', help='print a cProfile of one replay')
+    args = parser.parse_args()
+    calls = [call for call in args.calls.split(',') if call]
+    if args.action == 'record':
+        record(args, calls)
+    else:
+        replay(args, calls)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+HR_save_usertemplates upload throughput with 1 KB chunks (older firmwares),
+the largest chunks of the transport and pipelined chunks, against the local
+emulator with a simulated round trip time.
+
+    python -m benchmarks.bench_upload [--users 5000] [--templates 2] [--rtt 0.02]
+"""
+import argparse
+import os
+import time
+
+from zk import ZK
+from zk.user import User
+from zk.finger import Finger
+from benchmarks.emulator import ZKEmulator
+
+
+def make_usertemplates(users, templates, size):
+    return [
+        (User(uid, 'User %i' % uid, 0, user_id=str(uid)),
+         [Finger(uid, fid, 1, os.urandom(size)) for fid in range(templates)])
+        for uid in range(1, users + 1)]
+
+
+def upload(port, usertemplates, chunk, pipeline):
+    zk = ZK('127.0.0.1', port=port, timeout=30, ommit_ping=True, write_pipeline=pipeline)
+    conn = zk.connect()
+    try:
+        conn.write_chunk = chunk
+        started = time.time()
+        conn.HR_save_usertemplates(usertemplates)
+        return time.time() - started
+    finally:
+        conn.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HR_save_usertemplates upload benchmark')
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--templates', type=int, default=2, help='templates per user [2]')
+    parser.add_argument('--size', type=int, default=1024, help='template size [1024] bytes')
+    parser.add_argument('--rtt', type=float, default=0.02, help='simulated round trip [0.02] seconds')
+    args = parser.parse_args()
+
+    usertemplates = make_usertemplates(args.users, args.templates, args.size)
+    modes = [
+        ('1 KB chunks', 1024, 0),
+        ('64 KB chunks', 0xFFc0, 0),
+        ('64 KB pipeline 4', 0xFFc0, 4),
+    ]
+    with ZKEmulator(latency=args.rtt) as device:
+        baseline = None
+        for name, chunk, pipeline in modes:
+            elapsed = upload(device.port, usertemplates, chunk, pipeline)
+            size = len(device.usertemps[-1])
+            baseline = baseline or elapsed
+            print ('{:<18} {} bytes {:7.2f} s  {:8.1f} KB/s  x{:.1f}'.format(
+                name, size, elapsed, size / 1024.0 / elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
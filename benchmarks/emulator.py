@@ -0,0 +1,627 @@
+# -*- coding: utf-8 -*-
+"""
+Local ZK terminal emulator, used to benchmark and load test zk.ZK without
+a device.
+
+It listens on TCP and UDP (same port number) and answers the protocol
+spoken by zk.base.ZK:
+
+* CMD_CONNECT, and CMD_AUTH checked against make_commkey when a password
+  is set
+* CMD_GET_FREE_SIZES and the identification commands
+* _CMD_PREPARE_BUFFER / _CMD_READ_BUFFER reads of the user table (28 or
+  72 bytes records), the templates and the attendance log (8, 16 or 40
+  bytes records), and _CMD_GET_USERTEMP
+* CMD_USER_WRQ, CMD_DELETE_USER, or CMD_PREPARE_DATA and CMD_DATA chunks
+  saved with _CMD_SAVE_USERTEMPS, which replaces the templates of every
+  user uploaded with the ones in the buffer (like most firmwares)
+* CMD_REG_EVENT: punch() sends a live attendance event to the sessions
+  that registered EF_ATTLOG
+
+Every reply can be delayed to simulate the network round trip time, and a
+fraction of the packets lost: a lost UDP datagram is not sent, a lost TCP
+segment costs a retransmission timeout.
+"""
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from socket import AF_INET, IPPROTO_TCP, SOCK_DGRAM, SOCK_STREAM, SOL_SOCKET, SO_LINGER, SO_REUSEADDR, TCP_NODELAY, socket
+from struct import pack, unpack
+
+try:
+    import queue
+except ImportError: # python 2
+    import Queue as queue
+
+from zk import const
+from zk.base import make_commkey
+
+SESSION_ID = 0x4f2c
+UDP_DATA_SIZE = 1024 # CMD_DATA payload per datagram, as read by zk.base over UDP
+
+
+def encode_time(t):
+    """
+    zkemsdk.c - EncodeTime
+    """
+    return (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) *
+        (24 * 60 * 60) + (t.hour * 60 + t.minute) * 60 + t.second
+    )
+
+
+def encode_timehex(t):
+    """
+    six bytes timestamp of the live events
+    """
+    return pack('6B', t.year - 2000, t.month, t.day, t.hour, t.minute, t.second)
+
+
+def attendance_record(uid, timestamp, status=0, punch=0, record_size=8):
+    """
+    one attendance record of the given layout, user_id is str(uid)
+    """
+    t = encode_time(timestamp)
+    if record_size == 16:
+        return pack('<IIBB2sI', uid, t, status, punch, b'', 0)
+    if record_size == 40:
+        return pack('<H24sBIB8s', uid, str(uid).encode(), status, t, punch, b'')
+    return pack('<HBIB', uid, status, t, punch)
+
+
+def make_attendance(records, start=datetime(2024, 1, 1, 8, 0, 0), users=1000, record_size=8):
+    """
+    synthetic attendance log of 8, 16 or 40 bytes records (with the
+    leading total size)
+    """
+    data = b''.join(
+        attendance_record(n % users + 1, start + timedelta(minutes=n), n % 2, 0, record_size)
+        for n in range(records))
+    return pack('<I', len(data)) + data
+
+
+def make_user(uid):
+    """
+    synthetic 72 bytes user record
+    """
+    return pack('<HB8s24sIx7sx24s', uid, 0, b'', ('User %i' % uid).encode(), 0, b'', str(uid).encode())
+
+
+def make_users(users):
+    """
+    synthetic 72 bytes user table (with the leading total size)
+    """
+    data = b''.join(make_user(uid) for uid in range(1, users + 1))
+    return pack('<I', len(data)) + data
+
+
+def make_template(uid, fid, size=512):
+    """
+    synthetic fingerprint template, the same bytes for the same uid / fid
+    """
+    seed = pack('<HB', uid, fid) + b'ZKTemplate'
+    return (seed * (size // len(seed) + 1))[:size]
+
+
+def user_record(data):
+    """
+    72 bytes user record from a 28 or 72 bytes CMD_USER_WRQ
+    """
+    if len(data) >= 72:
+        return data[:72]
+    uid, privilege, password, name, card, group_id, _tz, user_id = unpack('<HB5s8sIxBHI', data[:28])
+    return pack('<HB8s24sIx7sx24s', uid, privilege, password, name, card, str(group_id).encode(), str(user_id).encode())
+
+
+def user_record28(record):
+    """
+    28 bytes (zk6) user record from a 72 bytes one, numeric group and
+    user_id (0 when they are not)
+    """
+    uid, privilege, password, name, card, group_id, user_id = unpack('<HB8s24sIx7sx24s', record)
+    group_id, user_id = [value.split(b'\x00')[0] for value in (group_id, user_id)]
+    group_id = int(group_id) % 256 if group_id.isdigit() else 0
+    user_id = int(user_id) if user_id.isdigit() else 0
+    return pack('<HB5s8sIxBhI', uid, privilege, password[:5], name[:8], card, group_id, 0, user_id)
+
+
+class ZKEmulator(object):
+    """
+    ZK terminal listening on localhost, over TCP and UDP
+
+    :param records: number of attendance records
+    :param users: number of users (uid 1..users)
+    :param templates: fingerprint templates per user (fid 0..templates-1)
+    :param template_size: bytes per template
+    :param record_size: attendance record layout, 8, 16 or 40 bytes
+    :param user_packet_size: user record layout, 28 (zk6) or 72 (zk8)
+    :param password: communication key, CMD_AUTH required when not 0
+    :param serialnumber: answered to ~SerialNumber
+    :param latency: seconds added to every reply (simulated round trip)
+    :param loss: fraction of the reply packets lost (UDP datagrams not
+        sent, TCP replies delayed by rto)
+    :param rto: TCP retransmission timeout of a lost packet, seconds
+    :param seed: random seed of the packet loss
+    :param pipelining: answer requests sent before the previous reply was
+        delivered, like newer firmwares. when False they get CMD_ACK_ERROR
+    :param max_chunk: largest CMD_DATA accepted, bigger ones get
+        CMD_ACK_ERROR (None: no limit)
+    :param oversize: what a CMD_DATA over max_chunk gets instead: 'error'
+        (CMD_ACK_ERROR), 'drop' (no reply) or 'reset' (the connection is
+        reset, TCP)
+    :param drop_after: every drop_after _CMD_READ_BUFFER requests the
+        connection is closed half way through the reply, `drops` times
+        (TCP)
+    :param udp: also answer on UDP
+    :param tcp: answer on TCP, when False connections are refused like
+        on UDP only terminals
+    :param inline: buffers up to this size are sent right away in the
+        _CMD_PREPARE_BUFFER reply (CMD_DATA), like firmwares do for small
+        tables
+    """
+
+    def __init__(self, records=0, latency=0.0, pipelining=True, host='127.0.0.1', port=0, users=0, serialnumber='EMU0000001', max_chunk=None, drop_after=0, drops=0,
+                 templates=0, template_size=512, record_size=8, user_packet_size=72, password=0, loss=0.0, rto=0.2, seed=None, udp=True, inline=0, tcp=True, oversize='error'):
+        self.records = records
+        self.users = users
+        self.options = {
+            b'~SerialNumber': serialnumber.encode(),
+            b'~Platform': b'ZEM560_TFT',
+            b'~DeviceName': b'Emulator',
+            b'MAC': b'00:17:61:00:00:01',
+            b'~ExtendFmt': b'0',
+            b'~UserExtFmt': b'1',
+        }
+        self.firmware = b'Ver 6.60 Emulator'
+
+        self.user_records = dict((uid, make_user(uid)) for uid in range(1, users + 1))
+        self.templates = dict(((uid, fid), make_template(uid, fid, template_size))
+                              for uid in range(1, users + 1) for fid in range(templates))
+        self.record_size = record_size
+        self.user_packet_size = user_packet_size
+        self.password = password
+        self.latency = latency
+        self.loss = loss
+        self.rto = rto
+        self.random = random.Random(seed)
+        self.pipelining = pipelining
+        self.attendance = make_attendance(records, record_size=record_size)
+        self.buffer = b''
+        self.max_chunk = max_chunk
+        self.oversize = oversize
+        self.oversized = 0 # CMD_DATA chunks over max_chunk received
+        self.inline = inline
+        self.drop_after = drop_after
+        self.drops = drops
+        self.chunk_reads = 0
+        self.upload = None # [expected size, received chunks]
+        self.usertemps = [] # buffers saved with _CMD_SAVE_USERTEMPS
+        self.refreshes = 0
+        self.requests = 0
+        self.connections = 0
+        self.lost = 0 # packets lost on purpose
+        self.__listeners = [] # sessions registered for live events
+        self.__lock = threading.Lock()
+        self.__server = socket(AF_INET, SOCK_STREAM)
+        self.__server.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.__server.bind((host, port))
+        self.__server.listen(16)
+        self.address = self.__server.getsockname()
+        self.port = self.address[1]
+        self.__udp = None
+        if udp:
+            self.__udp = socket(AF_INET, SOCK_DGRAM)
+            self.__udp.bind((host, self.port))
+        if not tcp:
+            self.__server.close() # only bound to pick the port
+            self.__server = None
+        self.__running = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.__running = True
+        targets = [self.__serve] if self.__server else []
+        if self.__udp:
+            targets.append(self.__serve_udp)
+        for target in targets:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def stop(self):
+        self.__running = False
+        if self.__server:
+            self.__server.close()
+        if self.__udp:
+            self.__udp.close()
+
+    def __serve(self):
+        while self.__running:
+            try:
+                conn, _addr = self.__server.accept()
+            except Exception:
+                break
+            self.connections += 1
+            # replies go out as soon as they are due, Nagle would hold the
+            # small ones back until the client acknowledges the previous
+            conn.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+            thread = threading.Thread(target=self.__handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def __recv_exact(self, conn, size):
+        data = b''
+        while len(data) < size:
+            part = conn.recv(size - len(data))
+            if not part:
+                return None
+            data += part
+        return data
+
+    def __lose(self):
+        """
+        :return: True when the next packet is lost
+        """
+        if self.loss and self.random.random() < self.loss:
+            self.lost += 1
+            return True
+        return False
+
+    def __session(self, replies, pending, udp=False):
+        return {'auth': not self.password, 'events': 0, 'replies': replies, 'pending': pending, 'udp': udp}
+
+    def __handle(self, conn):
+        replies = queue.Queue()
+        pending = [0] # replies queued but not delivered yet
+        session = self.__session(replies, pending)
+        writer = threading.Thread(target=self.__write, args=(replies, pending, conn.sendall))
+        writer.daemon = True
+        writer.start()
+        try:
+            while True:
+                top = self.__recv_exact(conn, 8)
+                if top is None:
+                    break
+                length = unpack('<HHI', top)[2]
+                packet = self.__recv_exact(conn, length)
+                if packet is None:
+                    break
+                command, _checksum, _session, reply_id = unpack('<4H', packet[:8])
+                answer = self.__answer(session, command, packet[8:])
+                if session.get('reset'):
+                    conn.setsockopt(SOL_SOCKET, SO_LINGER, pack('ii', 1, 0)) # RST instead of FIN
+                    break
+                if not answer:
+                    continue
+                data = b''.join(self.packet(cmd, reply_id, payload) for cmd, payload in answer)
+                delay = self.latency + (self.rto if self.__lose() else 0)
+                pending[0] += 1
+                if command == const._CMD_READ_BUFFER:
+                    self.chunk_reads += 1
+                    if self.drops and self.drop_after and self.chunk_reads % self.drop_after == 0:
+                        self.drops -= 1
+                        replies.put((time.time() + delay, [data[:len(data) // 2]], True))
+                        break
+                replies.put((time.time() + delay, [data], True))
+                if command == const.CMD_EXIT:
+                    break
+        finally:
+            self.__unlisten(session)
+            replies.put(None)
+            writer.join()
+            conn.close()
+
+    def __serve_udp(self):
+        replies = queue.Queue()
+        pending = [0]
+        sessions = {} # client address -> session
+        writer = threading.Thread(target=self.__write, args=(replies, pending, None))
+        writer.daemon = True
+        writer.start()
+        while self.__running:
+            try:
+                packet, address = self.__udp.recvfrom(0xFFFF)
+            except Exception:
+                break
+            if len(packet) < 8:
+                continue
+            command, _checksum, _session, reply_id = unpack('<4H', packet[:8])
+            session = sessions.get(address)
+            if session is None or command == const.CMD_CONNECT:
+                if session is None:
+                    self.connections += 1
+                session = sessions[address] = self.__session(replies, pending, address)
+            answer = self.__answer(session, command, packet[8:])
+            if command == const.CMD_EXIT:
+                self.__unlisten(sessions.pop(address))
+            if not answer:
+                continue
+            datagrams = [self.header(cmd, reply_id, payload) for cmd, payload in self.__split_udp(answer)]
+            # lost datagrams are not sent at all
+            datagrams = [(address, d) for d in datagrams if not self.__lose()]
+            pending[0] += 1
+            replies.put((time.time() + self.latency, datagrams, True))
+        replies.put(None)
+
+    def __split_udp(self, answer):
+        """
+        CMD_DATA after CMD_PREPARE_DATA goes in UDP_DATA_SIZE datagrams
+        """
+        packets = []
+        prepared = False
+        for cmd, payload in answer:
+            if cmd == const.CMD_DATA and prepared:
+                packets.extend((cmd, payload[i:i + UDP_DATA_SIZE]) for i in range(0, len(payload), UDP_DATA_SIZE))
+            else:
+                packets.append((cmd, payload))
+            prepared = cmd == const.CMD_PREPARE_DATA
+        return packets
+
+    def __write(self, replies, pending, sendall):
+        """
+        deliver queued replies and events in order once they are due,
+        sendall None: UDP datagrams as (address, data)
+        """
+        while True:
+            item = replies.get()
+            if item is None:
+                break
+            due, packets, reply = item
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if reply:
+                pending[0] -= 1 # before sending, a serial client may answer at once
+            try:
+                for packet in packets:
+                    if sendall is None:
+                        self.__udp.sendto(packet[1], packet[0])
+                    else:
+                        sendall(packet)
+            except Exception:
+                if sendall is not None:
+                    break
+
+    def __answer(self, session, command, data):
+        """
+        :return: list of (command, data) replies, empty for the packets
+            that get none (event acknowledges)
+        """
+        if command == const.CMD_ACK_OK: # live event acknowledged
+            return []
+        self.requests += 1
+        if session['pending'][0] and not self.pipelining:
+            return [(const.CMD_ACK_ERROR, b'')]
+        if command == const.CMD_CONNECT:
+            session['auth'] = not self.password
+            return [(const.CMD_ACK_OK if session['auth'] else const.CMD_ACK_UNAUTH, b'')]
+        if command == const.CMD_AUTH:
+            session['auth'] = data[:4] == make_commkey(self.password, SESSION_ID)
+            return [(const.CMD_ACK_OK if session['auth'] else const.CMD_ACK_UNAUTH, b'')]
+        if not session['auth']:
+            return [(const.CMD_ACK_UNAUTH, b'')]
+        if command == const.CMD_REG_EVENT:
+            session['events'] = unpack('<I', data[:4])[0]
+            with self.__lock:
+                if session['events'] and session not in self.__listeners:
+                    self.__listeners.append(session)
+                elif not session['events'] and session in self.__listeners:
+                    self.__listeners.remove(session)
+            return [(const.CMD_ACK_OK, b'')]
+        if command == const.CMD_DATA and self.max_chunk is not None and len(data) > self.max_chunk:
+            self.oversized += 1
+            if self.oversize == 'reset' and not session['udp']:
+                session['reset'] = True
+            if self.oversize != 'error':
+                return []
+        return self.handle(command, data, session['udp'])
+
+    def __unlisten(self, session):
+        with self.__lock:
+            if session in self.__listeners:
+                self.__listeners.remove(session)
+
+    def punch(self, uid, status=0, punch=0, timestamp=None):
+        """
+        add an attendance record and send it as a live event (CMD_REG_EVENT)
+        to the sessions registered for EF_ATTLOG
+
+        :return: number of sessions notified
+        """
+        timestamp = timestamp or datetime.now().replace(microsecond=0)
+        data = self.attendance[4:] + attendance_record(uid, timestamp, status, punch, self.record_size)
+        self.attendance = pack('<I', len(data)) + data
+        self.records += 1
+        if self.user_packet_size == 28:
+            event = pack('<HBB6s', uid, status, punch, encode_timehex(timestamp))
+        else:
+            event = pack('<24sBB6s', str(uid).encode(), status, punch, encode_timehex(timestamp))
+        with self.__lock:
+            listeners = [s for s in self.__listeners if s['events'] & const.EF_ATTLOG]
+        for session in listeners:
+            if session['udp']:
+                packets = [(session['udp'], self.header(const.CMD_REG_EVENT, 0, event))]
+            else:
+                packets = [self.packet(const.CMD_REG_EVENT, 0, event)]
+            session['replies'].put((time.time() + self.latency, packets, False))
+        return len(listeners)
+
+    def header(self, command, reply_id, data=b''):
+        """
+        build a udp packet as sent by the terminal
+        """
+        return pack('<4H', command, 0, SESSION_ID, reply_id) + data
+
+    def packet(self, command, reply_id, data=b''):
+        """
+        build a tcp packet as sent by the terminal
+        """
+        packet = self.header(command, reply_id, data)
+        return pack('<HHI', const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, len(packet)) + packet
+
+    def user_table(self):
+        """
+        user table sorted by uid in user_packet_size records (with the
+        leading total size)
+        """
+        records = (self.user_records[uid] for uid in sorted(self.user_records))
+        if self.user_packet_size == 28:
+            records = (user_record28(record) for record in records)
+        data = b''.join(records)
+        return pack('<I', len(data)) + data
+
+    def template_table(self):
+        """
+        CMD_DB_RRQ / FCT_FINGERTMP buffer (with the leading total size)
+        """
+        data = b''.join(pack('<HHbb', len(template) + 6, uid, fid, 1) + template
+                        for (uid, fid), template in sorted(self.templates.items()))
+        return pack('<I', len(data)) + data
+
+    def save_user(self, record):
+        self.user_records[unpack('<H', record[:2])[0]] = record
+        self.users = len(self.user_records)
+
+    def sizes(self):
+        fields = [0] * 20
+        fields[4] = self.users
+        fields[6] = len(self.templates)
+        fields[8] = self.records
+        fields[16] = max(self.records, 100000)
+        return pack('20i', *fields) + pack('3i', 0, 0, 0)
+
+    def handle(self, command, data, udp=False):
+        """
+        :return: list of (command, data) replies
+        """
+        if command == const.CMD_GET_VERSION:
+            return [(const.CMD_ACK_OK, self.firmware + b'\x00')]
+        if command == const.CMD_GET_PINWIDTH:
+            return [(const.CMD_ACK_OK, b'\x09')]
+        if command == const.CMD_OPTIONS_RRQ:
+            key = data.split(b'\x00')[0]
+            if key not in self.options:
+                return [(const.CMD_ACK_ERROR, b'')]
+            return [(const.CMD_ACK_OK, key + b'=' + self.options[key] + b'\x00')]
+        if command == const.CMD_GET_TIME:
+            return [(const.CMD_ACK_OK, pack('<I', encode_time(datetime.now())))]
+        if command == const.CMD_GET_FREE_SIZES:
+            return [(const.CMD_ACK_OK, self.sizes())]
+        if command == const._CMD_PREPARE_BUFFER:
+            _flag, buffered, fct, _ext = unpack('<bhii', data[:11])
+            if buffered == const.CMD_ATTLOG_RRQ:
+                self.buffer = self.attendance
+            elif buffered == const.CMD_USERTEMP_RRQ:
+                self.buffer = self.user_table()
+            elif buffered == const.CMD_DB_RRQ and fct == const.FCT_FINGERTMP:
+                self.buffer = self.template_table()
+            else:
+                self.buffer = pack('<I', 0)
+            size = len(self.buffer)
+            if size <= self.inline:
+                return [(const.CMD_DATA, self.buffer)]
+            return [(const.CMD_ACK_OK, b'\x00' + pack('<II', size, size) + b'\x00' * 4)]
+        if command == const._CMD_READ_BUFFER:
+            start, size = unpack('<ii', data[:8])
+            chunk = self.buffer[start:start + size]
+            return [
+                (const.CMD_PREPARE_DATA, pack('<II', len(chunk), 0)),
+                (const.CMD_DATA, chunk),
+                (const.CMD_ACK_OK, b''),
+            ]
+        if command == const._CMD_GET_USERTEMP:
+            uid, fid = unpack('<hb', data[:3])
+            template = self.templates.get((uid, fid))
+            if template is None:
+                return [(const.CMD_ACK_ERROR, b'')]
+            if udp and len(template) + 1 > UDP_DATA_SIZE:
+                return [(const.CMD_PREPARE_DATA, pack('<I', len(template) + 1)),
+                        (const.CMD_DATA, template + b'\x00'),
+                        (const.CMD_ACK_OK, b'')]
+            return [(const.CMD_DATA, template + b'\x00')]
+        if command == const.CMD_PREPARE_DATA:
+            self.upload = [unpack('<I', data[:4])[0], []]
+            return [(const.CMD_ACK_OK, b'')]
+        if command == const.CMD_DATA:
+            if self.upload is None or (self.max_chunk is not None and len(data) > self.max_chunk):
+                return [(const.CMD_ACK_ERROR, b'')]
+            self.upload[1].append(data)
+            return [(const.CMD_ACK_OK, b'')]
+        if command == const._CMD_SAVE_USERTEMPS:
+            upload = b''.join(self.upload[1]) if self.upload else b''
+            if not self.upload or len(upload) != self.upload[0]:
+                return [(const.CMD_ACK_ERROR, b'')]
+            self.usertemps.append(upload)
+            self.upload = None
+            users, table, _templates = unpack('<III', upload[:12])
+            size = 29 if users % 73 else 73 # repack29 / repack73
+            for start in range(12, 12 + users, size):
+                record = user_record(upload[start + 1:start + size]) # after the leading 02
+                uid = unpack('<H', record[:2])[0]
+                for key in [key for key in self.templates if key[0] == uid]:
+                    del self.templates[key]
+                self.save_user(record)
+            templates = upload[12 + users + table:]
+            for start in range(12 + users, 12 + users + table, 8):
+                _kind, uid, fid, offset = unpack('<bHbI', upload[start:start + 8])
+                template_size = unpack('<H', templates[offset:offset + 2])[0]
+                self.templates[(uid, fid - 0x10)] = templates[offset + 2:offset + 2 + template_size]
+            return [(const.CMD_ACK_OK, b'')]
+        if command == const.CMD_USER_WRQ:
+            self.save_user(user_record(data))
+            return [(const.CMD_ACK_OK, b'')]
+        if command == const.CMD_DELETE_USER:
+            uid = unpack('<h', data[:2])[0]
+            self.user_records.pop(uid, None)
+            for key in [key for key in self.templates if key[0] == uid]:
+                del self.templates[key]
+            self.users = len(self.user_records)
+            return [(const.CMD_ACK_OK, b'')]
+        if command == const.CMD_REFRESHDATA:
+            self.refreshes += 1
+            return [(const.CMD_ACK_OK, b'')]
+        if command == const.CMD_CLEAR_ATTLOG:
+            self.records, self.attendance = 0, pack('<I', 0)
+            return [(const.CMD_ACK_OK, b'')]
+        if command == const.CMD_FREE_DATA:
+            self.buffer = b''
+            self.upload = None
+        return [(const.CMD_ACK_OK, b'')]
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='local ZK terminal emulator (TCP and UDP)')
+    parser.add_argument('-p', '--port', type=int, default=4370, help='port [4370]')
+    parser.add_argument('-r', '--records', type=int, default=10000, help='attendance records [10000]')
+    parser.add_argument('-u', '--users', type=int, default=1000, help='users [1000]')
+    parser.add_argument('-t', '--templates', type=int, default=0, help='templates per user [0]')
+    parser.add_argument('--record-size', type=int, default=8, choices=(8, 16, 40), help='attendance layout [8]')
+    parser.add_argument('--user-size', type=int, default=72, choices=(28, 72), help='user layout [72]')
+    parser.add_argument('-P', '--password', type=int, default=0, help='communication key [0]')
+    parser.add_argument('--rtt', type=float, default=0.0, help='simulated round trip [0] seconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='fraction of lost packets [0]')
+    args = parser.parse_args()
+    device = ZKEmulator(records=args.records, users=args.users, templates=args.templates, port=args.port,
+                        record_size=args.record_size, user_packet_size=args.user_size,
+                        password=args.password, latency=args.rtt, loss=args.loss)
+    device.start()
+    print ('emulating a terminal on 127.0.0.1:{} (tcp and udp), ctrl-c to stop'.format(device.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.stop()
+
+
+if __name__ == '__main__':
+    main()
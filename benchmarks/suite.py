@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+End to end benchmark suite against the local emulator: downloads
+(get_users, get_attendance, get_templates) at several table sizes, the
+HR_save_usertemplates upload, DownloadService persistence into SQLite and
+a fleet download from concurrent emulated devices.
+
+Results are written as JSON; --compare flags the cases slower than a
+stored baseline by more than --threshold (exit status 1).
+
+    python -m benchmarks.suite [--sizes 1000,100000,1000000] [--output results.json]
+    python -m benchmarks.suite --quick --compare baseline.json
+    python -m benchmarks.suite --results results.json --compare baseline.json
+
+user tables are capped at 65535 rows (the uid is 16 bits), templates at
+10 per user.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from zk import ZK
+from zk.user import User
+from zk.finger import Finger
+from zk.attendance import Attendance
+from benchmarks.emulator import ZKEmulator
+
+MAX_USERS = 0xFFFF
+MAX_TEMPLATES = 10 # per user
+
+
+def timed(fct, repeat=1):
+    """
+    :return: (result, best seconds of repeat runs)
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        result = fct()
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def result(rows, seconds, size=None):
+    """
+    one case result: rows/s is the compared rate
+    """
+    entry = {'rows': rows, 'seconds': round(seconds, 6), 'rate': round(rows / max(seconds, 1e-9), 1)}
+    if size is not None:
+        entry['bytes'] = size
+        entry['bytes_rate'] = round(size / max(seconds, 1e-9), 1)
+    return entry
+
+
+def session(device, **options):
+    return ZK('127.0.0.1', port=device.port, timeout=30, ommit_ping=True, **options).connect()
+
+
+def bench_downloads(sizes, rtt, repeat):
+    results = {}
+    for rows in sizes:
+        users = min(rows, MAX_USERS)
+        with ZKEmulator(records=rows, users=users, latency=rtt) as device:
+            conn = session(device)
+            try:
+                got, seconds = timed(conn.get_attendance, repeat)
+                assert len(got) == rows, len(got)
+                results['download.attendance.%i' % rows] = result(rows, seconds, len(device.attendance))
+                got, seconds = timed(conn.get_users, repeat)
+                assert len(got) == users, len(got)
+                results['download.users.%i' % rows] = result(users, seconds, len(device.user_table()))
+            finally:
+                conn.disconnect()
+        per_user = min(MAX_TEMPLATES, max(1, -(-rows // MAX_USERS)))
+        users = min(MAX_USERS, -(-rows // per_user))
+        with ZKEmulator(users=users, templates=per_user, template_size=256, latency=rtt) as device:
+            conn = session(device)
+            try:
+                got, seconds = timed(conn.get_templates, repeat)
+                assert len(got) == users * per_user, len(got)
+                results['download.templates.%i' % rows] = result(len(got), seconds, len(device.template_table()))
+            finally:
+                conn.disconnect()
+    return results
+
+
+def bench_upload(users, rtt, repeat, template_size=1024):
+    usertemplates = [
+        (User(uid, 'User %i' % uid, 0, user_id=str(uid)), [Finger(uid, 0, 1, os.urandom(template_size))])
+        for uid in range(1, min(users, MAX_USERS) + 1)]
+    with ZKEmulator(latency=rtt) as device:
+        conn = session(device)
+        try:
+            _none, seconds = timed(lambda: conn.HR_save_usertemplates(usertemplates), repeat)
+            return {'upload.usertemplates.%i' % len(usertemplates):
+                    result(len(usertemplates), seconds, len(device.usertemps[-1]))}
+        finally:
+            conn.disconnect()
+
+
+def bench_persist(rows, repeat):
+    from unittest.mock import patch
+    from data.db import init_db
+    from data.repositories import AttendanceRepository
+    from services.download_service import DownloadService
+    from zk.attendance import AttendanceBatch
+    start = datetime(2024, 1, 1, 8, 0, 0)
+    events = [Attendance(str(n % 1000 + 1), start, n % 2, 0, n % 1000 + 1) for n in range(rows)]
+    batch = AttendanceBatch()
+    for event in events:
+        batch.add(event)
+    results = {}
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        with patch('data.db._DB_PATH', path):
+            init_db()
+            service = DownloadService(None, AttendanceRepository())
+            saved, seconds = timed(lambda: service.persist_events(1, events), repeat)
+            results['persist.events.%i' % rows] = result(saved, seconds)
+            saved, seconds = timed(lambda: service.persist_batches(1, [batch]), repeat)
+            results['persist.batches.%i' % rows] = result(saved, seconds)
+    finally:
+        os.remove(path)
+    return results
+
+
+def bench_fleet(devices, records, rtt, workers):
+    from unittest.mock import patch
+    from data.db import init_db
+    from data.models import Device
+    from data.repositories import AttendanceRepository, DeviceRepository
+    from services.zk_service import ZKService
+    from services.download_service import DownloadService
+    from services.fleet_service import FleetDownloader
+    emulators = [ZKEmulator(records=records, users=100, latency=rtt, serialnumber='EMU%07i' % n).start()
+                 for n in range(devices)]
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    try:
+        with patch('data.db._DB_PATH', path):
+            init_db()
+            device_repo = DeviceRepository()
+            for n, device in enumerate(emulators):
+                device_repo.create(Device(id=None, name='emu %i' % n, ip='127.0.0.1', port=device.port))
+            zk = ZKService(max_sessions=workers, device_repo=device_repo)
+            fleet = FleetDownloader(zk, DownloadService(zk, AttendanceRepository()), device_repo,
+                                    max_workers=workers, timeout=30, retries=0)
+            try:
+                summary, seconds = timed(fleet.run)
+            finally:
+                zk.close_all()
+        assert not summary.failed and summary.events == devices * records, summary.format()
+        return {'fleet.%ix%i' % (devices, records): result(summary.events, seconds)}
+    finally:
+        for device in emulators:
+            device.stop()
+        os.remove(path)
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    :return: list of (case, baseline rate, current rate, ratio, regressed),
+        for the cases present in both
+    """
+    rows = []
+    for case in sorted(set(baseline.get('results', {})) & set(current.get('results', {}))):
+        old = baseline['results'][case]['rate']
+        new = current['results'][case]['rate']
+        ratio = new / old if old else 1.0
+        rows.append((case, old, new, ratio, ratio < 1.0 - threshold))
+    return rows
+
+
+def run(args):
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    results = {}
+    steps = [
+        ('downloads', lambda: bench_downloads(sizes, args.rtt, args.repeat)),
+        ('upload', lambda: bench_upload(args.upload_users, args.rtt, args.repeat)),
+        ('persist', lambda: bench_persist(args.persist_rows, args.repeat)),
+        ('fleet', lambda: bench_fleet(args.devices, args.fleet_records, args.rtt, args.workers)),
+    ]
+    for name, step in steps:
+        if args.only and name not in args.only.split(','):
+            continue
+        print ('running {} ...'.format(name), file=sys.stderr)
+        for case, entry in sorted(step().items()):
+            results[case] = entry
+            print ('{:<32} {:>9} rows {:9.3f} s {:>12.0f} rows/s'.format(
+                case, entry['rows'], entry['seconds'], entry['rate']), file=sys.stderr)
+    return {
+        'meta': {
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'rtt': args.rtt,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pyzk end to end benchmark suite')
+    parser.add_argument('--sizes', default='1000,100000,1000000', help='download table sizes [1000,100000,1000000]')
+    parser.add_argument('--quick', action='store_true', help='small sizes: 1000,10000 rows, 2 devices')
+    parser.add_argument('--rtt', type=float, default=0.0, help='simulated round trip [0] seconds')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per case, the best is kept [1]')
+    parser.add_argument('--upload-users', type=int, default=5000, help='users uploaded with one template [5000]')
+    parser.add_argument('--persist-rows', type=int, default=100000, help='events persisted [100000]')
+    parser.add_argument('--devices', type=int, default=16, help='emulated devices of the fleet run [16]')
+    parser.add_argument('--fleet-records', type=int, default=20000, help='records per fleet device [20000]')
+    parser.add_argument('--workers', type=int, default=8, help='fleet devices downloaded at the same time [8]')
+    parser.add_argument('--only', default='', help='steps to run: downloads,upload,persist,fleet [all]')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--results', help='compare these stored results instead of running')
+    parser.add_argument('--compare', help='baseline JSON file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown flagged as regression [0.1]')
+    args = parser.parse_args()
+    if args.quick:
+        args.sizes, args.upload_users, args.persist_rows = '1000,10000', 1000, 10000
+        args.devices, args.fleet_records = 2, 5000
+
+    if args.results:
+        with open(args.results) as f:
+            current = json.load(f)
+    else:
+        current = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=1, sort_keys=True)
+    elif not args.compare:
+        print (json.dumps(current, indent=1, sort_keys=True))
+    if not args.compare:
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    rows = compare(baseline, current, args.threshold)
+    print ('{:<32} {:>12} {:>12} {:>8}'.format('case', 'baseline/s', 'current/s', 'ratio'))
+    for case, old, new, ratio, regressed in rows:
+        print ('{:<32} {:>12.0f} {:>12.0f} {:>7.2f}x{}'.format(case, old, new, ratio, '  REGRESSION' if regressed else ''))
+    regressions = [row for row in rows if row[4]]
+    print ('{} cases compared, {} regressions (threshold {:.0%})'.format(len(rows), len(regressions), args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,6 +8,9 @@ class AppConfig:
     auto_download_on_open: bool = False
     auto_download_interval_min: int = 5
     delete_after_download: bool = False
+    # Scheduled downloads: devices downloaded at the same time, retries per device
+    fleet_max_workers: int = 4
+    fleet_retries: int = 2
 
 
 CONFIG = AppConfig()
@@ -28,7 +28,9 @@ def init_db() -> None:
                 platform TEXT,
                 device_name TEXT,
                 mac TEXT,
-                last_error TEXT
+                last_error TEXT,
+                capabilities TEXT,
+                counts TEXT
             )
             """
         )
@@ -37,7 +39,7 @@ def init_db() -> None:
         cols = [row[1] for row in cur.fetchall()]
         if 'password' not in cols:
             cur.execute("ALTER TABLE devices ADD COLUMN password INTEGER DEFAULT 0")
-        backfill_cols = ['location','serialnumber','firmware','platform','device_name','mac','last_error']
+        backfill_cols = ['location','serialnumber','firmware','platform','device_name','mac','last_error','capabilities','counts']
         for bc in backfill_cols:
             if bc not in cols:
                 cur.execute(f"ALTER TABLE devices ADD COLUMN {bc} TEXT")
@@ -1,3 +1,4 @@
+import json
 from typing import List, Optional, Tuple
 from .db import get_conn
 from .models import Device, Employee, Attendance
@@ -47,6 +48,69 @@ class DeviceRepository:
             cur.execute("DELETE FROM devices WHERE id=?", (device_id,))
             conn.commit()
 
+    def get_capabilities(self, ip: str, port: int) -> Optional[dict]:
+        with get_conn() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT capabilities FROM devices WHERE ip=? AND port=? AND capabilities IS NOT NULL ORDER BY id LIMIT 1", (ip, port))
+            r = cur.fetchone()
+        if not r or not r[0]:
+            return None
+        try:
+            return json.loads(r[0])
+        except ValueError:
+            return None
+
+    def set_capabilities(self, ip: str, port: int, profile: dict) -> None:
+        # Written to the rows with this serial number / MAC (or the row at this address when none
+        # matches). Profiles are read back by address: ZK.connect checks the serial number again
+        # and drops a profile that belongs to another terminal.
+        text = json.dumps(profile, sort_keys=True)
+        serial = profile.get('serialnumber') or None
+        mac = profile.get('mac') or None
+        with get_conn() as conn:
+            cur = conn.cursor()
+            cur.execute(
+                "UPDATE devices SET capabilities=?, firmware=?, platform=COALESCE(?, platform) WHERE (serialnumber IS NOT NULL AND serialnumber=?) OR (mac IS NOT NULL AND mac=?)",
+                (text, profile.get('firmware'), profile.get('platform'), serial, mac),
+            )
+            if cur.rowcount == 0:
+                cur.execute(
+                    "UPDATE devices SET capabilities=?, firmware=?, platform=COALESCE(?, platform), serialnumber=COALESCE(?, serialnumber), mac=COALESCE(?, mac) WHERE ip=? AND port=?",
+                    (text, profile.get('firmware'), profile.get('platform'), serial, mac, ip, port),
+                )
+            conn.commit()
+
+    def get_counts(self, ip: str, port: int, serialnumber: Optional[str] = None) -> Optional[dict]:
+        # users / fingers / records seen at the last download, see ZKService.poll_changes
+        with get_conn() as conn:
+            cur = conn.cursor()
+            r = None
+            if serialnumber:
+                cur.execute("SELECT counts FROM devices WHERE serialnumber=? AND counts IS NOT NULL ORDER BY id LIMIT 1", (serialnumber,))
+                r = cur.fetchone()
+            if not r:
+                cur.execute("SELECT counts FROM devices WHERE ip=? AND port=? AND counts IS NOT NULL ORDER BY id LIMIT 1", (ip, port))
+                r = cur.fetchone()
+        if not r or not r[0]:
+            return None
+        try:
+            return json.loads(r[0])
+        except ValueError:
+            return None
+
+    def set_counts(self, ip: str, port: int, counts: dict) -> None:
+        text = json.dumps(counts, sort_keys=True)
+        serial = counts.get('serialnumber') or None
+        with get_conn() as conn:
+            cur = conn.cursor()
+            cur.execute("UPDATE devices SET counts=? WHERE serialnumber IS NOT NULL AND serialnumber=?", (text, serial))
+            if cur.rowcount == 0:
+                cur.execute(
+                    "UPDATE devices SET counts=?, serialnumber=COALESCE(serialnumber, ?) WHERE ip=? AND port=?",
+                    (text, serial, ip, port),
+                )
+            conn.commit()
+
 
 class EmployeeRepository:
     def list(self) -> List[Employee]:
@@ -104,6 +168,9 @@ class EmployeeRepository:
             conn.commit()
 
 
+_RAW_ATTENDANCE = '{"uid": %d, "user_id": %s, "timestamp": "%s", "status": %d, "punch": %d}'
+
+
 class AttendanceRepository:
     def insert_many(self, device_id: int, events: List[Attendance]) -> None:
         with get_conn() as conn:
@@ -114,6 +181,26 @@ class AttendanceRepository:
             )
             conn.commit()
 
+    def insert_batch(self, device_id: int, batch) -> int:
+        """Bulk insert a zk AttendanceBatch, rows generated straight from its columns.
+
+        raw_json has the same fields as the json of a zk Attendance.
+        """
+        user_ids = batch.user_ids
+        quoted = [json.dumps(u) for u in user_ids]
+        rows = (
+            (device_id, user_ids[u], ts, status, punch, _RAW_ATTENDANCE % (uid, quoted[u], ts, status, punch))
+            for u, uid, ts, status, punch in zip(batch.user, batch.uid, batch.iter_times(), batch.status, batch.punch)
+        )
+        with get_conn() as conn:
+            cur = conn.cursor()
+            cur.executemany(
+                "INSERT INTO attendance(device_id,user_id,timestamp,status,punch,raw_json) VALUES (?,?,?,?,?,?)",
+                rows
+            )
+            conn.commit()
+        return len(batch)
+
 
 class SettingsRepository:
     def get(self, key: str) -> Optional[str]:
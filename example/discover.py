@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import argparse
+
+CWD = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(CWD)
+sys.path.append(ROOT_DIR)
+
+from services.discovery_service import DiscoveryService
+
+parser = argparse.ArgumentParser(description='Find ZK terminals on the network')
+parser.add_argument('targets', nargs='+', help='CIDR ranges or hosts (192.168.1.0/22 192.168.5.7:4371)')
+parser.add_argument('-p', '--port', type=int, default=4370, help='device port [4370]')
+parser.add_argument('-T', '--timeout', type=float, default=0.5, help='seconds to wait for every probe/reply [0.5]')
+parser.add_argument('-d', '--deadline', type=float, default=3.0, help='max seconds per host [3]')
+parser.add_argument('-w', '--workers', type=int, default=256, help='hosts probed at the same time [256]')
+parser.add_argument('-P', '--password', type=int, default=0, help='device code/password')
+parser.add_argument('-r', '--register', action="store_true", help='register the terminals found in the devices table')
+args = parser.parse_args()
+
+discovery = DiscoveryService(port=args.port, timeout=args.timeout, deadline=args.deadline,
+                             max_workers=args.workers, password=args.password)
+
+
+def on_found(d):
+    print ('{:<21} {:<4} serial: {:<16} fw: {:<22} platform: {}{}'.format(
+        '%s:%s' % (d.ip, d.port), d.transport, d.serialnumber or '-', d.firmware or '-', d.platform or '-',
+        ' (%s)' % d.error if d.error else ''))
+
+
+inicio = time.time()
+found = discovery.discover(args.targets, on_found=on_found)
+print ('{} terminals found in {:.2f}s'.format(len(found), time.time() - inicio))
+if args.register and found:
+    from data.db import init_db
+    from data.repositories import DeviceRepository
+    init_db()
+    created, updated = discovery.register(found, DeviceRepository())
+    print ('{} created, {} updated'.format(created, updated))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import argparse
+
+CWD = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.dirname(CWD)
+sys.path.append(ROOT_DIR)
+
+from data.db import init_db
+from data.repositories import AttendanceRepository, DeviceRepository
+from services.zk_service import ZKService
+from services.download_service import DownloadService
+from services.fleet_service import FleetDownloader
+
+parser = argparse.ArgumentParser(description='Download the attendance log of every enabled device')
+parser.add_argument('-w', '--workers', type=int, default=4, help='devices downloaded at the same time [4]')
+parser.add_argument('-T', '--timeout', type=int, default=10, help='seconds to wait for every reply [10]')
+parser.add_argument('-d', '--deadline', type=float, default=None, help='max seconds per download attempt')
+parser.add_argument('-r', '--retries', type=int, default=2, help='retries per device [2]')
+parser.add_argument('-b', '--backoff', type=float, default=2.0, help='seconds before the first retry, doubled after [2]')
+parser.add_argument('-c', '--clear', action="store_true", help='clear the log of the device after downloading')
+parser.add_argument('-a', '--all', action="store_true", help='download even when the record count did not change')
+args = parser.parse_args()
+
+init_db()
+devices = DeviceRepository()
+zk = ZKService(max_sessions=args.workers, device_repo=devices)
+fleet = FleetDownloader(zk, DownloadService(zk, AttendanceRepository()), devices,
+                        max_workers=args.workers, timeout=args.timeout, deadline=args.deadline,
+                        retries=args.retries, backoff=args.backoff, clear_after=args.clear,
+                        skip_unchanged=not args.all)
+
+
+def on_result(r):
+    if r.unchanged:
+        print ('= {} ({}:{}) unchanged'.format(r.name, r.ip, r.port))
+    elif r.ok:
+        print ('+ {} ({}:{}) {} events in {:.2f}s'.format(r.name, r.ip, r.port, r.events, r.seconds))
+    else:
+        print ('- {} ({}:{}) failed after {} attempts: {}'.format(r.name, r.ip, r.port, r.attempts, r.error))
+
+
+try:
+    summary = fleet.run(on_result=on_result)
+    print ('')
+    print (summary.format())
+finally:
+    zk.close_all()
+sys.exit(1 if summary.failed else 0)
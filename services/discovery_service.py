@@ -0,0 +1,149 @@
+import ipaddress
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from zk import ZK
+from zk.base import ZK_helper
+from zk.exception import ZKErrorResponse
+from data.models import Device
+from data.repositories import DeviceRepository
+
+
+@dataclass
+class DiscoveredDevice:
+    ip: str
+    port: int
+    transport: str  # 'tcp' or 'udp'
+    serialnumber: Optional[str] = None
+    firmware: Optional[str] = None
+    platform: Optional[str] = None
+    device_name: Optional[str] = None
+    mac: Optional[str] = None
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+
+def iter_hosts(cidr: str) -> Iterable[str]:
+    network = ipaddress.ip_network(cidr, strict=False)
+    hosts = list(network.hosts()) or [network.network_address]
+    return [str(h) for h in hosts]
+
+
+class DiscoveryService:
+    """Find ZK terminals on a network range.
+
+    Every host is probed in parallel: a TCP connection to `port` first, then
+    a UDP CMD_CONNECT when TCP is refused or times out. Each probe and each
+    reply of the identification commands is bounded by `timeout`, and a host
+    never takes more than `deadline` seconds (identification stops there).
+    """
+
+    def __init__(self, port: int = 4370, timeout: float = 0.5, deadline: float = 3.0,
+                 max_workers: int = 256, password: int = 0):
+        self.port = port
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_workers = max_workers
+        self.password = password
+
+    def probe(self, ip: str, port: Optional[int] = None) -> Optional[DiscoveredDevice]:
+        port = port or self.port
+        started = time.monotonic()
+        helper = ZK_helper(ip, port, self.timeout)
+        if helper.test_tcp() == 0:
+            transport = 'tcp'
+        elif helper.test_udp():
+            transport = 'udp'
+        else:
+            return None
+        found = DiscoveredDevice(ip=ip, port=port, transport=transport)
+        zk = ZK(ip, port=port, timeout=self.timeout, password=self.password, ommit_ping=True,
+                force_udp=(transport == 'udp'), probe_timeout=self.timeout)
+        if transport == 'tcp':
+            zk.helper = helper  # its connection becomes the session socket
+        conn = None
+        try:
+            try:
+                conn = zk.connect()
+            except ZKErrorResponse as e:
+                # a terminal answered CMD_CONNECT, i.e. a wrong password
+                found.error = str(e)
+                return found
+            except Exception:
+                return None  # port open, but not a ZK terminal
+            for field, getter in (('serialnumber', conn.get_serialnumber),
+                                  ('firmware', conn.get_firmware_version),
+                                  ('platform', conn.get_platform),
+                                  ('mac', conn.get_mac),
+                                  ('device_name', conn.get_device_name)):
+                if time.monotonic() - started > self.deadline:
+                    found.error = 'deadline'
+                    break
+                setattr(found, field, getter() or None)
+        except Exception as e:
+            found.error = str(e) or e.__class__.__name__
+        finally:
+            found.seconds = time.monotonic() - started
+            helper.close()
+            if conn:
+                try:
+                    conn.disconnect()
+                except Exception:
+                    pass
+        return found
+
+    def discover(self, targets: Iterable[str], on_found: Optional[Callable[[DiscoveredDevice], None]] = None) -> List[DiscoveredDevice]:
+        """Sweep CIDR ranges / hosts ("10.0.0.0/22", "10.0.4.7", "10.0.4.8:4371")."""
+        hosts: List[Tuple[str, int]] = []
+        for target in ([targets] if isinstance(targets, str) else targets):
+            if ':' in target and '/' not in target:
+                ip, port = target.rsplit(':', 1)
+                hosts.append((ip, int(port)))
+            else:
+                hosts.extend((ip, self.port) for ip in iter_hosts(target))
+        found: List[DiscoveredDevice] = []
+        if not hosts:
+            return found
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(hosts)))) as pool:
+            for dev in pool.map(lambda h: self.probe(*h), hosts):
+                if dev is None:
+                    continue
+                found.append(dev)
+                if on_found:
+                    on_found(dev)
+        return found
+
+    def register(self, found: Iterable[DiscoveredDevice], device_repo: DeviceRepository) -> Tuple[int, int]:
+        """Create the new terminals in the devices table, refresh the known ones.
+
+        Terminals are matched by serial number first, then by ip:port.
+        :return: (created, updated)
+        """
+        known = device_repo.list()
+        by_serial = dict((d.serialnumber, d) for d in known if d.serialnumber)
+        by_address = dict(((d.ip, d.port), d) for d in known)
+        created = updated = 0
+        for f in found:
+            dev = (f.serialnumber and by_serial.get(f.serialnumber)) or by_address.get((f.ip, f.port))
+            if dev is None:
+                dev = Device(id=None, name=f.device_name or f.serialnumber or f.ip, ip=f.ip, port=f.port,
+                             password=self.password)
+                created += 1
+            else:
+                updated += 1
+            dev.ip, dev.port = f.ip, f.port
+            for field in ('serialnumber', 'firmware', 'platform', 'device_name', 'mac'):
+                value = getattr(f, field)
+                if value:
+                    setattr(dev, field, value)
+            dev.last_seen = time.strftime('%Y-%m-%d %H:%M:%S')
+            if dev.id is None:
+                dev.id = device_repo.create(dev)
+                if dev.serialnumber:
+                    by_serial[dev.serialnumber] = dev
+                by_address[(dev.ip, dev.port)] = dev
+            else:
+                device_repo.update(dev)
+        return created, updated
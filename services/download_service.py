@@ -1,40 +1,89 @@
-from typing import List, Any
+import threading
+from typing import Any, Callable, Iterable, List, Optional
 from datetime import datetime
 import json
+from zk.attendance import AttendanceBatch
 from data.models import Attendance
 from data.repositories import AttendanceRepository
 from .zk_service import ZKService
 
 
+BATCH_SIZE = 5000
+
+
 class DownloadService:
     def __init__(self, zk: ZKService, attendance_repo: AttendanceRepository):
         self.zk = zk
         self.attendance_repo = attendance_repo
+        # SQLite allows one writer at a time; serialize batches coming from several downloads
+        self._write_lock = threading.Lock()
 
     def download_events(self, device_id: int, ip: str, port: int) -> int:
-        att = self.zk.get_attendance(ip, port)
-        return self._persist(device_id, att)
+        return self.persist_stream(device_id, self.zk.iter_attendance(ip, port))
 
     def persist_events(self, device_id: int, events_raw: List[Any]) -> int:
         return self._persist(device_id, events_raw)
 
+    def persist_stream(self, device_id: int, events: Iterable[Any], batch_size: int = BATCH_SIZE,
+                       on_batch: Optional[Callable[[int], None]] = None) -> int:
+        # Persist while the device is still sending, holding at most batch_size events
+        total = 0
+        batch: List[Any] = []
+        for a in events:
+            batch.append(a)
+            if len(batch) >= batch_size:
+                total += self._persist(device_id, batch)
+                batch = []
+                if on_batch:
+                    on_batch(total)
+        if batch:
+            total += self._persist(device_id, batch)
+            if on_batch:
+                on_batch(total)
+        return total
+
+    def persist_batches(self, device_id: int, batches: Iterable[AttendanceBatch], batch_size: int = BATCH_SIZE,
+                        on_batch: Optional[Callable[[int], None]] = None, skip: int = 0) -> int:
+        # persist_stream for ZK.iter_attendance_batches: columns go straight to
+        # executemany, no Attendance object / dataclass / json.dumps per event.
+        # The first `skip` events (already saved) are dropped
+        total = 0
+        pending = AttendanceBatch()
+        for batch in batches:
+            if skip:
+                dropped = min(skip, len(batch))
+                batch, skip = batch[dropped:], skip - dropped
+            pending.extend(batch)
+            if len(pending) >= batch_size:
+                total += self._persist_batch(device_id, pending)
+                pending = AttendanceBatch()
+                if on_batch:
+                    on_batch(total)
+        if len(pending):
+            total += self._persist_batch(device_id, pending)
+            if on_batch:
+                on_batch(total)
+        return total
+
+    def _persist_batch(self, device_id: int, batch: AttendanceBatch) -> int:
+        with self._write_lock:
+            self.attendance_repo.insert_batch(device_id, batch)
+        return len(batch)
+
     def _persist(self, device_id: int, att: List[Any]) -> int:
         events: List[Attendance] = []
         for a in att:
-            # a fields can vary; normalize
-            user_id = str(getattr(a, 'user_id', getattr(a, 'uid', ''))) if hasattr(a, '__dict__') else str(a.get('user_id') or a.get('uid') or '')
-            ts = getattr(a, 'timestamp', None) if hasattr(a, '__dict__') else a.get('timestamp')
-            status = int(getattr(a, 'status', 0)) if hasattr(a, '__dict__') else int(a.get('status', 0))
-            punch = int(getattr(a, 'punch', 0)) if hasattr(a, '__dict__') else int(a.get('punch', 0))
-            ts_text = str(ts)
+            # a fields can vary; normalize (zk Attendance objects or dicts)
+            raw = a if isinstance(a, dict) else a.json_pack()
             events.append(Attendance(
                 id=None,
                 device_id=device_id,
-                user_id=user_id,
-                timestamp=ts_text,
-                status=status,
-                punch=punch,
-                raw_json=json.dumps(getattr(a, '__dict__', a), default=str)
+                user_id=str(raw.get('user_id') or raw.get('uid') or ''),
+                timestamp=str(raw.get('timestamp')),
+                status=int(raw.get('status', 0)),
+                punch=int(raw.get('punch', 0)),
+                raw_json=json.dumps(raw, default=str)
             ))
-        self.attendance_repo.insert_many(device_id, events)
+        with self._write_lock:
+            self.attendance_repo.insert_many(device_id, events)
         return len(events)
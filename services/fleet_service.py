@@ -0,0 +1,185 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from data.models import Device
+from data.repositories import DeviceRepository
+from .download_service import DownloadService
+from .zk_service import ZKService
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+@dataclass
+class DeviceResult:
+    device_id: Optional[int]
+    name: str
+    ip: str
+    port: int
+    ok: bool = False
+    unchanged: bool = False  # skipped, same record count as the last download
+    events: int = 0
+    attempts: int = 0
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def rate(self) -> float:
+        return self.events / self.seconds if self.seconds > 0 else 0.0
+
+
+@dataclass
+class FleetSummary:
+    results: List[DeviceResult] = field(default_factory=list)
+    seconds: float = 0.0
+
+    @property
+    def events(self) -> int:
+        return sum(r.events for r in self.results)
+
+    @property
+    def failed(self) -> List[DeviceResult]:
+        return [r for r in self.results if not r.ok]
+
+    def format(self) -> str:
+        lines = [f"{'Dispositivo':<20} {'IP':<21} {'Estado':<11} {'Eventos':>8} {'Intentos':>8} {'Seg':>7} {'Ev/s':>8}"]
+        for r in self.results:
+            state = ('SIN CAMBIOS' if r.unchanged else 'OK') if r.ok else 'ERROR'
+            lines.append(f"{r.name[:20]:<20} {r.ip + ':' + str(r.port):<21} {state:<11} {r.events:>8} {r.attempts:>8} {r.seconds:>7.2f} {r.rate:>8.0f}")
+            if r.error:
+                lines.append(f"    {r.error}")
+        lines.append(f"Total: {self.events} eventos de {len(self.results) - len(self.failed)}/{len(self.results)} dispositivos en {self.seconds:.2f}s")
+        return "\n".join(lines)
+
+
+class FleetDownloader:
+    """Download the attendance log of many devices on a bounded thread pool.
+
+    Each device is downloaded on its pooled session (see ZKService) and its
+    events are streamed into the attendance table in batches while they
+    arrive. A failed attempt is retried after `backoff`, `2*backoff`, ...
+    seconds; `timeout` is the socket timeout of every reply and `deadline`
+    (optional) bounds a whole attempt: it is checked before every step and
+    after every batch, and new sessions wait at most that long for a reply.
+    With `skip_unchanged`, a device whose record count is the one saved
+    after its last download (see ZKService.poll_changes) is not transferred
+    again, and with `incremental` only the records added after the last
+    download are read (the whole log when it was cleared or rotated since).
+    """
+
+    def __init__(self, zk: ZKService, download_service: DownloadService, device_repo: DeviceRepository,
+                 max_workers: int = 4, timeout: int = 10, deadline: Optional[float] = None,
+                 retries: int = 2, backoff: float = 2.0, clear_after: bool = False,
+                 skip_unchanged: bool = True, incremental: bool = True):
+        self.zk = zk
+        self.download_service = download_service
+        self.device_repo = device_repo
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.clear_after = clear_after
+        self.skip_unchanged = skip_unchanged
+        self.incremental = incremental
+
+    def devices(self) -> List[Device]:
+        # Enabled devices, the ones downloaded longest ago first
+        devices = [d for d in self.device_repo.list() if d.enabled]
+        return sorted(devices, key=lambda d: d.last_download or '')
+
+    def _download_once(self, dev: Device, skip: int, saved: List[int],
+                       on_batch: Optional[Callable[[Device, int], None]]) -> bool:
+        """:return: False when the log was unchanged and not downloaded"""
+        started = time.monotonic()
+
+        def check(step: str) -> None:
+            if self.deadline is not None and time.monotonic() - started > self.deadline:
+                raise DeadlineExceeded(f"deadline of {self.deadline}s exceeded {step}")
+
+        def batch_done(n: int) -> None:
+            saved[0] = skip + n
+            if on_batch:
+                on_batch(dev, saved[0])
+            check(f"after {saved[0]} events")
+
+        timeout = self.timeout if self.deadline is None else min(self.timeout, self.deadline)
+        with self.zk.session(dev.ip, dev.port, int(dev.password or 0), timeout) as conn:
+            check("connecting")
+            conn.disable_device()
+            try:
+                check("disabling the device")
+                counts, changed = self.zk.poll_changes(dev.ip, dev.port, conn)
+                check("reading the counts")
+                # known from the session profile, device_repo.update() must not blank them
+                for name in ('serialnumber', 'firmware', 'platform', 'mac'):
+                    setattr(dev, name, getattr(dev, name) or conn.capabilities.get(name) or None)
+                if self.skip_unchanged and not skip and 'records' not in changed:
+                    return False
+                conn.get_user_index(check=False) # the users download before the first batch
+                check("reading the users")
+                # records already saved by a failed attempt are skipped, the log order is stable
+                position = counts['attlog'] if self.incremental else None
+                self.download_service.persist_batches(dev.id or 0, conn.iter_attendance_batches(position),
+                                                      on_batch=batch_done, skip=skip)
+                counts['attlog'] = conn.attendance_position
+                if self.clear_after:
+                    conn.clear_attendance()
+                    counts['records'], counts['attlog'] = 0, None
+                self.zk.save_counts(dev.ip, dev.port, counts, ['records', 'attlog'])
+                return True
+            finally:
+                conn.enable_device()
+
+    def download_device(self, dev: Device, on_batch: Optional[Callable[[Device, int], None]] = None) -> DeviceResult:
+        result = DeviceResult(device_id=dev.id, name=dev.name, ip=dev.ip, port=dev.port)
+        started = time.monotonic()
+        saved = [0]
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            result.attempts = attempt + 1
+            try:
+                result.unchanged = not self._download_once(dev, saved[0], saved, on_batch)
+                result.ok = True
+                result.error = None
+                break
+            except Exception as e:
+                result.error = str(e) or e.__class__.__name__
+        result.events = saved[0]
+        result.seconds = time.monotonic() - started
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if result.ok:
+            dev.last_download = now
+            dev.last_seen = now
+            dev.last_error = None
+        else:
+            dev.last_error = result.error
+        try:
+            self.device_repo.update(dev)
+        except Exception:
+            pass
+        return result
+
+    def run(self, devices: Optional[List[Device]] = None,
+            on_result: Optional[Callable[[DeviceResult], None]] = None,
+            on_batch: Optional[Callable[[Device, int], None]] = None) -> FleetSummary:
+        """Download every device, calling on_result as each one finishes."""
+        if devices is None:
+            devices = self.devices()
+        summary = FleetSummary()
+        started = time.monotonic()
+        if devices:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(devices)))) as pool:
+                futures = [pool.submit(self.download_device, dev, on_batch) for dev in devices]
+                for future in as_completed(futures):
+                    result = future.result()
+                    summary.results.append(result)
+                    if on_result:
+                        on_result(result)
+        summary.seconds = time.monotonic() - started
+        return summary
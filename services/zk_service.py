@@ -1,83 +1,366 @@
-from typing import Any, Dict, List
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 from datetime import datetime
 from zk import ZK
+from data.repositories import DeviceRepository
+
+
+@dataclass
+class _Session:
+    password: int = 0
+    timeout: int = 5
+    zk: Optional[ZK] = None
+    profile: Optional[dict] = None
+    in_use: bool = False
+    last_used: float = 0.0
+    last_checked: float = 0.0
 
 
 class ZKService:
-    def __init__(self):
-        self._connections: Dict[str, ZK] = {}
+    """Pool of device sessions.
+
+    Each terminal gets at most one session (devices accept a single client
+    well), reused across operations and handed to one thread at a time
+    through checkout()/checkin() or the session() context manager.
+    Sessions idle for more than `keepalive_interval` seconds are probed
+    with a single cheap command before reuse; sessions idle for more than
+    `idle_timeout` seconds are closed. At most `max_sessions` sessions are
+    kept open, the least recently used idle one is evicted to make room.
+    With a `device_repo`, new sessions are seeded with the capability profile
+    stored for the device (see ZK.get_capabilities) and refresh it, and the
+    users / fingers / records counts of the last download are kept to skip
+    transfers when nothing changed (see poll_changes). A buffered download
+    whose connection drops reconnects up to `reconnects` times and
+    continues from the first missing chunk.
+    """
+
+    COUNT_FIELDS = ('users', 'fingers', 'records')
+
+    def __init__(self, max_sessions: int = 8, idle_timeout: float = 300.0, keepalive_interval: float = 30.0,
+                 device_repo: Optional[DeviceRepository] = None, reconnects: int = 3):
+        self.max_sessions = max_sessions
+        self.reconnects = reconnects
+        self.device_repo = device_repo
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self._sessions: Dict[str, _Session] = {}
+        self._cond = threading.Condition()
 
     def _key(self, ip: str, port: int) -> str:
         return f"{ip}:{port}"
 
-    def connect(self, ip: str, port: int, password: int = 0, timeout: int = 5) -> None:
-        key = self._key(ip, port)
-        if key in self._connections:
-            return
-        zk = ZK(ip, port=port, password=password, ommit_ping=False, verbose=False, timeout=timeout)
-        zk.connect()
-        self._connections[key] = zk
-
-    def disconnect(self, ip: str, port: int) -> None:
-        key = self._key(ip, port)
-        zk = self._connections.pop(key, None)
+    # --- pool -------------------------------------------------------------
+    def _close(self, zk: Optional[ZK]) -> None:
         if zk:
             try:
                 zk.disconnect()
             except Exception:
                 pass
 
-    def is_connected(self, ip: str, port: int) -> bool:
-        return self._key(ip, port) in self._connections
+    def _alive(self, zk: ZK) -> bool:
+        try:
+            zk.get_time()
+            return True
+        except Exception:
+            return False
 
-    def get_device_info(self, ip: str, port: int) -> Dict[str, Any]:
+    def _load_profile(self, ip: str, port: int) -> Optional[dict]:
+        if self.device_repo is None:
+            return None
+        try:
+            return self.device_repo.get_capabilities(ip, port)
+        except Exception:
+            return None
+
+    def _save_profile(self, ip: str, port: int, zk: ZK, profile: Optional[dict]) -> Optional[dict]:
+        # Only the facts missing from the stored profile cost a round trip
+        if self.device_repo is None:
+            return profile
+        try:
+            current = zk.get_capabilities()
+            if current != profile:
+                self.device_repo.set_capabilities(ip, port, current)
+            return current
+        except Exception:
+            return profile
+
+    def _evict_idle_locked(self, now: float) -> List[ZK]:
+        """Drop idle sessions past idle_timeout, return them to be closed outside the lock."""
+        expired = [k for k, s in self._sessions.items()
+                   if not s.in_use and s.zk and now - s.last_used > self.idle_timeout]
+        return [self._sessions.pop(k).zk for k in expired]
+
+    def _evict_lru_locked(self) -> Optional[ZK]:
+        idle = [(s.last_used, k) for k, s in self._sessions.items() if not s.in_use and s.zk]
+        if not idle:
+            return None
+        _, key = min(idle)
+        return self._sessions.pop(key).zk
+
+    def checkout(self, ip: str, port: int, password: Optional[int] = None, timeout: Optional[int] = None,
+                 wait: Optional[float] = None) -> ZK:
+        """Borrow the session of a device, connecting it if needed.
+
+        Blocks while another thread uses the device (or while the pool is
+        full of busy sessions), up to `wait` seconds when given. A session
+        opened with another password is closed and logs in again with
+        `password`.
+        """
         key = self._key(ip, port)
-        zk = self._connections.get(key)
-        if not zk:
-            raise RuntimeError("Not connected")
-        info = {
-            'serial': zk.get_serialnumber(),
-            'name': zk.get_device_name(),
-            'fw': zk.get_firmware_version(),
-            'platform': zk.get_platform(),
-            'mac': zk.get_mac(),
-            'time': zk.get_time(),
-        }
+        deadline = None if wait is None else time.monotonic() + wait
+        to_close: List[ZK] = []
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                to_close.extend(self._evict_idle_locked(now))
+                session = self._sessions.get(key)
+                if session is None:
+                    if len(self._sessions) >= self.max_sessions:
+                        lru = self._evict_lru_locked()
+                        if lru is not None:
+                            to_close.append(lru)
+                    if len(self._sessions) < self.max_sessions:
+                        session = _Session(password=password or 0, timeout=timeout or 5)
+                        session.in_use = True
+                        self._sessions[key] = session
+                        break
+                elif not session.in_use:
+                    session.in_use = True
+                    if password is not None and password != session.password:
+                        # the device password changed: log in again with the new one
+                        session.password = password
+                        to_close.append(session.zk)
+                        session.zk = None
+                    break
+                remaining = None if deadline is None else deadline - now
+                if remaining is not None and remaining <= 0:
+                    for zk in to_close:
+                        self._close(zk)
+                    raise TimeoutError(f"{key} is busy")
+                self._cond.wait(remaining)
+        for zk in to_close:
+            self._close(zk)
+
+        # network I/O happens outside the lock, the session is reserved
+        try:
+            now = time.monotonic()
+            if session.zk is not None and now - session.last_checked > self.keepalive_interval:
+                if not self._alive(session.zk):
+                    self._close(session.zk)
+                    session.zk = None
+                else:
+                    session.last_checked = now
+            if session.zk is None:
+                profile = self._load_profile(ip, port)
+                zk = ZK(ip, port=port, password=session.password, ommit_ping=False, verbose=False,
+                        timeout=session.timeout, capabilities=profile, reconnects=self.reconnects)
+                zk.connect()
+                session.profile = self._save_profile(ip, port, zk, profile)
+                session.zk = zk
+                session.last_checked = time.monotonic()
+            return session.zk
+        except Exception:
+            with self._cond:
+                self._sessions.pop(key, None)
+                self._cond.notify_all()
+            raise
+
+    def checkin(self, ip: str, port: int, discard: bool = False) -> None:
+        """Give back a session borrowed with checkout(); discard closes it.
+
+        Facts learned while it was in use (the upload chunk size) are added
+        to the stored capability profile.
+        """
+        key = self._key(ip, port)
+        zk = None
+        with self._cond:
+            session = self._sessions.get(key)
+        if not discard and session is not None and session.zk is not None \
+                and session.zk.capabilities != session.profile:
+            # still reserved by the caller, the I/O happens outside the lock
+            session.profile = self._save_profile(ip, port, session.zk, session.profile)
+        with self._cond:
+            session = self._sessions.get(key)
+            if session is None:
+                return
+            if discard:
+                zk = self._sessions.pop(key).zk
+            else:
+                session.in_use = False
+                session.last_used = session.last_checked = time.monotonic()
+            self._cond.notify_all()
+        self._close(zk)
+
+    @contextmanager
+    def session(self, ip: str, port: int, password: Optional[int] = None, timeout: Optional[int] = None):
+        """Context manager around checkout()/checkin().
+
+        A session that raised (or whose generator was closed half way) is
+        discarded, the next checkout reconnects.
+        """
+        zk = self.checkout(ip, port, password, timeout)
+        ok = False
+        try:
+            yield zk
+            ok = True
+        finally:
+            self.checkin(ip, port, discard=not ok)
+
+    def reap_idle(self) -> int:
+        """Close idle sessions past idle_timeout, return how many were closed."""
+        with self._cond:
+            expired = self._evict_idle_locked(time.monotonic())
+            self._cond.notify_all()
+        for zk in expired:
+            self._close(zk)
+        return len(expired)
+
+    def close_all(self) -> None:
+        with self._cond:
+            idle = [k for k, s in self._sessions.items() if not s.in_use]
+            zks = [self._sessions.pop(k).zk for k in idle]
+            self._cond.notify_all()
+        for zk in zks:
+            self._close(zk)
+
+    # --- change detection -------------------------------------------------
+    def _load_counts(self, ip: str, port: int, serial: Optional[str]) -> Optional[dict]:
+        if self.device_repo is None:
+            return None
+        try:
+            return self.device_repo.get_counts(ip, port, serial)
+        except Exception:
+            return None
+
+    def poll_changes(self, ip: str, port: int, zk: ZK) -> Tuple[dict, List[str]]:
+        """Compare the counts of a connected terminal with the persisted ones.
+
+        Costs a CMD_GET_FREE_SIZES and a serial number read (live, not the
+        capability profile one, so a swapped terminal is not compared with
+        the counts of the previous one). Counts only move when rows are
+        added or deleted, an edited user keeps them equal.
+        :return: (current counts, names of the fields that changed: all of
+            them when nothing was saved for this serial number yet). the
+            counts carry the saved 'attlog' position (see ZK.iter_attendance)
+        """
         zk.read_sizes()
-        info.update({'users': zk.users, 'fingers': zk.fingers, 'records': zk.records})
-        return info
+        counts = {'serialnumber': zk.get_serialnumber(live=True) or None}
+        counts.update((f, getattr(zk, f)) for f in self.COUNT_FIELDS)
+        saved = self._load_counts(ip, port, counts['serialnumber'])
+        if not saved or saved.get('serialnumber') != counts['serialnumber']:
+            counts['attlog'] = None
+            return counts, list(self.COUNT_FIELDS)
+        counts['attlog'] = saved.get('attlog')
+        return counts, [f for f in self.COUNT_FIELDS if saved.get(f) != counts[f]]
 
-    def get_users(self, ip: str, port: int) -> List[dict]:
+    def save_counts(self, ip: str, port: int, counts: dict, fields: Iterable[str]) -> None:
+        """Persist the counts of the tables just downloaded (other fields keep their saved value)."""
+        if self.device_repo is None:
+            return
+        try:
+            saved = self._load_counts(ip, port, counts.get('serialnumber'))
+            if not saved or saved.get('serialnumber') != counts.get('serialnumber'):
+                saved = {'serialnumber': counts.get('serialnumber')}
+            saved.update((f, counts[f]) for f in fields)
+            self.device_repo.set_counts(ip, port, saved)
+        except Exception:
+            pass
+
+    def get_users_if_changed(self, ip: str, port: int) -> Optional[List[Any]]:
+        """get_users(), or None when the user count is the one of the last call."""
+        with self.session(ip, port) as zk:
+            counts, changed = self.poll_changes(ip, port, zk)
+            if 'users' not in changed:
+                return None
+            users = zk.get_users() or []
+            self.save_counts(ip, port, counts, ['users'])
+            return users
+
+    def get_attendance_if_changed(self, ip: str, port: int) -> Optional[List[Any]]:
+        """The records added since the last call, None when the record count is the same.
+
+        Only the tail of the log is transferred, unless it was cleared or rotated.
+        """
+        with self.session(ip, port) as zk:
+            counts, changed = self.poll_changes(ip, port, zk)
+            if 'records' not in changed:
+                return None
+            attendance = zk.get_attendance(counts['attlog']) or []
+            counts['attlog'] = zk.attendance_position
+            self.save_counts(ip, port, counts, ['records', 'attlog'])
+            return attendance
+
+    # --- public API -------------------------------------------------------
+    def connect(self, ip: str, port: int, password: int = 0, timeout: int = 5) -> None:
+        self.checkout(ip, port, password, timeout)
+        self.checkin(ip, port)
+
+    def disconnect(self, ip: str, port: int) -> None:
         key = self._key(ip, port)
-        zk = self._connections.get(key)
-        if not zk:
-            raise RuntimeError("Not connected")
-        return zk.get_users() or []
+        with self._cond:
+            session = self._sessions.get(key)
+            if session is None or session.in_use:
+                return
+            zk = self._sessions.pop(key).zk
+            self._cond.notify_all()
+        self._close(zk)
+
+    def is_connected(self, ip: str, port: int) -> bool:
+        with self._cond:
+            session = self._sessions.get(self._key(ip, port))
+            return bool(session and session.zk)
+
+    def get_device_info(self, ip: str, port: int) -> Dict[str, Any]:
+        with self.session(ip, port) as zk:
+            info = {
+                'serial': zk.get_serialnumber(),
+                'name': zk.get_device_name(),
+                'fw': zk.get_firmware_version(),
+                'platform': zk.get_platform(),
+                'mac': zk.get_mac(),
+                'time': zk.get_time(),
+            }
+            zk.read_sizes()
+            info.update({'users': zk.users, 'fingers': zk.fingers, 'records': zk.records})
+            return info
+
+    def get_users(self, ip: str, port: int) -> List[dict]:
+        with self.session(ip, port) as zk:
+            return zk.get_users() or []
 
     def get_attendance(self, ip: str, port: int) -> List[dict]:
-        key = self._key(ip, port)
-        zk = self._connections.get(key)
-        if not zk:
-            raise RuntimeError("Not connected")
-        return zk.get_attendance() or []
+        with self.session(ip, port) as zk:
+            return zk.get_attendance() or []
+
+    def iter_attendance(self, ip: str, port: int) -> Iterator[Any]:
+        # the session stays checked out until the generator is exhausted or closed
+        with self.session(ip, port) as zk:
+            for att in zk.iter_attendance():
+                yield att
+
+    def set_user(self, ip: str, port: int, **user: Any) -> None:
+        with self.session(ip, port) as zk:
+            zk.set_user(**user)
+
+    def set_users(self, ip: str, port: int, users: Iterable[Any]) -> int:
+        with self.session(ip, port) as zk:
+            return zk.set_users(users)
+
+    def delete_users(self, ip: str, port: int, users: Iterable[Any]) -> int:
+        with self.session(ip, port) as zk:
+            return zk.delete_users(users)
 
     def clear_attendance(self, ip: str, port: int) -> None:
-        key = self._key(ip, port)
-        zk = self._connections.get(key)
-        if not zk:
-            raise RuntimeError("Not connected")
-        zk.clear_attendance()
+        with self.session(ip, port) as zk:
+            zk.clear_attendance()
 
     def disable_device(self, ip: str, port: int) -> None:
-        key = self._key(ip, port)
-        zk = self._connections.get(key)
-        if not zk:
-            raise RuntimeError("Not connected")
-        zk.disable_device()
+        with self.session(ip, port) as zk:
+            zk.disable_device()
 
     def enable_device(self, ip: str, port: int) -> None:
-        key = self._key(ip, port)
-        zk = self._connections.get(key)
-        if not zk:
-            raise RuntimeError("Not connected")
-        zk.enable_device()
+        with self.session(ip, port) as zk:
+            zk.enable_device()
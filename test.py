@@ -6,6 +6,11 @@ import os
 import unittest
 import codecs
 import json
+import tempfile
+import time
+from collections import deque
+from datetime import datetime
+from struct import pack, unpack
 
 if sys.version_info[0] < 3:
     from mock import patch, Mock, MagicMock
@@ -15,11 +20,18 @@ else:
 mock_socket = MagicMock(name='zk.socket')
 sys.modules['zk.socket'] = mock_socket
 from zk import ZK, const
-from zk.base import ZK_helper
+from zk.base import ZK_helper, UserIndex, LinearUserIndex, iter_attendance_records, decode_attendance_batch, attendance_array, create_checksum, create_checksum_loop, numpy
 from zk.user import User
 from zk.finger import Finger
-from zk.attendance import Attendance
-from zk.exception import ZKErrorResponse, ZKNetworkError
+from zk.attendance import Attendance, AttendanceBatch
+from zk.exception import ZKErrorResponse, ZKNetworkError, ZKReplayError
+from zk.instrument import CommandStats, BUCKETS
+from zk.transport import Recorder, Replayer, iter_capture, RECV
+from benchmarks.emulator import ZKEmulator, make_attendance, make_user
+
+# python 2 resolves the socket imports of zk.base to the zk.socket mock
+# above, ZK can't reach the emulator there
+emulated = unittest.skipIf(sys.version_info[0] < 3, "zk.socket is mocked on python 2")
 
 try:
     unittest.TestCase.assertRaisesRegex
@@ -49,6 +61,69 @@ def dump(obj, nested_level=0, output=sys.stdout):
         print >> output, '%s%s' % (nested_level * spacing, obj)
 
 
+def tcp_packet(command, data=b'', session_id=0x45cf, reply_id=1):
+    """ build a tcp packet as sent by the device """
+    packet = pack('<4H', command, 0, session_id, reply_id) + data
+    return pack('<HHI', const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, len(packet)) + packet
+
+def sizes_data(users=0, fingers=0, records=0):
+    """ CMD_GET_FREE_SIZES payload """
+    fields = [0] * 20
+    fields[4] = users
+    fields[6] = fingers
+    fields[8] = records
+    return pack('20i', *fields)
+
+def encode_time(t):
+    """ zkemsdk.c - EncodeTime """
+    return (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) *
+        (24 * 60 * 60) + (t.hour * 60 + t.minute) * 60 + t.second
+    )
+
+def attendance_side_effect(records, record_size):
+    """ recv sequence for connect + get_attendance (no users) + disconnect """
+    payload = b''.join(records)
+    sizes = tcp_packet(const.CMD_ACK_OK, sizes_data(records=len(records)))
+    return [
+        tcp_packet(const.CMD_ACK_OK), # connect
+        sizes, # read_sizes (get_attendance)
+        sizes, # read_sizes (get_users)
+        tcp_packet(const.CMD_DATA, pack('<I', len(records) * record_size) + payload), # DATA directly
+        tcp_packet(const.CMD_ACK_OK), # exit
+    ]
+
+def udp_packet(command, data=b'', session_id=0x45cf, reply_id=1):
+    """ build an udp packet as sent by the device """
+    return pack('<4H', command, 0, session_id, reply_id) + data
+
+def udp_buffer_side_effect(payload, max_chunk=16 * 1024):
+    """ recv sequence for an udp read_with_buffer (prepare, chunks, free) """
+    packets = [udp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', len(payload)))]
+    for start in range(0, len(payload), max_chunk):
+        chunk = payload[start:start + max_chunk]
+        packets.append(udp_packet(const.CMD_PREPARE_DATA, pack('<I', len(chunk))))
+        packets.extend(udp_packet(const.CMD_DATA, chunk[i:i + 1024]) for i in range(0, len(chunk), 1024))
+        packets.append(udp_packet(const.CMD_ACK_OK))
+    packets.append(udp_packet(const.CMD_ACK_OK)) # free_data
+    return packets
+
+def recv_stream(socket, packets):
+    """ serve packets to recv (one per call) and recv_into (as a tcp stream, at most one packet per call) """
+    queue = deque(packets)
+    def recv(size):
+        return queue.popleft()
+    def recv_into(buffer, nbytes=0):
+        data = queue.popleft()
+        nbytes = nbytes or len(buffer)
+        if len(data) > nbytes:
+            queue.appendleft(data[nbytes:])
+            data = data[:nbytes]
+        buffer[:len(data)] = data
+        return len(data)
+    socket.return_value.recv.side_effect = recv
+    socket.return_value.recv_into.side_effect = recv_into
+
 class PYZKTest(unittest.TestCase):
     def setup(self):
 
@@ -139,10 +214,10 @@ class PYZKTest(unittest.TestCase):
         """ Basic unauth test """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        recv_stream(socket, [
             codecs.decode('5050827d08000000d5075bb2cf450000', 'hex'), # tcp CMD_UNAUTH
             codecs.decode('5050827d08000000d5075ab2cf450100', 'hex') # tcp CMD_UNAUTH
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201', password=12)
         self.assertRaisesRegex(ZKErrorResponse, "Unauthenticated", zk.connect)
@@ -154,12 +229,12 @@ class PYZKTest(unittest.TestCase):
         """ Basic auth test """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        recv_stream(socket, [
             codecs.decode('5050827d08000000d5075bb2cf450000', 'hex'), # tcp CMD_UNAUTH
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex') # tcp random CMD_ACK_OK TODO: generate proper sequenced response
 
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201', password=45)
         conn = zk.connect()
@@ -173,11 +248,11 @@ class PYZKTest(unittest.TestCase):
         """ can read sizes? """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        recv_stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d64000000d007a3159663130000000000000000000000000000000000070000000000000006000000000000005d020000000000000f0c0000000000000100000000000000b80b000010270000a0860100b20b00000927000043840100000000000000', 'hex'), #sizes
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'), # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201') # already tested
         conn = zk.connect()
@@ -198,13 +273,13 @@ class PYZKTest(unittest.TestCase):
         """ can get empty? """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        recv_stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d64000000d007a3159663130000000000000000000000000000000000070000000000000006000000000000005d020000000000000f0c0000000000000100000000000000b80b000010270000a0860100b20b00000927000043840100000000000000', 'hex'), #sizes
             codecs.decode('5050827d04020000dd05942c96631500f801000001000e0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003830380000000000000000000000000000000000000000000200000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003832310000000000000000000000000000000000000000000300000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833350000000000000000000000000000000000000000000400000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833310000000000000000000000000000000000000000000500000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833320000000000000000000000000000000000000000000600000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003836000000000000000000000000000000000000000000000c0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000383432000000000000000000000000000000000000000000','hex'), #DATA directly(not ok)
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'), # tcp random CMD_ACK_OK TODO: generate proper sequenced response
             #codecs.decode('5050827d08000000d00745b2cf451b00', 'hex')  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201' )
         conn = zk.connect()
@@ -233,7 +308,7 @@ class PYZKTest(unittest.TestCase):
         """ test case for K20 """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        recv_stream(socket, [
             codecs.decode('5050827d08000000d007d7d758200000','hex'), #ACK Ok
             codecs.decode('5050827d58000000d0074c49582013000000000000000000000000000000000002000000000000000000000000000000000000000000000007000000000000000000000000000000f4010000f401000050c30000f4010000f201000050c30000','hex'),#Sizes
             codecs.decode('5050827d9c000000dd053c87582015009000000001000000000000000000006366756c616e6f0000000000000000000000000000000000000000000000000000000000003130303030316c70000000000000000000000000000000000200000000000000000000726d656e67616e6f0000000000000000000000000000000000','hex'),#DATA112
@@ -242,7 +317,7 @@ class PYZKTest(unittest.TestCase):
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # CMD_ACK_OK for get_users TODO: generate proper sequenced response
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # CMD_ACK_OK for free_data TODO: generate proper sequenced response
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # CMD_ACK_OK for exit      TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201') #, verbose=True)
         conn = zk.connect()
@@ -270,7 +345,7 @@ class PYZKTest(unittest.TestCase):
         """ tst case for https://github.com/fananimi/pyzk/pull/18#issuecomment-406250746 """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        recv_stream(socket, [
             codecs.decode('5050827d09000000d007babb5c3c100009', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d58000000d007292c5c3c13000000000000000000000000000000000046000000000000004600000000000000990c0000000000001a010000000000000600000006000000f4010000f401000050c30000ae010000ae010000b7b60000', 'hex'), #sizes
             codecs.decode('5050827d15000000d007a7625c3c150000b4130000b4130000cdef2300','hex'), #PREPARE_BUFFER -> OK 5044
@@ -313,7 +388,7 @@ class PYZKTest(unittest.TestCase):
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # CMD_ACK_OK for get_users TODO: generate proper sequenced response
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # CMD_ACK_OK for free_data TODO: generate proper sequenced response
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # CMD_ACK_OK for exit      TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201') # , verbose=True)
         conn = zk.connect()
@@ -340,13 +415,13 @@ class PYZKTest(unittest.TestCase):
         """ can get empty? """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        recv_stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d15000000d007acf93064160000941d0000941d0000b400be00', 'hex'), # ack ok with size 7572
             codecs.decode('5050827d10000000dc05477830641700941d000000000100', 'hex'), #prepare data
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'), # tcp random CMD_ACK_OK TODO: generate proper sequenced response
             #codecs.decode('5050827d08000000d00745b2cf451b00', 'hex')  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201', verbose=True)
         conn = zk.connect()
@@ -371,7 +446,7 @@ class PYZKTest(unittest.TestCase):
         """ cchekc correct template 1 """
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        recv_stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d10000000dc055558d0983200dc040000f0030000', 'hex'), # tcp PREPARE_DATA 1244
             codecs.decode('5050827df8030000dd0500f4000032004d9853533231000004dbda0408050709ced000001cda69010000008406316adb0c0012062900d000aad221001600390caf001cdbb106240031007e033bdb3b00e9067700850083d42b004300c503f40043dbd6037b005000460ea7db5900910f90009f0012d5e7005c00970a5f006ddb', 'hex'), # DATA (tcp 1016, actual 112?)
@@ -389,7 +464,7 @@ class PYZKTest(unittest.TestCase):
             codecs.decode('07283b590300fef3f5f800da10f5494b031000071819061035084365650b14900834c0c1c4c104c1c5a302100e1134c1c01045c83c8806110e2185c22edd11082424fec006ff02cb052834c3c073c910d4eb965b3833ff0bc582cce18d876a051106f337f826c00410013d2b05c200ca003f4cfeff03d56454ccc101', 'hex'),  # raw 124
             codecs.decode('5050827d08000000d007fcf701003200', 'hex'),  # tcp CMD_ACK_OK
             #codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201', verbose=True)
         conn = zk.connect()
@@ -406,7 +481,7 @@ class PYZKTest(unittest.TestCase):
         """ cchekc correct template 1 fixed"""
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        recv_stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d10000000dc055558d0983200dc040000f0030000', 'hex'), # tcp PREPARE_DATA 1244
             codecs.decode('5050827df8030000dd0500f4000032004d9853533231000004dbda0408050709ced000001cda69010000008406316adb0c0012062900d000aad221001600390caf001cdbb106240031007e033bdb3b00e9067700850083d42b004300c503f40043dbd6037b005000460ea7db5900910f90009f0012d5e7005c00970a5f006ddb930fa1009a00560f86db9d00820e86006f007dd3f400ab00a60fcd01b7dbb00b4b00bd0079083adbc00045035d000600c1df7300cc0039049e00dddb380e8c00da00e30dd8dbdc00220e130027004dd9f500e3009d0a6a00e9db26090001ef00ea03c5dbf0002306', 'hex'), # DATA (tcp 1016, actual 112 +104
@@ -419,7 +494,7 @@ class PYZKTest(unittest.TestCase):
             codecs.decode('07283b590300fef3f5f800da10f5494b031000071819061035084365650b14900834c0c1c4c104c1c5a302100e1134c1c01045c83c8806110e2185c22edd11082424fec006ff02cb052834c3c073c910d4eb965b3833ff0bc582cce18d876a051106f337f826c00410013d2b05c200ca003f4cfeff03d56454ccc101', 'hex'),  # raw 124
             codecs.decode('5050827d08000000d007fcf701003200', 'hex'),  # tcp CMD_ACK_OK
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201') #, verbose=True)
         conn = zk.connect()
@@ -436,7 +511,7 @@ class PYZKTest(unittest.TestCase):
         """ cchekc correct template 2 fixed"""
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        recv_stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d10000000dc053b59d0983500f3030000f0030000', 'hex'), # tcp PREPARE_DATA 1011
             codecs.decode('5050827df8030000dd056855000035004ab153533231000003f2f10408050709ced000001bf36901000000831f256cf23e00740f4c008900f2f879005500fe0fe3005bf2d30a60005c00a00f32f26600580a2700ad00e3fd98007500800f000082f21a0f68008300300e5bf28d00570930004b00dafd4c009a00dd090900a8f2270f8600ad008a0b1ff2b000480f4400730040fc5400b800430f4400c6f2370ab100ca00f30ecbf2cb002f0f4a001300c7fdaa00e400b50c4300e6f2b706bf00ea00f90668f2f2002e0dad003000b7f7cf00f600350cbe0008f31f0dd0000c017101cbf20f019c01', 'hex'), # DATA (tcp 1016, actual 112 +104
@@ -449,7 +524,7 @@ class PYZKTest(unittest.TestCase):
 
             codecs.decode('5050827d08000000d007fcf701003200', 'hex'),  # tcp CMD_ACK_OK
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201')#, verbose=True)
         conn = zk.connect()
@@ -466,7 +541,7 @@ class PYZKTest(unittest.TestCase):
         """ check live_capture 12 bytes"""
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        recv_stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d64000000d007a3159663130000000000000000000000000000000000070000000000000006000000000000005d020000000000000f0c0000000000000100000000000000b80b000010270000a0860100b20b00000927000043840100000000000000', 'hex'), #sizes
             codecs.decode('5050827d04020000dd05942c96631500f801000001000e0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003830380000000000000000000000000000000000000000000200000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003832310000000000000000000000000000000000000000000300000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833350000000000000000000000000000000000000000000400000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833310000000000000000000000000000000000000000000500000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833320000000000000000000000000000000000000000000600000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003836000000000000000000000000000000000000000000000c0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000383432000000000000000000000000000000000000000000','hex'), #DATA directly(not ok)
@@ -476,7 +551,7 @@ class PYZKTest(unittest.TestCase):
             codecs.decode('5050827df8030000f401ae4301000000f19449000000120c07130906', 'hex'), # reg_event!
             codecs.decode('5050827d08000000d007fcf701003200', 'hex'),  # tcp CMD_ACK_OK
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201')#, verbose=True)
         conn = zk.connect()
@@ -493,7 +568,7 @@ class PYZKTest(unittest.TestCase):
         """ check live_capture 32 bytes"""
         helper.return_value.test_ping.return_value = True # ping simulated
         helper.return_value.test_tcp.return_value = 0 # helper tcp ok
-        socket.return_value.recv.side_effect = [
+        recv_stream(socket, [
             codecs.decode('5050827d08000000d0075fb2cf450100', 'hex'), # tcp CMD_ACK_OK
             codecs.decode('5050827d64000000d007a3159663130000000000000000000000000000000000070000000000000006000000000000005d020000000000000f0c0000000000000100000000000000b80b000010270000a0860100b20b00000927000043840100000000000000', 'hex'), #sizes
             codecs.decode('5050827d04020000dd05942c96631500f801000001000e0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003830380000000000000000000000000000000000000000000200000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003832310000000000000000000000000000000000000000000300000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833350000000000000000000000000000000000000000000400000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833310000000000000000000000000000000000000000000500000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003833320000000000000000000000000000000000000000000600000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000003836000000000000000000000000000000000000000000000c0000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000383432000000000000000000000000000000000000000000','hex'), #DATA directly(not ok)
@@ -503,7 +578,7 @@ class PYZKTest(unittest.TestCase):
             codecs.decode('5050827df8030000f401ae43010000003131343030363400000000000000000000000000000000000f00120b1d0c3703', 'hex'), # reg_event!
             codecs.decode('5050827d08000000d007fcf701003200', 'hex'),  # tcp CMD_ACK_OK
             codecs.decode('5050827d08000000d00745b2cf451b00', 'hex'),  # tcp random CMD_ACK_OK TODO: generate proper sequenced response
-        ]
+        ])
         #begin
         zk = ZK('192.168.1.201')#, verbose=True)
         conn = zk.connect()
@@ -514,6 +589,527 @@ class PYZKTest(unittest.TestCase):
             self.assertEqual(att.user_id, "1140064", "incorrect user_id %s" % att.user_id)
         conn.disconnect()
 
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_attendance_8(self, helper, socket):
+        """ decode 8 bytes attendance records """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        t1 = datetime(2024, 1, 31, 8, 15, 42)
+        t2 = datetime(2024, 2, 1, 17, 0, 5)
+        recv_stream(socket, attendance_side_effect([
+            pack('<HBIB', 7, 1, encode_time(t1), 0),
+            pack('<HBIB', 65000, 0, encode_time(t2), 1),
+        ], 8))
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        att = conn.get_attendance()
+        conn.disconnect()
+        self.assertEqual(len(att), 2, "incorrect size %s" % len(att))
+        self.assertEqual((att[0].user_id, att[0].uid, att[0].timestamp, att[0].status, att[0].punch), ('7', 7, t1, 1, 0))
+        self.assertEqual((att[1].user_id, att[1].uid, att[1].timestamp, att[1].status, att[1].punch), ('65000', 65000, t2, 0, 1))
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_attendance_16(self, helper, socket):
+        """ decode 16 bytes attendance records """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        t1 = datetime(2023, 12, 31, 23, 59, 59)
+        recv_stream(socket, attendance_side_effect([
+            pack('<IIBB2sI', 4822257, encode_time(t1), 1, 15, b'', 0),
+            pack('<IIBB2sI', 12, encode_time(t1), 0, 0, b'', 0),
+        ], 16))
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        att = conn.get_attendance()
+        conn.disconnect()
+        self.assertEqual(len(att), 2, "incorrect size %s" % len(att))
+        self.assertEqual((att[0].user_id, att[0].uid, att[0].timestamp, att[0].status, att[0].punch), ('4822257', '4822257', t1, 1, 15))
+        self.assertEqual((att[1].user_id, att[1].uid), ('12', '12'))
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_get_attendance_40(self, helper, socket):
+        """ decode 40 bytes attendance records """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        t1 = datetime(2025, 6, 1, 7, 30, 0)
+        recv_stream(socket, attendance_side_effect([
+            pack('<H24sBIB8s', 3, b'1140064', 1, encode_time(t1), 4, b''),
+            pack('<H24sBIB8s', 4, b'A-77', 0, encode_time(t1), 0, b''),
+            pack('<H24sBIB8s', 5, b'9', 0, encode_time(t1), 1, b''),
+        ], 40))
+        zk = ZK('192.168.1.201')
+        conn = zk.connect()
+        att = conn.get_attendance()
+        conn.disconnect()
+        self.assertEqual(len(att), 3, "incorrect size %s" % len(att))
+        self.assertEqual((att[0].user_id, att[0].uid, att[0].timestamp, att[0].status, att[0].punch), ('1140064', 3, t1, 1, 4))
+        self.assertEqual([a.user_id for a in att], ['1140064', 'A-77', '9'])
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_udp_iter_attendance_chunked(self, helper, socket):
+        """ records split between chunks are decoded once, in order """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        t = datetime(2024, 5, 6, 7, 8, 9)
+        count = 2100 # 16804 bytes, record 2047 is split between the chunks
+        records = [pack('<HBIB', uid % 60000 + 1, uid % 4, encode_time(t), 0) for uid in range(count)]
+        sizes = udp_packet(const.CMD_ACK_OK, sizes_data(records=count))
+        recv_stream(socket, [udp_packet(const.CMD_ACK_OK), sizes, sizes] + \
+            udp_buffer_side_effect(pack('<I', count * 8) + b''.join(records)) + [udp_packet(const.CMD_ACK_OK)])
+        zk = ZK('192.168.1.201', force_udp=True)
+        conn = zk.connect()
+        att = list(conn.iter_attendance())
+        conn.disconnect()
+        self.assertEqual(len(att), count, "incorrect size %s" % len(att))
+        self.assertEqual([a.uid for a in att], [uid % 60000 + 1 for uid in range(count)])
+        self.assertEqual(att[2047].status, 2047 % 4)
+        self.assertEqual(att[-1].timestamp, t)
+
+    @patch('zk.base.socket')
+    @patch('zk.base.ZK_helper')
+    def test_tcp_read_with_buffer_fragmented(self, helper, socket):
+        """ a chunk split anywhere (headers and ACK included) lands in place in the buffer """
+        helper.return_value.test_ping.return_value = True # ping simulated
+        helper.return_value.test_tcp.return_value = 0 # helper tcp ok
+        payload = bytes(bytearray(range(200)))
+        stream = tcp_packet(const.CMD_PREPARE_DATA, pack('<II', len(payload), 0)) + \
+            tcp_packet(const.CMD_DATA, payload) + tcp_packet(const.CMD_ACK_OK)
+        recv_stream(socket, [
+            tcp_packet(const.CMD_ACK_OK), # connect
+            tcp_packet(const.CMD_ACK_OK, b'\x00' + pack('<I', len(payload))), # prepare buffer
+            stream[:30], stream[30:37], stream[37:150], stream[150:-5], stream[-5:], # read buffer, split ACK
+            tcp_packet(const.CMD_ACK_OK), # free data
+        ])
+        conn = ZK('192.168.1.201').connect()
+        data, size = conn.read_with_buffer(const.CMD_ATTLOG_RRQ)
+        self.assertEqual((data, size), (payload, 200))
+        self.assertIsInstance(data, bytearray) # filled in place, never joined
+        self.assertEqual(unpack('<H', socket.return_value.send.call_args[0][0][8:10])[0], const.CMD_FREE_DATA) # then freed
+
+    @emulated
+    def test_pipelined_read_with_buffer(self):
+        """ pipelined chunk reads return the same log, or fall back to serial reads """
+        fields = lambda att: [(a.user_id, a.uid, a.timestamp, a.status, a.punch) for a in att]
+        for pipelining in (True, False):
+            # replies held back, so the chunk requests always overlap them
+            with ZKEmulator(records=20000, pipelining=pipelining, latency=0.02) as device:
+                conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+                serial = conn.get_attendance()
+                conn.disconnect()
+                conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True, read_pipeline=4).connect()
+                pipelined = conn.get_attendance()
+                self.assertEqual(conn.read_pipeline, 4 if pipelining else 0, "pipeline fallback")
+                conn.disconnect()
+            self.assertEqual(len(serial), 20000)
+            self.assertEqual(fields(pipelined), fields(serial))
+
+    @emulated
+    def test_upload_usertemplates(self):
+        """ HR_save_usertemplates uploads the same buffer with any chunk size or pipeline """
+        usertemplates = [(User(uid, 'User %i' % uid, 0, user_id=str(uid)),
+                          [Finger(uid, fid, 1, bytes(bytearray([uid % 256, fid])) * 300) for fid in range(2)])
+                         for uid in range(1, 201)]
+        table = []
+        fpack = []
+        for user, fingers in usertemplates:
+            for finger in fingers:
+                table.append(pack('<bHbI', 2, user.uid, 0x10 + finger.fid, len(b''.join(fpack))))
+                fpack.append(finger.repack_only())
+        table = b''.join(table)
+        fpack = b''.join(fpack)
+        for options, force_udp, chunk, pipeline in (({}, False, 0xFFc0, 4), ({'pipelining': False, 'latency': 0.05}, False, 0xFFc0, 0),
+                                                    ({'max_chunk': 1024}, False, 1024, 4), ({}, True, 1024, 4)):
+            with ZKEmulator(**options) as device:
+                conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True, force_udp=force_udp, write_pipeline=4).connect()
+                conn.HR_save_usertemplates(usertemplates)
+                self.assertEqual((conn.write_chunk, conn.write_pipeline), (chunk, pipeline), "upload fallback %s" % options)
+                repack = User.repack29 if conn.user_packet_size == 28 else User.repack73
+                conn.disconnect()
+            upack = b''.join(repack(user) for user, _fingers in usertemplates)
+            expected = pack('III', len(upack), len(table), len(fpack)) + upack + table + fpack
+            self.assertEqual(device.usertemps, [expected])
+
+    @emulated
+    def test_upload_chunk_probe(self):
+        """ the upload chunk size is probed once with probe_timeout, and kept in the capability profile """
+        usertemplates = [(User(uid, 'User %i' % uid, 0, user_id=str(uid)), [Finger(uid, 0, 1, b'\x01' * 600)])
+                         for uid in range(1, 201)]
+        for oversize in ('error', 'drop', 'reset'):
+            with ZKEmulator(max_chunk=1024, oversize=oversize) as device:
+                conn = ZK('127.0.0.1', port=device.port, timeout=30, ommit_ping=True, probe_timeout=0.5).connect()
+                started = time.time()
+                conn.HR_save_usertemplates(usertemplates)
+                self.assertLess(time.time() - started, 5, "probe timeout %s" % oversize)
+                self.assertEqual((conn.write_chunk, device.oversized), (1024, 1), oversize)
+                self.assertEqual(len(device.usertemps), 1)
+                profile = conn.get_capabilities()
+                self.assertEqual(profile['write_chunk'], 1024)
+                conn.disconnect()
+                conn = ZK('127.0.0.1', port=device.port, timeout=30, ommit_ping=True, capabilities=profile).connect()
+                conn.HR_save_usertemplates(usertemplates)
+                self.assertEqual((conn.write_chunk, device.oversized, len(device.usertemps)), (1024, 1, 2), "not probed again")
+                conn.disconnect()
+        with ZKEmulator() as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+            conn.HR_save_usertemplates(usertemplates)
+            self.assertEqual((conn.write_chunk, conn.get_capabilities()['write_chunk']), (0xFFc0, 0xFFc0))
+            conn.disconnect()
+
+    @emulated
+    def test_set_users_single_refresh(self):
+        """ set_users / delete_users write a batch with one CMD_REFRESHDATA """
+        user_fields = lambda users: [(u.uid, u.name, u.user_id) for u in users]
+        few = [User(uid, 'Few %i' % uid, 0, user_id=str(uid)) for uid in range(3, 13)]
+        many = [User(uid, 'Many %i' % uid, 0, user_id=str(uid)) for uid in range(100, 350)]
+        for options, pipeline in (({}, 4), ({'pipelining': False, 'latency': 0.02}, 0)):
+            with ZKEmulator(users=5, templates=2, **options) as device:
+                conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True, write_pipeline=4).connect()
+                conn.get_users()
+                self.assertEqual(conn.set_users(few + [User(None, 'Next', 0)]), 11)
+                self.assertEqual(device.refreshes, 1)
+                self.assertEqual(conn.write_pipeline, pipeline, "pipeline fallback")
+                self.assertEqual(conn.next_uid, 14)
+                for user in many:
+                    device.templates[(user.uid, 0)] = b'enrolled %i' % user.uid
+                self.assertEqual(conn.set_users(many), 250)
+                self.assertEqual(device.usertemps, [], "no _CMD_SAVE_USERTEMPS unless asked")
+                self.assertEqual(len(device.templates), 10 + 250, "enrolled fingerprints kept")
+                self.assertEqual(conn.set_users(many[:10], high_rate=True), 10)
+                self.assertEqual(len(device.usertemps), 1, "uploaded with _CMD_SAVE_USERTEMPS")
+                self.assertEqual(len(device.templates), 10 + 240, "the buffer replaced their templates")
+                self.assertEqual(conn.delete_users([1, 2] + few[:2]), 4)
+                self.assertEqual(device.refreshes, 4)
+                users = conn.get_users()
+                conn.disconnect()
+            expected = user_fields(few[2:]) + [(13, 'Next', '13')] + user_fields(many)
+            self.assertEqual(user_fields(users), expected)
+
+    @emulated
+    def test_user_index_cache(self):
+        """ single-user operations use the session user index instead of the user table """
+        with ZKEmulator(records=10, users=50) as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+            conn.get_users()
+            requests = device.requests
+            conn.delete_user(user_id='7')
+            self.assertEqual(device.requests - requests, 3, "read sizes, delete, refresh")
+            conn.set_user(uid=60, name='New', user_id='A60')
+            requests = device.requests
+            self.assertEqual(conn.get_user_index().find_user_id('A60').uid, 60)
+            self.assertIsNone(conn.get_user_index().find_uid(7))
+            self.assertEqual(device.requests - requests, 2, "only read sizes")
+            self.assertEqual(len(conn.get_attendance()), 10)
+            device.save_user(make_user(70)) # written by someone else
+            self.assertEqual(conn.get_user_index().find_user_id('70').uid, 70)
+            conn.disconnect()
+
+    @emulated
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_numpy_arrays(self):
+        """ get_attendance_array / get_users_array hold the same values as the object lists """
+        with ZKEmulator(records=5000, users=50) as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+            users = conn.get_users_array()
+            self.assertEqual([tuple(u.tolist()) for u in users],
+                             [(u.uid, u.name, u.privilege, u.password, u.group_id, u.user_id, u.card) for u in conn.get_users()])
+            att = conn.get_attendance_array()
+            self.assertEqual(att.dtype.names, ('uid', 'user_id', 'timestamp', 'status', 'punch'))
+            self.assertEqual([(int(a['uid']), str(a['user_id']), a['timestamp'].astype(datetime), int(a['status'])) for a in att],
+                             [(a.uid, a.user_id, a.timestamp, a.status) for a in conn.get_attendance()])
+            conn.disconnect()
+        users = [User(1, 'one', 0, user_id='100'), User(7, 'seven', 0, user_id='7')]
+        t = encode_time(datetime(2024, 2, 29, 23, 59, 59))
+        cases = [
+            (16, b''.join(pack('<IIBB2sI', user_id, t, 0, 1, b'', 0) for user_id in (100, 7, 555))),
+            (40, b''.join(pack('<H24sBIB8s', uid, b'100\x00x', 1, t, 4, b'') for uid in (1, 2))),
+        ]
+        for record_size, data in cases:
+            att = attendance_array(data, record_size, UserIndex(users))
+            self.assertEqual([(int(a['uid']), str(a['user_id']), a['timestamp'].astype(datetime), int(a['punch'])) for a in att],
+                             [(int(a.uid), a.user_id, a.timestamp, a.punch) for a in iter_attendance_records(data, record_size, UserIndex(users))])
+
+    @emulated
+    def test_attendance_tail(self):
+        """ a saved attendance_position reads only the new records, the whole log after a rotation """
+        fields = lambda att: [(a.uid, a.timestamp, a.status) for a in att]
+        with ZKEmulator(records=150000) as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+            full = conn.get_attendance()
+            position = conn.attendance_position
+            self.assertEqual(position['index'], 150000)
+            self.assertFalse(conn.attendance_incremental)
+            device.records, device.attendance = 150200, make_attendance(150200)
+            requests = device.requests
+            new = conn.get_attendance(position)
+            self.assertTrue(conn.attendance_incremental)
+            self.assertEqual(device.requests - requests, 5, "sizes, prepare, anchor record, one chunk, free")
+            self.assertEqual(len(new), 200)
+            self.assertEqual(conn.get_attendance(conn.attendance_position), [])
+            self.assertEqual(fields(conn.get_attendance()), fields(full) + fields(new))
+            # oldest records dropped by a full terminal
+            device.attendance = make_attendance(150200, start=datetime(2024, 1, 2))
+            rotated = conn.get_attendance(position)
+            self.assertFalse(conn.attendance_incremental)
+            self.assertEqual(len(rotated), 150200)
+            device.records, device.attendance = 10, make_attendance(10)
+            self.assertEqual(len(conn.get_attendance(position)), 10, "log cleared")
+            conn.disconnect()
+        with ZKEmulator(records=100000) as device: # rotation with chunk requests in flight
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True, read_pipeline=4).connect()
+            conn.get_attendance()
+            position = conn.attendance_position
+            device.records, device.attendance = 200000, make_attendance(200000, start=datetime(2024, 1, 2))
+            started = time.time()
+            rotated = conn.get_attendance(position)
+            self.assertFalse(conn.attendance_incremental)
+            self.assertEqual(fields(rotated), fields(conn.get_attendance()))
+            self.assertEqual(len(rotated), 200000)
+            self.assertEqual(conn.read_pipeline, 4, "pipeline still on")
+            self.assertLess(time.time() - started, 5, "no reply timeout")
+            conn.disconnect()
+        with ZKEmulator(records=20, inline=1024) as device: # small log sent with the prepare reply
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+            full = conn.get_attendance()
+            position = conn.attendance_position
+            self.assertEqual((len(full), position['index']), (20, 20))
+            self.assertEqual(conn.get_attendance(position), [])
+            self.assertTrue(conn.attendance_incremental)
+            device.records, device.attendance = 25, make_attendance(25)
+            new = sum((list(batch) for batch in conn.iter_attendance_batches(position)), [])
+            self.assertTrue(conn.attendance_incremental)
+            self.assertEqual(fields(new), fields(conn.get_attendance())[20:])
+            device.attendance = make_attendance(25, start=datetime(2024, 1, 2))
+            self.assertEqual(len(conn.get_attendance(position)), 25, "rotated")
+            self.assertFalse(conn.attendance_incremental)
+            conn.disconnect()
+
+    @emulated
+    def test_buffered_read_resumes(self):
+        """ a buffered read survives dropped connections and resumes from its spool file """
+        fields = lambda att: [(a.uid, a.timestamp, a.status) for a in att]
+        with ZKEmulator(records=100000) as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+            expected = fields(conn.get_attendance())
+            raw, size = conn.read_with_buffer(const.CMD_ATTLOG_RRQ)
+            conn.disconnect()
+            self.assertEqual(size, 800004) # 13 chunks
+            device.drop_after, device.drops = 3, 3
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True, reconnects=3).connect()
+            self.assertEqual(fields(conn.get_attendance()), expected)
+            conn.disconnect()
+            self.assertEqual(device.drops, 0)
+            with tempfile.TemporaryDirectory() as tmp:
+                spool = os.path.join(tmp, 'attlog.spool')
+                device.chunk_reads, device.drop_after, device.drops = 0, 5, 1
+                conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+                self.assertRaises(Exception, conn.read_with_buffer, const.CMD_ATTLOG_RRQ, spool=spool)
+                self.assertRaises(Exception, conn.disconnect) # dropped, the socket is closed anyway
+                self.assertEqual(os.path.getsize(spool), 4 * 0xFFc0 + 18)
+                conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+                self.assertEqual(conn.read_with_buffer(const.CMD_ATTLOG_RRQ, spool=spool), (raw, size))
+                conn.disconnect()
+                self.assertEqual(device.chunk_reads, 5 + 9, "only the missing chunks read again")
+                self.assertFalse(os.path.exists(spool))
+                conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+                self.assertEqual(conn.read_with_buffer(const.CMD_ATTLOG_RRQ, spool=spool), (raw, size))
+                conn.disconnect()
+                self.assertFalse(os.path.exists(spool))
+
+    @emulated
+    def test_emulator_layouts(self):
+        """ the emulator answers every user / attendance layout over TCP and UDP, with authentication """
+        for force_udp in (False, True):
+            for record_size, user_packet_size in ((8, 28), (16, 72), (40, 72)):
+                with ZKEmulator(records=3000, users=20, templates=2, template_size=1500, password=1234,
+                                record_size=record_size, user_packet_size=user_packet_size) as device:
+                    self.assertRaisesRegex(ZKErrorResponse, "Unauthenticated",
+                                           ZK('127.0.0.1', port=device.port, timeout=2, ommit_ping=True,
+                                              force_udp=force_udp, password=1).connect)
+                    conn = ZK('127.0.0.1', port=device.port, timeout=2, ommit_ping=True,
+                              force_udp=force_udp, password=1234).connect()
+                    case = "udp %s, %i/%i bytes" % (force_udp, record_size, user_packet_size)
+                    self.assertEqual([u.user_id for u in conn.get_users()], [str(uid) for uid in range(1, 21)], case)
+                    attendance = conn.get_attendance()
+                    self.assertEqual(len(attendance), 3000, case)
+                    self.assertEqual((attendance[5].user_id, attendance[5].timestamp), ('6', datetime(2024, 1, 1, 8, 5)), case)
+                    self.assertEqual(len(conn.get_templates()), 40, case)
+                    self.assertEqual(conn.get_user_template(3, 1).template, device.templates[(3, 1)], case)
+                    conn.disconnect()
+
+    @emulated
+    def test_emulator_live_events_and_loss(self):
+        """ CMD_REG_EVENT live events from the emulator, and downloads over a lossy UDP link """
+        with ZKEmulator(users=5) as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=2, ommit_ping=True).connect()
+            live = conn.live_capture(new_timeout=0.2)
+            self.assertIsNone(next(live)) # registered, nothing yet
+            self.assertEqual(device.punch(3, status=1, timestamp=datetime(2024, 5, 6, 7, 8, 9)), 1)
+            event = next(event for event in live if event is not None)
+            self.assertEqual((event.user_id, event.uid, event.timestamp, event.status), ('3', 3, datetime(2024, 5, 6, 7, 8, 9), 1))
+            conn.end_live_capture = True
+            self.assertEqual(list(live), []) # event unregistered
+            self.assertEqual(len(conn.get_attendance()), 1)
+            conn.disconnect()
+        with ZKEmulator(records=20000, loss=0.01, seed=1) as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=0.3, ommit_ping=True, force_udp=True, reconnects=10).connect()
+            expected = list(iter_attendance_records(device.attendance[4:], 8, UserIndex()))
+            self.assertEqual([(a.uid, a.timestamp) for a in conn.get_attendance()], [(a.uid, a.timestamp) for a in expected])
+            self.assertTrue(device.lost)
+            try:
+                conn.disconnect()
+            except ZKNetworkError:
+                pass # the CMD_EXIT reply lost too, the socket is closed anyway
+
+    @emulated
+    def test_instrument_command_stats(self):
+        """ CommandStats aggregates commands, chunks, retries and decodes of a session """
+        stats = CommandStats()
+        with ZKEmulator(records=20000, users=50, latency=0.001, pipelining=False) as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True, read_pipeline=4, instrument=stats).connect()
+            self.assertEqual(len(conn.get_attendance()), 20000)
+            self.assertEqual(len(conn.get_users()), 50)
+            conn.disconnect()
+        summary = stats.summary()
+        connect = summary['commands']['CMD_CONNECT']
+        self.assertEqual((connect['count'], connect['errors'], connect['sent']), (1, 0, 16))
+        self.assertEqual(sum(connect['histogram']), 1)
+        self.assertEqual(len(connect['histogram']), len(BUCKETS) + 1)
+        self.assertEqual(summary['retries'], {'CMD_READ_BUFFER/pipeline': 1}) # the emulator rejects pipelining
+        self.assertEqual(summary['decodes']['attendance']['records'], 20000)
+        self.assertEqual(summary['decodes']['users']['records'], 100) # get_attendance reads the users too
+        self.assertTrue(summary['chunks']['CMD_READ_BUFFER']['bytes'] >= 20000 * 8)
+        self.assertIn('CMD_PREPARE_BUFFER', stats.format())
+        stats.reset()
+        self.assertEqual(stats.summary()['commands'], {})
+
+    @emulated
+    def test_record_replay_transport(self):
+        """ a recorded session replays the same records with no device, tcp and udp """
+        fields = lambda att: [(a.user_id, a.uid, a.timestamp, a.status, a.punch) for a in att]
+        tmp = tempfile.mkdtemp()
+        for force_udp, path in ((False, os.path.join(tmp, 'tcp.zkcap')), (True, os.path.join(tmp, 'udp.zkcap.gz'))):
+            with ZKEmulator(records=30000, users=20) as device:
+                with Recorder(path) as recorder:
+                    conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True, force_udp=force_udp, transport=recorder).connect()
+                    attendance = conn.get_attendance()
+                    conn.disconnect()
+            self.assertTrue(any(event[0] == RECV for event in iter_capture(path)))
+            conn = ZK('127.0.0.1', port=1, timeout=5, transport=Replayer(path)).connect() # nothing listening
+            self.assertEqual(conn.tcp, not force_udp)
+            self.assertEqual(fields(conn.get_attendance()), fields(attendance))
+            conn = ZK('127.0.0.1', port=1, timeout=5, transport=Replayer(path)).connect()
+            self.assertRaises(ZKNetworkError, conn.get_firmware_version) # not what was recorded
+        with open(os.path.join(tmp, 'bad.zkcap'), 'wb') as f:
+            f.write(b'nope')
+        self.assertRaises(ZKReplayError, Replayer, os.path.join(tmp, 'bad.zkcap'))
+
+    @emulated
+    def test_probe_socket_becomes_session(self):
+        """ the in-process probe connection is reused by the session, udp sessions are pinged over udp """
+        with ZKEmulator(records=5) as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, probe_timeout=0.5).connect()
+            self.assertEqual(len(conn.get_attendance()), 5)
+            conn.disconnect()
+            self.assertEqual(device.connections, 1)
+        closed = ZKEmulator()
+        closed.stop() # nobody listening there
+        helper = ZK_helper('127.0.0.1', closed.port, timeout=0.5)
+        self.assertTrue(helper.test_ping(), "refused means the host is up")
+        self.assertNotEqual(helper.test_tcp(), 0)
+        self.assertIsNone(helper.take_socket())
+        self.assertFalse(helper.test_ping(udp=True), "no terminal answers on udp")
+        with ZKEmulator(records=5, tcp=False, password=1234) as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, password=1234, probe_timeout=0.5, force_udp=True).connect()
+            self.assertEqual(len(conn.get_attendance()), 5)
+            conn.disconnect()
+            self.assertEqual(device.connections, 2, "udp ping, session")
+            self.assertRaises(ZKErrorResponse, ZK('127.0.0.1', port=device.port, timeout=5, password=1, probe_timeout=0.5, force_udp=True).connect)
+
+    @emulated
+    def test_capabilities_skip_probes(self):
+        """ a saved capability profile skips the probes until the firmware changes """
+        with ZKEmulator() as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+            profile = conn.get_capabilities()
+            conn.disconnect()
+            self.assertEqual(profile['serialnumber'], 'EMU0000001')
+            self.assertEqual((profile['tcp'], profile['user_packet_size'], profile['pin_width']), (True, 72, 9))
+            self.assertEqual((profile['extend_fmt'], profile['user_extend_fmt']), (0, 1))
+            requests = device.requests
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True, capabilities=profile).connect()
+            self.assertEqual(conn.get_user_extend_fmt(), 1)
+            self.assertEqual(conn.get_capabilities(), profile)
+            self.assertEqual(device.requests - requests, 3, "CMD_CONNECT, the firmware and serial number checks only")
+            conn.disconnect()
+            device.firmware = b'Ver 6.70 Emulator'
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True, capabilities=profile).connect()
+            requests = device.requests
+            self.assertEqual(conn.get_capabilities()['firmware'], 'Ver 6.70 Emulator')
+            self.assertEqual(device.requests - requests, 5, "profile dropped, probed again")
+            conn.disconnect()
+        with ZKEmulator(serialnumber='BBB') as device: # same firmware, another terminal at the address
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True, capabilities=dict(profile, platform='OLD')).connect()
+            self.assertEqual(conn.get_serialnumber(), 'BBB')
+            self.assertEqual(conn.get_platform(), 'ZEM560_TFT', "profile dropped")
+            conn.disconnect()
+
+    def test_checksum_matches_loop(self):
+        """ create_checksum gives the same bytes as the zkemsdk.c loop """
+        cases = [b'', b'\x00', b'\x01', b'\xff\xff', b'\xff\xff\xff', b'\xff\xff\x01\x00', b'\x00' * 1032]
+        cases += [bytes(bytearray((i * 7 + n) % 256 for i in range(n))) for n in (7, 8, 9, 1024, 1025, 4097)]
+        cases += [b'\xff' * n for n in (2, 4, 1024, 1025)]
+        for data in cases:
+            self.assertEqual(create_checksum(data), create_checksum_loop(tuple(bytearray(data))), len(data))
+        self.assertEqual(create_checksum(tuple(bytearray(b'abc'))), create_checksum(b'abc'))
+
+    def test_user_index_matches_linear_scan(self):
+        """ indexed user resolution gives the same records as the linear scan """
+        users = [
+            User(1, 'one', 0, user_id='100'),
+            User(2, 'two', 0, user_id='200'),
+            User(2, 'dup uid', 0, user_id='201'),
+            User(3, 'dup user_id', 0, user_id='100'),
+            User(7, 'seven', 0, user_id='7'),
+        ]
+        t = encode_time(datetime(2024, 3, 4, 5, 6, 7))
+        cases = [
+            (8, b''.join(pack('<HBIB', uid, 1, t, 0) for uid in (1, 2, 3, 7, 9, 100))),
+            (16, b''.join(pack('<IIBB2sI', user_id, t, 0, 1, b'', 0) for user_id in (100, 200, 201, 7, 2, 555))),
+        ]
+        fields = lambda att: [(a.user_id, a.uid, a.timestamp, a.status, a.punch) for a in att]
+        for record_size, data in cases:
+            indexed = list(iter_attendance_records(data, record_size, UserIndex(users)))
+            linear = list(iter_attendance_records(data, record_size, LinearUserIndex(users)))
+            self.assertEqual(fields(indexed), fields(linear), "record size %i differs" % record_size)
+        self.assertEqual(UserIndex(users).find_uid(2).name, 'two')
+        self.assertEqual(UserIndex(users).find_user_id('100').name, 'one')
+
+    def test_attendance_batch(self):
+        """ AttendanceBatch holds the same records as the Attendance objects and saves them in bulk """
+        users = [User(1, 'one', 0, user_id='100'), User(7, 'seven', 0, user_id='7')]
+        times = [encode_time(datetime(2024, 2, 29, 23, 59, 59)), encode_time(datetime(2024, 3, 1, 0, 0, 1))]
+        cases = [
+            (8, b''.join(pack('<HBIB', uid, 1, t, 2) for uid in (1, 7, 9) for t in times)),
+            (16, b''.join(pack('<IIBB2sI', user_id, t, 0, 1, b'', 0) for user_id in (100, 7, 555) for t in times)),
+            (40, b''.join(pack('<H24sBIB8s', uid, b'100', 1, t, 4, b'') for uid in (1, 2) for t in times)),
+        ]
+        fields = lambda att: [(a.user_id, int(a.uid), a.timestamp, a.status, a.punch) for a in att]
+        for record_size, data in cases:
+            objects = list(iter_attendance_records(data, record_size, UserIndex(users)))
+            batch = decode_attendance_batch(data, record_size, UserIndex(users))
+            self.assertEqual(fields(batch), fields(objects), "record size %i differs" % record_size)
+            self.assertEqual(fields(batch[2:]), fields(objects[2:]))
+        self.assertEqual(batch.nbytes, 18 * len(batch))
+        merged = AttendanceBatch()
+        merged.add(Attendance('7', datetime(2024, 1, 1, 8, 0, 0), 1, 0, 7))
+        merged.extend(batch)
+        self.assertEqual(merged.user_ids, ['7', '100'])
+        self.assertEqual(fields(merged[1:]), fields(objects))
+        self.assertEqual(list(merged.iter_times())[:2], ['2024-01-01 08:00:00', '2024-02-29 23:59:59'])
+
     def test_finger_pack(self):
         fing = Finger(26,1,1,codecs.decode("0123456789ABCDEF", "hex"))
         expected = {
@@ -549,5 +1145,25 @@ class PYZKTest(unittest.TestCase):
         sut = Finger.json_unpack(json.loads(packed_str))
         self.assertEqual(sut.uid, data['uid'])
 
+    def test_slotted_models(self):
+        """ User, Finger and Attendance have no __dict__, compare and pack on their fields """
+        template = codecs.decode("0123456789ABCDEF0011223344556677", "hex")
+        fing = Finger(26, 1, 1, template)
+        user = User(1, 'one', 0, '123', '2', '100', 55)
+        attendance = Attendance('100', datetime(2024, 1, 2, 3, 4, 5), 1, 0, 1)
+        for obj in (fing, user, attendance):
+            self.assertFalse(hasattr(obj, '__dict__'), obj)
+        self.assertEqual(fing.mark, b"0123456789abcdef...0011223344556677")
+        self.assertEqual(fing, Finger.json_unpack(fing.json_pack()))
+        self.assertNotEqual(fing, Finger(26, 2, 1, template))
+        self.assertNotEqual(fing, None)
+        self.assertEqual(User.json_unpack(user.json_pack()).json_pack(), user.json_pack())
+        self.assertEqual(user.repack73(), User.json_unpack(json.loads(json.dumps(user.json_pack()))).repack73())
+        self.assertEqual(json.loads(json.dumps(attendance.json_pack(), default=str))['timestamp'], '2024-01-02 03:04:05')
+
+if sys.version_info >= (3, 7): # asyncio.run, the application layer
+    from test_aio import AsyncZKTest
+    from test_services import ServicesTest
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+tests of zk.aio.AsyncZK against the emulator, python 3.7+ (test.py runs
+them on those versions)
+"""
+import sys
+import unittest
+
+if sys.version_info < (3, 7):
+    raise unittest.SkipTest("zk.aio needs python 3.7")
+
+import asyncio
+
+from zk import ZK, const
+from zk.aio import AsyncZK
+from zk.base import create_header, create_tcp_top
+from benchmarks.emulator import ZKEmulator
+
+
+class AsyncZKTest(unittest.TestCase):
+
+    def test_async_client_matches_sync(self):
+        """ AsyncZK decodes the same users and attendance as ZK """
+        fields = lambda att: [(a.user_id, a.uid, a.timestamp, a.status, a.punch) for a in att]
+        user_fields = lambda users: [(u.uid, u.name, u.privilege, u.password, u.group_id, u.user_id, u.card) for u in users]
+
+        async def download(port):
+            async with AsyncZK('127.0.0.1', port=port, timeout=5) as conn:
+                users = await conn.get_users()
+                attendance = await conn.get_attendance()
+                await conn.set_user(name='new')
+                return users, attendance, conn.next_uid
+
+        with ZKEmulator(records=3000, users=1000) as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+            users = conn.get_users()
+            attendance = conn.get_attendance()
+            conn.disconnect()
+            ausers, aattendance, next_uid = asyncio.run(download(device.port))
+        self.assertEqual(len(ausers), 1000)
+        self.assertEqual(user_fields(ausers), user_fields(users))
+        self.assertEqual(len(aattendance), 3000)
+        self.assertEqual(fields(aattendance), fields(attendance))
+        self.assertEqual(next_uid, 1002)
+
+    def test_async_recv_timeout_keeps_stream(self):
+        """ a receive timing out (live_capture polling) never leaves a packet half read """
+        first = create_tcp_top(create_header(const.CMD_REG_EVENT, b'first', 0, 0))
+        second = create_tcp_top(create_header(const.CMD_REG_EVENT, b'second', 0, 1))
+
+        async def receive():
+            conn = AsyncZK('127.0.0.1', timeout=5)
+            reader = conn._AsyncZK__reader = asyncio.StreamReader()
+            recv = conn._AsyncZK__recv_packet
+            received = []
+            reader.feed_data(first[:5]) # part of the top header
+            with self.assertRaises(asyncio.TimeoutError):
+                await recv(0.05)
+            reader.feed_data(first[5:12]) # the rest of the header, payload late
+            asyncio.get_running_loop().call_later(0.2, reader.feed_data, first[12:] + second)
+            received.append(await recv(0.05))
+            received.append(await recv(0.05))
+            return [(header[0], data) for header, data in received]
+
+        self.assertEqual(asyncio.run(receive()), [(const.CMD_REG_EVENT, b'first'), (const.CMD_REG_EVENT, b'second')])
+
+    def test_async_udp_fallback(self):
+        """ AsyncZK uses UDP when the terminal refuses TCP connections """
+        async def download(port):
+            async with AsyncZK('127.0.0.1', port=port, timeout=5) as conn:
+                return conn.tcp, len(await conn.get_users()), len(await conn.get_attendance())
+
+        with ZKEmulator(records=30, users=5, tcp=False) as device:
+            self.assertEqual(asyncio.run(download(device.port)), (False, 5, 30))
+
+
+if __name__ == '__main__':
+    unittest.main()
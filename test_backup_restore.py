@@ -100,7 +100,7 @@ try:
             'version':'1.00jut',
             'serial': serialnumber,
             'fp_version': fp_version,
-            'users': [u.__dict__ for u in users],
+            'users': [u.json_pack() for u in users],
             'templates':[t.json_pack() for t in templates]
             }
         json.dump(data, output, indent=1)
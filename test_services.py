@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+tests of the application layer (services, data, benchmarks suite) against
+the emulator, python 3.7+ (test.py runs them on those versions)
+"""
+import sys
+import unittest
+
+if sys.version_info < (3, 7):
+    raise unittest.SkipTest("the application layer needs python 3.7")
+
+import json
+import sqlite3
+import tempfile
+from datetime import datetime
+from struct import pack
+from unittest.mock import patch, Mock
+
+from zk import ZK
+from zk.attendance import Attendance, AttendanceBatch
+from zk.finger import Finger
+from zk.user import User
+from zk.base import UserIndex, decode_attendance_batch
+from benchmarks.emulator import ZKEmulator, make_attendance
+from services.zk_service import ZKService
+from services.download_service import DownloadService
+from services.fleet_service import FleetDownloader
+from services.discovery_service import DiscoveryService, iter_hosts
+from data.db import init_db
+from data.models import Device
+from data.repositories import AttendanceRepository, DeviceRepository
+
+
+def encode_time(t):
+    """ zkemsdk.c - EncodeTime """
+    return (
+        ((t.year % 100) * 12 * 31 + ((t.month - 1) * 31) + t.day - 1) *
+        (24 * 60 * 60) + (t.hour * 60 + t.minute) * 60 + t.second
+    )
+
+
+class ServicesTest(unittest.TestCase):
+
+    def test_benchmark_suite_compare(self):
+        """ the benchmark suite reports rows/s per case and flags the slower ones """
+        from benchmarks import suite
+        current = {'results': suite.bench_downloads([300], 0, 1)}
+        self.assertEqual(sorted(current['results']), ['download.attendance.300', 'download.templates.300', 'download.users.300'])
+        self.assertEqual(current['results']['download.users.300']['rows'], 300)
+        baseline = {'results': dict((case, dict(entry, rate=entry['rate'] * 2)) for case, entry in current['results'].items())}
+        baseline['results']['download.attendance.300']['rate'] /= 2.05 # within the threshold
+        baseline['results']['gone'] = {'rate': 1}
+        regressed = [row[0] for row in suite.compare(baseline, current, 0.1) if row[4]]
+        self.assertEqual(regressed, ['download.templates.300', 'download.users.300'])
+
+    @patch('zk.base.ZK_helper')
+    def test_service_pool_reuses_sessions(self, helper):
+        """ ZKService keeps one session per device and reconnects after errors """
+        helper.return_value.test_ping.return_value = True
+        helper.return_value.test_tcp.return_value = 0
+        with ZKEmulator(records=10, users=5) as device:
+            service = ZKService(max_sessions=1, keepalive_interval=0)
+            users = service.get_users('127.0.0.1', device.port)
+            first = service.checkout('127.0.0.1', device.port)
+            service.checkin('127.0.0.1', device.port)
+            self.assertEqual(len(users), 5)
+            self.assertEqual(len(service.get_attendance('127.0.0.1', device.port)), 10)
+            self.assertIs(service.checkout('127.0.0.1', device.port), first, "session reused")
+            self.assertRaises(TimeoutError, service.checkout, '127.0.0.1', device.port, wait=0.1)
+            service.checkin('127.0.0.1', device.port, discard=True)
+            self.assertFalse(service.is_connected('127.0.0.1', device.port))
+            with service.session('127.0.0.1', device.port) as conn:
+                self.assertIsNot(conn, first, "discarded session reconnected")
+            with ZKEmulator() as other:
+                service.connect('127.0.0.1', other.port) # max_sessions=1 evicts the idle one
+                self.assertFalse(service.is_connected('127.0.0.1', device.port))
+                self.assertTrue(service.is_connected('127.0.0.1', other.port))
+                service.close_all()
+            self.assertFalse(service.is_connected('127.0.0.1', other.port))
+
+    @patch('zk.base.ZK_helper')
+    def test_service_password_change(self, helper):
+        """ a pooled session logs in again when the device password changed """
+        helper.return_value.test_ping.return_value = True
+        helper.return_value.test_tcp.return_value = 0
+        with ZKEmulator(records=10) as device:
+            service = ZKService(keepalive_interval=0)
+            first = service.checkout('127.0.0.1', device.port, password=0)
+            service.checkin('127.0.0.1', device.port)
+            device.password = 1234
+            self.assertIs(service.checkout('127.0.0.1', device.port, password=0), first)
+            service.checkin('127.0.0.1', device.port)
+            second = service.checkout('127.0.0.1', device.port, password=1234)
+            self.assertIsNot(second, first)
+            self.assertEqual(device.connections, 2)
+            self.assertEqual(len(second.get_attendance()), 10)
+            service.checkin('127.0.0.1', device.port)
+            self.assertTrue(service.is_connected('127.0.0.1', device.port))
+            service.close_all()
+
+    @patch('zk.base.ZK_helper')
+    def test_service_saves_upload_chunk(self, helper):
+        """ the upload chunk size probed by a session is stored for the next ones """
+        helper.return_value.test_ping.return_value = True
+        helper.return_value.test_tcp.return_value = 0
+        usertemplates = [(User(uid, 'User %i' % uid, 0, user_id=str(uid)), [Finger(uid, 0, 1, b'\x01' * 600)])
+                         for uid in range(1, 101)]
+        with tempfile.NamedTemporaryFile(suffix='.db') as db, patch('data.db._DB_PATH', db.name):
+            init_db()
+            device_repo = DeviceRepository()
+            with ZKEmulator(max_chunk=1024) as device:
+                device_repo.create(Device(id=None, name='one', ip='127.0.0.1', port=device.port))
+                service = ZKService(device_repo=device_repo)
+                with service.session('127.0.0.1', device.port) as conn:
+                    conn.HR_save_usertemplates(usertemplates)
+                self.assertEqual(device_repo.get_capabilities('127.0.0.1', device.port)['write_chunk'], 1024)
+                service.close_all()
+                with service.session('127.0.0.1', device.port) as conn:
+                    conn.HR_save_usertemplates(usertemplates)
+                service.close_all()
+            self.assertEqual((device.oversized, len(device.usertemps)), (1, 2), "probed once")
+
+    @patch('zk.base.ZK_helper')
+    def test_fleet_download(self, helper):
+        """ FleetDownloader saves every reachable device and retries the others """
+        helper.return_value.test_ping.return_value = True
+        helper.return_value.test_tcp.return_value = 0
+        with ZKEmulator(records=12000, users=10) as one, ZKEmulator(records=300) as two:
+            closed = ZKEmulator()
+            closed.stop() # nobody listening there
+            devices = [
+                Device(id=1, name='one', ip='127.0.0.1', port=one.port),
+                Device(id=2, name='two', ip='127.0.0.1', port=two.port),
+                Device(id=3, name='off', ip='127.0.0.1', port=closed.port),
+            ]
+            device_repo = Mock()
+            device_repo.list.return_value = devices
+            att_repo = Mock()
+            zk = ZKService()
+            fleet = FleetDownloader(zk, DownloadService(zk, att_repo), device_repo,
+                                    max_workers=2, timeout=2, retries=1, backoff=0)
+            finished = []
+            summary = fleet.run(on_result=finished.append)
+            zk.close_all()
+        results = dict((r.device_id, r) for r in summary.results)
+        self.assertEqual(len(finished), 3)
+        self.assertEqual(summary.events, 12300)
+        self.assertEqual((results[1].ok, results[1].events), (True, 12000))
+        self.assertEqual((results[2].ok, results[2].events), (True, 300))
+        self.assertEqual((results[3].ok, results[3].attempts), (False, 2))
+        saved = sum(len(c[0][1]) for c in att_repo.insert_batch.call_args_list)
+        self.assertEqual(saved, 12300)
+        self.assertEqual(device_repo.update.call_count, 3)
+        self.assertTrue(devices[0].last_download)
+        self.assertTrue(devices[2].last_error)
+
+    @patch('zk.base.ZK_helper')
+    def test_fleet_deadline_before_first_batch(self, helper):
+        """ the deadline also cuts a terminal that is slow before sending any record """
+        helper.return_value.test_ping.return_value = True
+        helper.return_value.test_tcp.return_value = 0
+        with ZKEmulator(users=5, latency=0.2) as device:
+            zk = ZKService()
+            fleet = FleetDownloader(zk, DownloadService(zk, Mock()), Mock(), timeout=2, deadline=0.5, retries=0)
+            result = fleet.download_device(Device(id=1, name='slow', ip='127.0.0.1', port=device.port))
+            zk.close_all()
+        self.assertFalse(result.ok)
+        self.assertIn('deadline of 0.5s exceeded', result.error)
+
+    @patch('zk.base.ZK_helper')
+    def test_fleet_skips_unchanged_devices(self, helper):
+        """ the record count saved per serial number skips downloads of unchanged logs """
+        helper.return_value.test_ping.return_value = True
+        helper.return_value.test_tcp.return_value = 0
+        with tempfile.NamedTemporaryFile(suffix='.db') as db, patch('data.db._DB_PATH', db.name):
+            init_db()
+            device_repo = DeviceRepository()
+            with ZKEmulator(records=300) as device:
+                device_repo.create(Device(id=None, name='one', ip='127.0.0.1', port=device.port))
+                att_repo = Mock()
+                zk = ZKService(device_repo=device_repo)
+                fleet = FleetDownloader(zk, DownloadService(zk, att_repo), device_repo, timeout=2)
+                first = fleet.run().results[0]
+                second = fleet.run().results[0]
+                device.records, device.attendance = 310, make_attendance(310)
+                third = fleet.run().results[0]
+                zk.close_all()
+            counts = device_repo.get_counts('127.0.0.1', device.port, 'EMU0000001')
+            saved = device_repo.list()[0]
+        self.assertEqual((first.ok, first.unchanged, first.events), (True, False, 300))
+        self.assertEqual((second.ok, second.unchanged, second.events), (True, True, 0))
+        self.assertEqual((third.ok, third.unchanged, third.events), (True, False, 10), "only the new records")
+        self.assertEqual((counts['serialnumber'], counts['records'], counts['attlog']['index']), ('EMU0000001', 310, 310))
+        self.assertEqual((saved.serialnumber, saved.firmware), ('EMU0000001', 'Ver 6.60 Emulator'))
+
+    def test_discovery(self):
+        """ DiscoveryService identifies every terminal and registers it once """
+        with ZKEmulator(serialnumber='A001') as one, ZKEmulator(serialnumber='B002') as two:
+            closed = ZKEmulator()
+            closed.stop() # nobody listening there
+            discovery = DiscoveryService(timeout=0.5)
+            targets = ['127.0.0.1:%i' % port for port in (one.port, two.port, closed.port)]
+            found = sorted(discovery.discover(targets), key=lambda d: d.serialnumber)
+            self.assertEqual(one.connections, 1)
+        self.assertEqual([(d.port, d.transport, d.serialnumber) for d in found], [(one.port, 'tcp', 'A001'), (two.port, 'tcp', 'B002')])
+        self.assertEqual(found[0].firmware, 'Ver 6.60 Emulator')
+        self.assertEqual(found[0].platform, 'ZEM560_TFT')
+        device_repo = Mock()
+        device_repo.list.return_value = [Device(id=7, name='known', ip='10.0.0.9', port=4370, serialnumber='B002')]
+        device_repo.create.return_value = 8
+        self.assertEqual(discovery.register(found, device_repo), (1, 1))
+        self.assertEqual(device_repo.create.call_args[0][0].serialnumber, 'A001')
+        self.assertEqual(device_repo.update.call_args[0][0].port, two.port)
+        self.assertEqual(len(iter_hosts('10.0.0.0/22')), 1022)
+
+    def test_poll_changes_live_serial(self):
+        """ poll_changes reads the serial number live: a swapped terminal is not matched with the old counts """
+        device_repo = Mock()
+        service = ZKService(device_repo=device_repo)
+        with ZKEmulator(records=10, serialnumber='BBB') as device:
+            conn = ZK('127.0.0.1', port=device.port, timeout=5, ommit_ping=True).connect()
+            conn.capabilities['serialnumber'] = 'AAA' # stale profile value
+            device_repo.get_counts.return_value = {'serialnumber': 'AAA', 'users': 0, 'fingers': 0, 'records': 10}
+            counts, changed = service.poll_changes('127.0.0.1', device.port, conn)
+            self.assertEqual(counts['serialnumber'], 'BBB')
+            self.assertIn('records', changed)
+            device_repo.get_counts.return_value = dict(device_repo.get_counts.return_value, serialnumber='BBB')
+            self.assertNotIn('records', service.poll_changes('127.0.0.1', device.port, conn)[1])
+            conn.disconnect()
+
+    def test_attendance_batch_insert(self):
+        """ AttendanceRepository saves an AttendanceBatch in bulk """
+        data = b''.join(pack('<H24sBIB8s', uid, b'100', 1, t, 4, b'') for uid in (1, 2)
+                        for t in (encode_time(datetime(2024, 2, 29, 23, 59, 59)), encode_time(datetime(2024, 3, 1, 0, 0, 1))))
+        batch = AttendanceBatch()
+        batch.add(Attendance('7', datetime(2024, 1, 1, 8, 0, 0), 1, 0, 7))
+        batch.extend(decode_attendance_batch(data, 40, UserIndex([])))
+        with tempfile.NamedTemporaryFile(suffix='.db') as db, patch('data.db._DB_PATH', db.name):
+            init_db()
+            self.assertEqual(AttendanceRepository().insert_batch(3, batch), 5)
+            rows = sqlite3.connect(db.name).execute(
+                "SELECT device_id,user_id,timestamp,status,punch,raw_json FROM attendance ORDER BY id").fetchall()
+        self.assertEqual(rows[0][:5], (3, '7', '2024-01-01 08:00:00', 1, 0))
+        self.assertEqual(json.loads(rows[1][5]), {'uid': 1, 'user_id': '100', 'timestamp': '2024-02-29 23:59:59',
+                                                  'status': 1, 'punch': 4})
+
+
+if __name__ == '__main__':
+    unittest.main()
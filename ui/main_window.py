@@ -7,6 +7,7 @@ from ui.views.system_card import SystemCard
 from ui.views.access_card import AccessCard
 from widgets.message_toast import MessageToast
 from services.zk_service import ZKService
+from data.repositories import DeviceRepository
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -14,7 +15,7 @@ class MainWindow(QtWidgets.QMainWindow):
         super().__init__()
         self.setWindowTitle('ZKTeco Manager')
         self.resize(1100, 720)
-        self.zk = ZKService()
+        self.zk = ZKService(device_repo=DeviceRepository())
 
         # Menu / modules
         self.tabs = QtWidgets.QTabWidget()
@@ -73,6 +74,18 @@ class MainWindow(QtWidgets.QMainWindow):
         except Exception:
             pass
 
+        # Close pooled device sessions left idle
+        self._reap_timer = QtCore.QTimer(self)
+        self._reap_timer.timeout.connect(self.zk.reap_idle)
+        self._reap_timer.start(60 * 1000)
+
+    def closeEvent(self, e):
+        try:
+            self.zk.close_all()
+        except Exception:
+            pass
+        super().closeEvent(e)
+
     def resizeEvent(self, e):
         super().resizeEvent(e)
         self.toast._reposition()
@@ -191,7 +191,7 @@ class EmployeeCard(QtWidgets.QWidget):
                 employees = []
                 for u in users or []:
                     # u may be a dict or zk.User
-                    if hasattr(u, '__dict__'):
+                    if not isinstance(u, dict):
                         uid = getattr(u, 'uid', None)
                         name = getattr(u, 'name', '') or ''
                         privilege = getattr(u, 'privilege', None)
@@ -7,9 +7,11 @@ from data.models import Device
 from data.repositories import DeviceRepository, SettingsRepository
 from dialogs.device_dialog import DeviceDialog
 from workers.base_worker import run_in_thread
-from workers.zk_workers import ConnectWorker, DisconnectWorker, DownloadEventsWorker
+from workers.zk_workers import ConnectWorker, DisconnectWorker, DownloadEventsWorker, FleetDownloadWorker, DiscoverWorker
 from services.zk_service import ZKService
 from services.download_service import DownloadService
+from services.fleet_service import FleetDownloader
+from services.discovery_service import DiscoveryService
 from data.repositories import AttendanceRepository
 from widgets.message_toast import MessageToast
 from config import CONFIG
@@ -47,7 +49,8 @@ class TerminalCard(QtWidgets.QWidget):
         self.btn_disconnect = QtWidgets.QPushButton('Desconectar')
         self.btn_download = QtWidgets.QPushButton('Descargar eventos')
         self.btn_sync = QtWidgets.QPushButton('Sincronizar datos')
-        for b in (self.btn_add, self.btn_edit, self.btn_connect, self.btn_disconnect, self.btn_download, self.btn_sync):
+        self.btn_discover = QtWidgets.QPushButton('Buscar en red')
+        for b in (self.btn_add, self.btn_edit, self.btn_connect, self.btn_disconnect, self.btn_download, self.btn_sync, self.btn_discover):
             toolbar.addWidget(b)
         toolbar.addStretch(1)
         layout.addLayout(toolbar)
@@ -69,6 +72,7 @@ class TerminalCard(QtWidgets.QWidget):
         self.btn_disconnect.clicked.connect(self._on_disconnect)
         self.btn_download.clicked.connect(self._on_download)
         self.btn_sync.clicked.connect(self._on_sync)
+        self.btn_discover.clicked.connect(self._on_discover)
         # Programación y opciones se configuran en Sistema
 
         # Timer para programación diaria
@@ -186,6 +190,22 @@ class TerminalCard(QtWidgets.QWidget):
         # Pass password=0 for now (DeviceDialog has no password); extend if needed
         self._start_download_for_device(dev, clear_after)
 
+    def _on_discover(self):
+        last = self.set_repo.get('discovery_cidr') or '192.168.1.0/24'
+        text, ok = QtWidgets.QInputDialog.getText(self, 'Buscar en red', 'Rangos (CIDR o IP, separados por coma):', text=last)
+        if not ok or not text.strip():
+            return
+        targets = [t.strip() for t in text.split(',') if t.strip()]
+        self.set_repo.set('discovery_cidr', text.strip())
+        worker = DiscoverWorker(DiscoveryService(), targets, self.dev_repo)
+        worker.log.connect(self._log)
+        def on_result(found):
+            self._load_table()
+            self._log(f"Búsqueda terminada: {len(found)} terminales")
+        worker.result.connect(on_result)
+        worker.error.connect(lambda e: self._log(e, 'ERROR'))
+        run_in_thread(worker)
+
     def _on_sync(self):
         self._log('Sincronización aún no implementada (placeholder)')
 
@@ -231,18 +251,28 @@ class TerminalCard(QtWidgets.QWidget):
         self._setup_daily_timer()
         self._log('Descarga programada iniciada')
         clear_after = (self.set_repo.get('delete_after_download') == '1')
-        for dev in self.dev_repo.list():
-            if not dev.enabled:
-                continue
-            self._start_download_for_device(dev, clear_after)
+        fleet = FleetDownloader(self.zk, self.download_service, self.dev_repo,
+                                max_workers=CONFIG.fleet_max_workers, retries=CONFIG.fleet_retries,
+                                clear_after=clear_after)
+        worker = FleetDownloadWorker(fleet)
+        worker.log.connect(self._log)
+        def on_result(summary):
+            self._load_table()
+            self._log(f"Descarga programada: {summary.events} eventos, {len(summary.failed)} dispositivos con error en {summary.seconds:.1f}s",
+                      'WARN' if summary.failed else 'INFO')
+            if summary.events:
+                self.events_saved.emit(summary.events)
+        worker.result.connect(on_result)
+        worker.error.connect(lambda e: self._log(e, 'ERROR'))
+        run_in_thread(worker)
 
     def _start_download_for_device(self, dev: Device, clear_after: bool):
-        worker = DownloadEventsWorker(self.zk, dev.ip, dev.port, clear_after=clear_after, password=int(dev.password or 0))
+        worker = DownloadEventsWorker(self.zk, dev.ip, dev.port, clear_after=clear_after, password=int(dev.password or 0),
+                                      download_service=self.download_service, device_id=dev.id or 0)
         worker.log.connect(self._log)
-        def on_result(events):
+        def on_result(count):
             try:
-                # Persist the events we already downloaded in the worker
-                count = self.download_service.persist_events(dev.id or 0, events)
+                # Events were persisted in batches by the worker while downloading
                 dev.last_download = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
                 self.dev_repo.update(dev)
                 self._load_table()
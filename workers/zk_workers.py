@@ -2,6 +2,10 @@ from typing import Optional
 from PyQt5 import QtCore
 from workers.base_worker import BaseWorker
 from services.zk_service import ZKService
+from services.download_service import DownloadService
+from services.fleet_service import FleetDownloader
+from services.discovery_service import DiscoveryService
+from data.repositories import DeviceRepository
 from data.models import Employee
 from zk import const
 
@@ -39,36 +43,94 @@ class DisconnectWorker(BaseWorker):
 
 
 class DownloadEventsWorker(BaseWorker):
-    def __init__(self, zk: ZKService, ip: str, port: int, clear_after: bool = False, password: int = 0):
+    def __init__(self, zk: ZKService, ip: str, port: int, clear_after: bool = False, password: int = 0,
+                 download_service: Optional[DownloadService] = None, device_id: int = 0):
         super().__init__()
         self.zk = zk
         self.ip = ip
         self.port = port
         self.clear_after = clear_after
         self.password = password
+        # With a download service, events are persisted in batches while downloading
+        # and the result is the number of saved events instead of the event list
+        self.download_service = download_service
+        self.device_id = device_id
 
     def run(self):
         try:
-            # Connect, disable, download, (optional) clear, enable, disconnect
+            # Disable, download, (optional) clear, enable on one pooled session
             if not self.zk.is_connected(self.ip, self.port):
                 self.log.emit(f"Conectando a {self.ip}:{self.port}", "INFO")
-                self.zk.connect(self.ip, self.port, self.password)
-            self.zk.disable_device(self.ip, self.port)
-            events = self.zk.get_attendance(self.ip, self.port)
-            self.log.emit(f"Descargados {len(events)} eventos", "INFO")
-            if self.clear_after:
-                self.zk.clear_attendance(self.ip, self.port)
-                self.log.emit("Eventos borrados en el dispositivo", "INFO")
-            # Re-enable and disconnect
-            try:
-                self.zk.enable_device(self.ip, self.port)
-            finally:
-                self.zk.disconnect(self.ip, self.port)
+            with self.zk.session(self.ip, self.port, self.password) as conn:
+                conn.disable_device()
+                try:
+                    if self.download_service:
+                        events = self.download_service.persist_batches(
+                            self.device_id,
+                            conn.iter_attendance_batches(),
+                            on_batch=lambda n: self.progress.emit(n, f"Guardados {n} eventos"),
+                        )
+                        self.log.emit(f"Descargados {events} eventos", "INFO")
+                    else:
+                        events = conn.get_attendance()
+                        self.log.emit(f"Descargados {len(events)} eventos", "INFO")
+                    if self.clear_after:
+                        conn.clear_attendance()
+                        self.log.emit("Eventos borrados en el dispositivo", "INFO")
+                finally:
+                    # Re-enable, the session goes back to the pool
+                    conn.enable_device()
             self.result.emit(events)
         except Exception as e:
             self.error.emit(str(e))
 
 
+class FleetDownloadWorker(BaseWorker):
+    def __init__(self, fleet: FleetDownloader):
+        super().__init__()
+        self.fleet = fleet
+
+    def run(self):
+        try:
+            def on_result(r):
+                if r.unchanged:
+                    self.log.emit(f"{r.name}: sin eventos nuevos", "INFO")
+                elif r.ok:
+                    self.log.emit(f"{r.name}: {r.events} eventos en {r.seconds:.1f}s", "INFO")
+                else:
+                    self.log.emit(f"{r.name}: {r.error} ({r.attempts} intentos)", "ERROR")
+            summary = self.fleet.run(
+                on_result=on_result,
+                on_batch=lambda dev, n: self.progress.emit(n, f"{dev.name}: guardados {n} eventos"),
+            )
+            self.result.emit(summary)
+        except Exception as e:
+            self.error.emit(str(e))
+
+
+class DiscoverWorker(BaseWorker):
+    def __init__(self, discovery: DiscoveryService, targets: list, device_repo: Optional[DeviceRepository] = None):
+        super().__init__()
+        self.discovery = discovery
+        self.targets = targets
+        # With a device repository, found terminals are registered in the devices table
+        self.device_repo = device_repo
+
+    def run(self):
+        try:
+            self.log.emit(f"Buscando terminales en {', '.join(self.targets)}", "INFO")
+            found = self.discovery.discover(
+                self.targets,
+                on_found=lambda d: self.log.emit(f"Encontrado {d.ip}:{d.port} ({d.transport}) {d.serialnumber or ''}", "INFO"),
+            )
+            if self.device_repo is not None and found:
+                created, updated = self.discovery.register(found, self.device_repo)
+                self.log.emit(f"{created} dispositivos nuevos, {updated} actualizados", "INFO")
+            self.result.emit(found)
+        except Exception as e:
+            self.error.emit(str(e))
+
+
 class DownloadUsersWorker(BaseWorker):
     def __init__(self, zk: ZKService, ip: str, port: int):
         super().__init__()
@@ -80,17 +142,11 @@ class DownloadUsersWorker(BaseWorker):
         try:
             if not self.zk.is_connected(self.ip, self.port):
                 self.log.emit(f"Conectando a {self.ip}:{self.port}", "INFO")
-                self.zk.connect(self.ip, self.port)
             users = self.zk.get_users(self.ip, self.port)
             self.log.emit(f"Descargados {len(users)} usuarios", "INFO")
             self.result.emit(users)
         except Exception as e:
             self.error.emit(str(e))
-        finally:
-            try:
-                self.zk.disconnect(self.ip, self.port)
-            except Exception:
-                pass
 
 class UploadUserWorker(BaseWorker):
     def __init__(self, zk: ZKService, ip: str, port: int, employee: Employee):
@@ -104,11 +160,11 @@ class UploadUserWorker(BaseWorker):
         try:
             if not self.zk.is_connected(self.ip, self.port):
                 self.log.emit(f"Conectando a {self.ip}:{self.port}", "INFO")
-                self.zk.connect(self.ip, self.port)
             priv = const.USER_ADMIN if (self.employee.privilege == const.USER_ADMIN) else const.USER_DEFAULT
             # uid no cambia; actualizamos otros campos
             self.log.emit(f"Actualizando usuario {self.employee.user_id}", "INFO")
-            self.zk._connections[f"{self.ip}:{self.port}"].set_user(
+            self.zk.set_user(
+                self.ip, self.port,
                 uid=self.employee.uid,
                 name=self.employee.name or '',
                 privilege=priv,
@@ -120,8 +176,3 @@ class UploadUserWorker(BaseWorker):
             self.result.emit({"ok": True})
         except Exception as e:
             self.error.emit(str(e))
-        finally:
-            try:
-                self.zk.disconnect(self.ip, self.port)
-            except Exception:
-                pass
@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio client for ZK terminals (python 3.7+)
+
+AsyncZK speaks the same protocol as zk.base.ZK and shares its packet
+building and decoding helpers, so a single event loop can talk to many
+terminals at the same time. It is not imported by the zk package to keep
+python 2 support there; import it as ``from zk.aio import AsyncZK``.
+
+It falls back to UDP when the terminal refuses the TCP connection
+(and force_udp is not set).
+"""
+import asyncio
+import codecs
+from struct import pack, unpack
+
+from . import const
+from .base import (AttendanceDecoder, TemplateDecoder, UserDecoder, UserIndex,
+                   create_header, create_tcp_top, decode_sizes,
+                   iter_live_events, make_commkey, pack_user)
+from .exception import ZKErrorConnection, ZKErrorResponse, ZKNetworkError
+from .user import User
+
+
+class _DatagramQueue(asyncio.DatagramProtocol):
+    """
+    collect the datagrams sent by the terminal
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def datagram_received(self, data, addr):
+        self.queue.put_nowait(data)
+
+
+class AsyncZK(object):
+    """
+    asyncio version of zk.ZK
+    """
+
+    def __init__(self, ip, port=4370, timeout=60, password=0, force_udp=False, verbose=False, encoding='UTF-8'):
+        """
+        Construct a new 'AsyncZK' object.
+
+        :param ip: machine's IP address
+        :param port: machine's port
+        :param timeout: timeout number (seconds for every reply)
+        :param password: passint
+        :param force_udp: use UDP connection
+        :param verbose: showing log while run the commands
+        :param encoding: user encoding
+        """
+        User.encoding = encoding
+        self.__address = (ip, port)
+        self.__timeout = timeout
+        self.__password = password # passint
+        self.__session_id = 0
+        self.__reply_id = const.USHRT_MAX - 1
+        self.__reader = None
+        self.__writer = None
+        self.__transport = None
+        self.__datagrams = None
+
+        self.is_connect = False
+        self.is_enabled = True
+        self.force_udp = force_udp
+        self.verbose = verbose
+        self.encoding = encoding
+        self.tcp = not force_udp
+        self.users = 0
+        self.fingers = 0
+        self.records = 0
+        self.dummy = 0
+        self.cards = 0
+        self.fingers_cap = 0
+        self.users_cap = 0
+        self.rec_cap = 0
+        self.faces = 0
+        self.faces_cap = 0
+        self.fingers_av = 0
+        self.users_av = 0
+        self.rec_av = 0
+        self.next_uid = 1
+        self.next_user_id='1'
+        self.user_packet_size = 28 # default zk6
+        self.end_live_capture = False
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        if self.is_connect:
+            await self.disconnect()
+
+    async def __open(self):
+        loop = asyncio.get_running_loop()
+        if self.tcp:
+            self.__reader, self.__writer = await asyncio.wait_for(
+                asyncio.open_connection(*self.__address), self.__timeout)
+        else:
+            self.__transport, protocol = await loop.create_datagram_endpoint(
+                _DatagramQueue, remote_addr=self.__address)
+            self.__datagrams = protocol.queue
+
+    def __close(self):
+        if self.__writer is not None:
+            self.__writer.close()
+            self.__writer = None
+            self.__reader = None
+        if self.__transport is not None:
+            self.__transport.close()
+            self.__transport = None
+            self.__datagrams = None
+
+    def __send_packet(self, command, command_string=b'', reply_id=None):
+        """
+        send a command without waiting for the reply
+        """
+        if reply_id is None:
+            reply_id = self.__reply_id
+        buf = create_header(command, command_string, self.__session_id, reply_id)
+        if self.tcp:
+            self.__writer.write(create_tcp_top(buf))
+        else:
+            self.__transport.sendto(buf)
+
+    async def __recv_packet(self, timeout=None):
+        """
+        receive exactly one packet from the terminal
+
+        only the wait for the packet is bounded by timeout: readexactly
+        consumes nothing until all the bytes asked for arrived, so a
+        cancelled wait for the top header leaves the stream as it was. once
+        the header is read the payload is awaited with the session timeout,
+        and the connection is closed if it doesn't come (the stream would
+        be parsed from the middle of a packet).
+
+        :return: header (command, checksum, session_id, reply_id), data
+        """
+        timeout = timeout or self.__timeout
+        if not self.tcp:
+            packet = await asyncio.wait_for(self.__datagrams.get(), timeout)
+            return unpack('<4H', packet[:8]), packet[8:]
+        try:
+            top = await asyncio.wait_for(self.__reader.readexactly(8), timeout)
+            magic1, magic2, length = unpack('<HHI', top)
+            if magic1 != const.MACHINE_PREPARE_DATA_1 or magic2 != const.MACHINE_PREPARE_DATA_2 or length < 8:
+                raise ZKErrorResponse("TCP packet invalid")
+            try:
+                packet = await asyncio.wait_for(self.__reader.readexactly(length), self.__timeout)
+            except asyncio.TimeoutError:
+                self.is_connect = False
+                self.__close()
+                raise ZKNetworkError("timeout in the middle of a packet, connection closed")
+        except asyncio.IncompleteReadError:
+            raise ZKNetworkError("connection closed by the device")
+        return unpack('<4H', packet[:8]), packet[8:]
+
+    async def __send_command(self, command, command_string=b''):
+        """
+        send command to the terminal
+
+        :return: reply command, reply data
+        """
+        if command not in [const.CMD_CONNECT, const.CMD_AUTH] and not self.is_connect:
+            raise ZKErrorConnection("instance are not connected.")
+        try:
+            self.__send_packet(command, command_string)
+            if self.tcp:
+                await self.__writer.drain()
+            header, data = await self.__recv_packet()
+        except (asyncio.TimeoutError, OSError) as e:
+            raise ZKNetworkError(str(e) or "timeout")
+        self.__header = header
+        self.__reply_id = header[3]
+        return header[0], data
+
+    @staticmethod
+    def __ok(response):
+        return response in [const.CMD_ACK_OK, const.CMD_PREPARE_DATA, const.CMD_DATA]
+
+    async def connect(self):
+        """
+        connect to the device
+
+        :return: self
+        """
+        self.end_live_capture = False
+        self.tcp = not self.force_udp
+        if self.tcp:
+            self.user_packet_size = 72 # default zk8
+        try:
+            try:
+                await self.__open()
+            except ConnectionRefusedError:
+                if not self.tcp:
+                    raise
+                if self.verbose: print ("tcp refused, trying udp")
+                self.tcp = False
+                self.user_packet_size = 28 # default zk6
+                await self.__open()
+        except (asyncio.TimeoutError, OSError) as e:
+            raise ZKNetworkError("can't reach device (%s)" % (e or "timeout"))
+        self.__session_id = 0
+        self.__reply_id = const.USHRT_MAX - 1
+        response, _data = await self.__send_command(const.CMD_CONNECT)
+        self.__session_id = self.__header[2]
+        if response == const.CMD_ACK_UNAUTH:
+            if self.verbose: print ("try auth")
+            command_string = make_commkey(self.__password, self.__session_id)
+            response, _data = await self.__send_command(const.CMD_AUTH, command_string)
+        if self.__ok(response):
+            self.is_connect = True
+            return self
+        self.__close()
+        if response == const.CMD_ACK_UNAUTH:
+            raise ZKErrorResponse("Unauthenticated")
+        if self.verbose: print ("connect err response {} ".format(response))
+        raise ZKErrorResponse("Invalid response: Can't connect")
+
+    async def disconnect(self):
+        """
+        diconnect from the connected device
+
+        :return: bool
+        """
+        response, _data = await self.__send_command(const.CMD_EXIT)
+        if self.__ok(response):
+            self.is_connect = False
+            self.__close()
+            return True
+        raise ZKErrorResponse("can't disconnect")
+
+    async def enable_device(self):
+        """
+        re-enable the connected device
+
+        :return: bool
+        """
+        response, _data = await self.__send_command(const.CMD_ENABLEDEVICE)
+        if self.__ok(response):
+            self.is_enabled = True
+            return True
+        raise ZKErrorResponse("Can't enable device")
+
+    async def disable_device(self):
+        """
+        disable (lock) device
+
+        :return: bool
+        """
+        response, _data = await self.__send_command(const.CMD_DISABLEDEVICE)
+        if self.__ok(response):
+            self.is_enabled = False
+            return True
+        raise ZKErrorResponse("Can't disable device")
+
+    async def refresh_data(self):
+        response, _data = await self.__send_command(const.CMD_REFRESHDATA)
+        if not self.__ok(response):
+            raise ZKErrorResponse("can't refresh data")
+
+    async def free_data(self):
+        """
+        clear buffer
+
+        :return: bool
+        """
+        response, _data = await self.__send_command(const.CMD_FREE_DATA)
+        if self.__ok(response):
+            return True
+        raise ZKErrorResponse("can't free data")
+
+    async def read_sizes(self):
+        """
+        read the memory ussage
+
+        :return: bool
+        """
+        response, data = await self.__send_command(const.CMD_GET_FREE_SIZES)
+        if not self.__ok(response):
+            raise ZKErrorResponse("can't read sizes")
+        if self.verbose: print(codecs.encode(data,'hex'))
+        for field, value in decode_sizes(data).items():
+            setattr(self, field, value)
+        return True
+
+    async def cancel_capture(self):
+        response, _data = await self.__send_command(const.CMD_CANCELCAPTURE)
+        return self.__ok(response)
+
+    async def verify_user(self):
+        response, _data = await self.__send_command(const.CMD_STARTVERIFY)
+        if self.__ok(response):
+            return True
+        raise ZKErrorResponse("Cant Verify")
+
+    async def reg_event(self, flags):
+        response, _data = await self.__send_command(const.CMD_REG_EVENT, pack("I", flags))
+        if not self.__ok(response):
+            raise ZKErrorResponse("cant' reg events %i" % flags)
+
+    async def __read_chunk(self, start, size):
+        """
+        read a chunk from buffer
+        """
+        for _retries in range(3):
+            response, data = await self.__send_command(const._CMD_READ_BUFFER, pack('<ii', start, size))
+            if response == const.CMD_DATA:
+                return data
+            if response != const.CMD_PREPARE_DATA:
+                if self.verbose: print ("invalid response %s" % response)
+                continue
+            parts = []
+            while True:
+                try:
+                    header, data = await self.__recv_packet()
+                except asyncio.TimeoutError:
+                    raise ZKNetworkError("timeout reading chunk %i:[%i]" % (start, size))
+                if header[0] == const.CMD_DATA:
+                    parts.append(data)
+                elif header[0] == const.CMD_ACK_OK:
+                    return b''.join(parts)
+                else:
+                    if self.verbose: print ("broken!")
+                    break
+        raise ZKErrorResponse("can't read chunk %i:[%i]" % (start, size))
+
+    async def __iter_buffer(self, command, fct=0, ext=0):
+        """
+        read info with buffered command (ZK6: 1503), chunk by chunk
+
+        :return: async generator of bytes, one item per chunk received
+        """
+        if self.tcp:
+            MAX_CHUNK = 0xFFc0
+        else:
+            MAX_CHUNK = 16 * 1024
+        command_string = pack('<bhii', 1, command, fct, ext)
+        response, data = await self.__send_command(const._CMD_PREPARE_BUFFER, command_string)
+        if not self.__ok(response):
+            raise ZKErrorResponse("RWB Not supported")
+        if response == const.CMD_DATA:
+            yield data
+            return
+        size = unpack('I', data[1:5])[0]
+        if self.verbose: print ("size fill be %i" % size)
+        start = 0
+        while start < size:
+            chunk = await self.__read_chunk(start, min(MAX_CHUNK, size - start))
+            start += len(chunk)
+            yield chunk
+            if not chunk:
+                break
+        await self.free_data()
+
+    async def read_with_buffer(self, command, fct=0 ,ext=0):
+        """
+        read info with buffered command (ZK6: 1503)
+
+        :return: bytes, size
+        """
+        chunks = [chunk async for chunk in self.__iter_buffer(command, fct, ext)]
+        data = b''.join(chunks)
+        return data, len(data)
+
+    async def iter_templates(self):
+        """
+        :return: async generator of Finger object
+        """
+        await self.read_sizes()
+        if self.fingers == 0:
+            return
+        decoder = TemplateDecoder(self.verbose)
+        async for chunk in self.__iter_buffer(const.CMD_DB_RRQ, const.FCT_FINGERTMP):
+            for finger in decoder.feed(chunk):
+                yield finger
+        decoder.close()
+
+    async def get_templates(self):
+        """
+        :return: list of Finger object
+        """
+        return [finger async for finger in self.iter_templates()]
+
+    async def iter_users(self):
+        """
+        :return: async generator of User object
+        """
+        await self.read_sizes()
+        if self.users == 0:
+            self.next_uid = 1
+            self.next_user_id='1'
+            return
+        decoder = UserDecoder(self.users, self.encoding, self.verbose)
+        async for chunk in self.__iter_buffer(const.CMD_USERTEMP_RRQ, const.FCT_USER):
+            for user in decoder.feed(chunk):
+                yield user
+            self.user_packet_size = decoder.user_packet_size
+        next_ids = decoder.next_ids()
+        if next_ids is not None:
+            self.next_uid, self.next_user_id = next_ids
+
+    async def get_users(self):
+        """
+        :return: list of User object
+        """
+        return [user async for user in self.iter_users()]
+
+    async def iter_attendance(self):
+        """
+        :return: async generator of Attendance object
+        """
+        await self.read_sizes()
+        if self.records == 0:
+            return
+        records = self.records
+        users = await self.get_users()
+        decoder = AttendanceDecoder(records, UserIndex(users), self.verbose)
+        async for chunk in self.__iter_buffer(const.CMD_ATTLOG_RRQ):
+            for attendance in decoder.feed(chunk):
+                yield attendance
+        for attendance in decoder.close():
+            yield attendance
+
+    async def get_attendance(self):
+        """
+        :return: list of Attendance object
+        """
+        return [attendance async for attendance in self.iter_attendance()]
+
+    async def set_user(self, uid=None, name='', privilege=0, password='', group_id='', user_id='', card=0):
+        """
+        create or update user by uid, same parameters as ZK.set_user
+        """
+        if uid is None:
+            uid = self.next_uid
+            if not user_id:
+                user_id = self.next_user_id
+        if not user_id:
+            user_id = str(uid) #ZK6 needs uid2 == uid
+        if privilege not in [const.USER_DEFAULT, const.USER_ADMIN]:
+            privilege = const.USER_DEFAULT
+        privilege = int(privilege)
+        try:
+            command_string = pack_user(uid, name, privilege, password, group_id, user_id, card, self.user_packet_size, self.encoding)
+        except Exception as e:
+            if self.verbose: print("Error pack: %s" % e)
+            raise ZKErrorResponse("Can't pack user")
+        response, _data = await self.__send_command(const.CMD_USER_WRQ, command_string)
+        if not self.__ok(response):
+            raise ZKErrorResponse("Can't set user")
+        await self.refresh_data()
+        if self.next_uid == uid:
+            self.next_uid += 1 # better recalculate again
+        if self.next_user_id == user_id:
+            self.next_user_id = str(self.next_uid)
+
+    async def live_capture(self, new_timeout=10):
+        """
+        try live capture of events, yields None every new_timeout seconds
+        without events (set end_live_capture to stop)
+
+        :return: async generator of Attendance object
+        """
+        was_enabled = self.is_enabled
+        users = UserIndex(await self.get_users())
+        await self.cancel_capture()
+        await self.verify_user()
+        if not self.is_enabled:
+            await self.enable_device()
+        if self.verbose: print ("start live_capture")
+        await self.reg_event(const.EF_ATTLOG)
+        self.end_live_capture = False
+        while not self.end_live_capture:
+            try:
+                header, data = await self.__recv_packet(new_timeout)
+            except asyncio.TimeoutError:
+                if self.verbose: print ("time out")
+                yield None # return to keep watching
+                continue
+            self.__send_packet(const.CMD_ACK_OK, b'', const.USHRT_MAX - 1)
+            if not header[0] == const.CMD_REG_EVENT:
+                if self.verbose: print("not event! %x" % header[0])
+                continue
+            if not len(data):
+                if self.verbose: print ("empty")
+                continue
+            for attendance in iter_live_events(data, users):
+                yield attendance
+        if self.verbose: print ("exit gracefully")
+        await self.reg_event(0)
+        if not was_enabled:
+            await self.disable_device()
@@ -1,5 +1,38 @@
 # -*- coding: utf-8 -*-
+from array import array
+from datetime import datetime, timedelta
+
+try:
+    import numpy
+except ImportError: # optional, only for AttendanceBatch.to_numpy
+    numpy = None
+
+_EPOCH = datetime(1970, 1, 1)
+_SECONDS = 'q' # timestamp array typecode
+try:
+    array(_SECONDS)
+except ValueError: # python 2 has no long long arrays, long is 64 bits on most unix
+    _SECONDS = 'l'
+
+
+def to_seconds(timestamp):
+    """
+    naive datetime (device local time) to seconds since 1970-01-01
+    """
+    delta = timestamp - _EPOCH
+    return delta.days * 86400 + delta.seconds
+
+
+def from_seconds(seconds):
+    """
+    seconds since 1970-01-01 to naive datetime (device local time)
+    """
+    return _EPOCH + timedelta(seconds=seconds)
+
+
 class Attendance(object):
+    __slots__ = ('uid', 'user_id', 'timestamp', 'status', 'punch')
+
     def __init__(self, user_id, timestamp, status, punch=0, uid=0):
         self.uid = uid # not really used any more
         self.user_id = user_id
@@ -7,8 +40,149 @@ class Attendance(object):
         self.status = status
         self.punch = punch
 
+    def json_pack(self): #packs for json, timestamp left as datetime
+        return {
+            "uid": self.uid,
+            "user_id": self.user_id,
+            "timestamp": self.timestamp,
+            "status": self.status,
+            "punch": self.punch
+        }
+
     def __str__(self):
         return '<Attendance>: {} : {} ({}, {})'.format(self.user_id, self.timestamp, self.status, self.punch)
 
     def __repr__(self):
         return '<Attendance>: {} : {} ({}, {})'.format(self.user_id, self.timestamp,self.status, self.punch)
+
+
+class AttendanceBatch(object):
+    """
+    column store of attendance records: 18 bytes per record in typed arrays
+    instead of an Attendance object and a datetime.
+
+    timestamps are seconds since 1970-01-01 in device local time (naive,
+    like the datetimes of Attendance). every user_id string is kept once in
+    user_ids and the rows refer to it by position. batch[i] builds the
+    Attendance of a row on demand, batch[i:j] is another batch.
+    """
+
+    def __init__(self):
+        self.user = array('I')      # position in user_ids
+        self.uid = array('I')
+        self.timestamp = array(_SECONDS)
+        self.status = array('B')
+        self.punch = array('B')
+        self.user_ids = []
+        self._codes = {}            # user_id -> position in user_ids
+
+    def code(self, user_id):
+        """
+        :return: position of user_id in user_ids, added when new
+        """
+        code = self._codes.get(user_id)
+        if code is None:
+            code = self._codes[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+        return code
+
+    def append(self, user_id, uid, timestamp, status, punch=0):
+        """
+        add a record, timestamp in seconds (see to_seconds)
+        """
+        self.user.append(self.code(user_id))
+        self.uid.append(uid)
+        self.timestamp.append(timestamp)
+        self.status.append(status)
+        self.punch.append(punch)
+
+    def add(self, attendance):
+        """
+        add an Attendance object
+        """
+        uid = attendance.uid
+        self.append(attendance.user_id, int(uid) if uid else 0, to_seconds(attendance.timestamp),
+                    attendance.status, attendance.punch)
+
+    def extend(self, other):
+        """
+        append the rows of another batch
+        """
+        if not self.user_ids:
+            self.user_ids = list(other.user_ids)
+            self._codes = dict(other._codes)
+            self.user.extend(other.user)
+        else:
+            codes = [self.code(user_id) for user_id in other.user_ids]
+            self.user.extend(codes[c] for c in other.user)
+        self.uid.extend(other.uid)
+        self.timestamp.extend(other.timestamp)
+        self.status.extend(other.status)
+        self.punch.extend(other.punch)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            batch = AttendanceBatch()
+            batch.user_ids = self.user_ids
+            batch._codes = self._codes
+            batch.user = self.user[key]
+            batch.uid = self.uid[key]
+            batch.timestamp = self.timestamp[key]
+            batch.status = self.status[key]
+            batch.punch = self.punch[key]
+            return batch
+        return Attendance(self.user_ids[self.user[key]], from_seconds(self.timestamp[key]),
+                          self.status[key], self.punch[key], self.uid[key])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return '<AttendanceBatch>: {} records, {} users'.format(len(self), len(self.user_ids))
+
+    @property
+    def nbytes(self):
+        """
+        bytes used by the columns (user_ids not included)
+        """
+        return sum(len(c) * c.itemsize for c in (self.user, self.uid, self.timestamp, self.status, self.punch))
+
+    def iter_user_ids(self):
+        """
+        :return: generator of the user_id of every row
+        """
+        user_ids = self.user_ids
+        return (user_ids[c] for c in self.user)
+
+    def iter_times(self, fmt='%Y-%m-%d'):
+        """
+        timestamps as text ('2024-01-31 08:00:00' like str(datetime)), the
+        date part formatted once per day
+
+        :return: generator of str
+        """
+        days = {}
+        for seconds in self.timestamp:
+            day, second = divmod(seconds, 86400)
+            text = days.get(day)
+            if text is None:
+                text = days[day] = from_seconds(day * 86400).strftime(fmt)
+            yield '%s %02d:%02d:%02d' % (text, second // 3600, second // 60 % 60, second % 60)
+
+    def to_numpy(self):
+        """
+        the columns as numpy arrays sharing the batch memory (user is the
+        position in user_ids)
+
+        :return: dict of column name -> numpy.ndarray
+        """
+        if numpy is None:
+            raise ImportError('numpy is required for AttendanceBatch.to_numpy')
+        return dict((name, numpy.frombuffer(getattr(self, name), dtype=dtype))
+                    for name, dtype in (('user', numpy.uint32), ('uid', numpy.uint32),
+                                        ('timestamp', _SECONDS), ('status', numpy.uint8),
+                                        ('punch', numpy.uint8)))
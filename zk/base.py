@@ -1,16 +1,35 @@
 # -*- coding: utf-8 -*-
+import os
 import sys
+import errno
+from collections import deque
 from datetime import datetime
-from socket import AF_INET, SOCK_DGRAM, SOCK_STREAM, socket, timeout
-from struct import pack, unpack
+from socket import AF_INET, SOCK_DGRAM, SOCK_STREAM, socket, timeout, error as socket_error
+from struct import Struct, pack, unpack, unpack_from
 import codecs
 
 from . import const
-from .attendance import Attendance
+from .attendance import Attendance, AttendanceBatch, to_seconds
 from .exception import ZKErrorConnection, ZKErrorResponse, ZKNetworkError
+from .instrument import clock
 from .user import User
 from .finger import Finger
 
+try:
+    import numpy
+except ImportError: # optional, speeds up checksums of big packets
+    numpy = None
+
+# the real socket class, kept even when zk.base.socket is replaced (tests).
+# python 2 tests replace the whole socket module, no probe is reused then
+_SOCKET_TYPE = socket if isinstance(socket, type) else ()
+# below this size numpy setup costs more than it saves
+_NUMPY_MIN_SIZE = 4096
+# connect_ex results meaning the host answered (with a RST)
+_REFUSED = set(getattr(errno, name) for name in ('ECONNREFUSED', 'WSAECONNREFUSED') if hasattr(errno, name))
+# read_with_buffer spool file header: magic, size, command, fct, ext
+_SPOOL_HEADER = Struct('<4sIhii')
+
 
 def safe_cast(val, to_type, default=None):
     #https://stackoverflow.com/questions/6330071/safe-casting-in-python
@@ -20,6 +39,16 @@ def safe_cast(val, to_type, default=None):
         return default
 
 
+def _bytes(data):
+    """
+    copy of a bytes-like object as bytes (bytes(memoryview) is its repr on
+    python 2)
+    """
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return bytes(data)
+
+
 def make_commkey(key, session_id, ticks=50):
     """
     take a password and session_id and scramble them to send to the machine.
@@ -57,60 +86,903 @@ def make_commkey(key, session_id, ticks=50):
     return k
 
 
+def create_tcp_top(packet):
+    """
+    witch the complete packet set top header
+    """
+    length = len(packet)
+    top = pack('<HHI', const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, length)
+    return top + packet
+
+
+def create_header(command, command_string, session_id, reply_id):
+    """
+    Puts a the parts that make up a packet together and packs them into a byte string
+    """
+    buf = pack('<4H', command, 0, session_id, reply_id) + command_string
+    checksum = unpack('H', create_checksum(buf))[0]
+    reply_id += 1
+    if reply_id >= const.USHRT_MAX:
+        reply_id -= const.USHRT_MAX
+
+    buf = pack('<4H', command, checksum, session_id, reply_id)
+    return buf + command_string
+
+
+def _fold_checksum(total):
+    """
+    zkemsdk.c keeps the running sum in 1..USHRT_MAX (subtracting USHRT_MAX
+    on overflow) and returns its complement, folded the same way
+    """
+    if total:
+        total = (total - 1) % const.USHRT_MAX + 1
+    checksum = ~total
+    while checksum < 0:
+        checksum += const.USHRT_MAX
+    return checksum
+
+
+def _word_sum(data):
+    """
+    sum of the native 16 bits words of data (even length)
+
+    a little endian number in base 2**16 is congruent to the sum of its
+    words modulo 2**16 - 1, so int.from_bytes does the whole loop in C.
+    the result is only meaningful modulo USHRT_MAX, plus being 0 for
+    all-zero data, which is all the checksum needs. python 2 has no
+    int.from_bytes and sums the unpacked words.
+    """
+    if numpy is not None and len(data) >= _NUMPY_MIN_SIZE:
+        return int(numpy.frombuffer(data, dtype=numpy.uint16).sum(dtype=numpy.uint64))
+    if not hasattr(int, 'from_bytes'): # python 2
+        return sum(unpack_from('%iH' % (len(data) // 2), data))
+    total = int.from_bytes(data, sys.byteorder) % const.USHRT_MAX
+    if not total and data.count(0) != len(data):
+        total = const.USHRT_MAX # non zero multiple of USHRT_MAX
+    return total
+
+
+def create_checksum(p):
+    """
+    Calculates the checksum of the packet to be sent to the time clock
+    Copied from zkemsdk.c
+
+    :param p: packet bytes (a tuple of byte values is also accepted)
+    """
+    if not isinstance(p, (bytes, bytearray)):
+        p = bytes(bytearray(p))
+    even = len(p) & ~1
+    total = _word_sum(memoryview(p)[:even].tobytes() if even != len(p) else p)
+    if even != len(p):
+        total += bytearray(p[-1:])[0]
+    return pack('H', _fold_checksum(total))
+
+
+def create_checksum_loop(p):
+    """
+    reference implementation of create_checksum, word by word as in
+    zkemsdk.c. kept to check the fast version against it.
+
+    :param p: tuple of byte values
+    """
+    l = len(p)
+    checksum = 0
+    while l > 1:
+        checksum += unpack('H', pack('BB', p[0], p[1]))[0]
+        p = p[2:]
+        if checksum > const.USHRT_MAX:
+            checksum -= const.USHRT_MAX
+        l -= 2
+    if l:
+        checksum = checksum + p[-1]
+
+    while checksum > const.USHRT_MAX:
+        checksum -= const.USHRT_MAX
+
+    checksum = ~checksum
+
+    while checksum < 0:
+        checksum += const.USHRT_MAX
+
+    return pack('H', checksum)
+
+
+def test_tcp_top(packet):
+    """
+    return size!
+    """
+    if len(packet)<=8:
+        return 0
+    tcp_header = unpack('<HHI', packet[:8])
+    if tcp_header[0] == const.MACHINE_PREPARE_DATA_1 and tcp_header[1] == const.MACHINE_PREPARE_DATA_2:
+        return tcp_header[2]
+    return 0
+
+
+def decode_sizes(data):
+    """
+    decode the CMD_GET_FREE_SIZES reply
+
+    :return: dict with the counters and capacities found in data
+    """
+    sizes = {}
+    if len(data) >= 80:
+        fields = unpack('20i', data[:80])
+        sizes.update({
+            'users': fields[4],
+            'fingers': fields[6],
+            'records': fields[8],
+            'dummy': fields[10], #???
+            'cards': fields[12],
+            'fingers_cap': fields[14],
+            'users_cap': fields[15],
+            'rec_cap': fields[16],
+            'fingers_av': fields[17],
+            'users_av': fields[18],
+            'rec_av': fields[19],
+        })
+        data = data[80:]
+    if len(data) >= 12: #face info
+        fields = unpack('3i', data[:12]) #dirty hack! we need more information
+        sizes['faces'] = fields[0]
+        sizes['faces_cap'] = fields[2]
+    return sizes
+
+
+def pack_user(uid, name, privilege, password, group_id, user_id, card, user_packet_size, encoding):
+    """
+    build the CMD_USER_WRQ command string
+
+    :param user_packet_size: 28 for zk6, 72 for zk8
+    """
+    if user_packet_size == 28: #self.firmware == 6:
+        if not group_id:
+            group_id = 0
+        return pack('HB5s8sIxBHI', uid, privilege, password.encode(encoding, errors='ignore'), name.encode(encoding, errors='ignore'), card, int(group_id), 0, int(user_id))
+    name_pad = name.encode(encoding, errors='ignore').ljust(24, b'\x00')[:24]
+    card_str = pack('<I', int(card))[:4]
+    return pack('HB8s24s4sx7sx24s', uid, privilege, password.encode(encoding, errors='ignore'), name_pad, card_str, group_id.encode(), user_id.encode())
+
+
+def decode_time(t):
+    """
+    Decode a timestamp retrieved from the timeclock (already unpacked as int)
+
+    copied from zkemsdk.c - DecodeTime
+    """
+    second = t % 60
+    t = t // 60
+
+    minute = t % 60
+    t = t // 60
+
+    hour = t % 24
+    t = t // 24
+
+    day = t % 31 + 1
+    t = t // 31
+
+    month = t % 12 + 1
+    t = t // 12
+
+    year = t + 2000
+
+    return datetime(year, month, day, hour, minute, second)
+
+
+def decode_timehex(timehex):
+    """
+    timehex string of six bytes
+    """
+    year, month, day, hour, minute, second = unpack("6B", timehex)
+    year += 2000
+    return datetime(year, month, day, hour, minute, second)
+
+
+class UserIndex(object):
+    """
+    uid -> User and user_id -> User lookups, built once per download and
+    updated in place when users are written or deleted
+
+    on duplicated keys the first user wins, like the old linear scans.
+    """
+
+    def __init__(self, users=()):
+        self.by_uid = {}
+        self.by_user_id = {}
+        self.extend(users)
+
+    def extend(self, users):
+        """
+        index downloaded users, keeping the first on duplicated keys
+        """
+        for user in users:
+            self.by_uid.setdefault(user.uid, user)
+            self.by_user_id.setdefault(user.user_id, user)
+
+    def find_uid(self, uid):
+        """
+        :return: first User with this uid or None
+        """
+        return self.by_uid.get(uid)
+
+    def find_user_id(self, user_id):
+        """
+        :return: first User with this user_id or None
+        """
+        return self.by_user_id.get(user_id)
+
+    def add(self, user):
+        """
+        add or replace (by uid) a user
+
+        :return: True when the uid is new
+        """
+        old = self.remove(user.uid)
+        self.by_uid[user.uid] = user
+        self.by_user_id[user.user_id] = user
+        return old is None
+
+    def remove(self, uid):
+        """
+        :return: the removed User or None
+        """
+        user = self.by_uid.pop(uid, None)
+        if user is not None and self.by_user_id.get(user.user_id) is user:
+            del self.by_user_id[user.user_id]
+        return user
+
+
+class LinearUserIndex(object):
+    """
+    reference implementation of UserIndex, scanning the whole user list on
+    every lookup (O(users)). kept to check the indexed lookups against it.
+    """
+
+    def __init__(self, users=()):
+        self.users = list(users)
+
+    def find_uid(self, uid):
+        tuser = list(filter(lambda x: x.uid == uid, self.users))
+        return tuser[0] if tuser else None
+
+    def find_user_id(self, user_id):
+        tuser = list(filter(lambda x: x.user_id == user_id, self.users))
+        return tuser[0] if tuser else None
+
+
+# attendance record layouts returned by CMD_ATTLOG_RRQ
+_ATT_RECORD_8 = Struct('<HBIB')         # uid, status, timestamp, punch
+_ATT_RECORD_16 = Struct('<IIBB2sI')     # user_id, timestamp, status, punch, reserved, workcode
+_ATT_RECORD_40 = Struct('<H24sBIB8s')   # uid, user_id, status, timestamp, punch, space
+
+
+def _iter_unpack(layout, view):
+    """
+    layout.iter_unpack over the whole records of view (trailing bytes are
+    ignored), an unpack_from loop where Struct.iter_unpack is missing
+    (python 2)
+    """
+    end = len(view) - len(view) % layout.size
+    if hasattr(layout, 'iter_unpack'):
+        return layout.iter_unpack(view[:end])
+    return (layout.unpack_from(view, offset) for offset in range(0, end, layout.size))
+
+
+def iter_attendance_records(data, record_size, index, verbose=False):
+    """
+    decode raw attendance records (without the leading total size)
+
+    works over a memoryview with precompiled structs, so the buffer is
+    never sliced or copied per record.
+
+    :param data: bytes-like object with the records
+    :param record_size: record size reported by the device (8, 16 or 40)
+    :param index: UserIndex used to resolve uid / user_id
+    :param verbose: print every raw record
+    :return: generator of Attendance objects
+    """
+    view = memoryview(data)
+    if record_size == 8:
+        layout = _ATT_RECORD_8
+    elif record_size == 16:
+        layout = _ATT_RECORD_16
+    else:
+        layout = _ATT_RECORD_40
+    if record_size == layout.size:
+        records = _iter_unpack(layout, view)
+    else: # unknown size, step by record_size but read 40 bytes
+        records = (layout.unpack_from(view, offset) for offset in range(0, len(view) - layout.size + 1, record_size))
+    if record_size == 8:
+        for record in records:
+            if verbose: print (codecs.encode(layout.pack(*record), 'hex'))
+            uid, status, timestamp, punch = record
+            tuser = index.find_uid(uid)
+            if not tuser:
+                user_id = str(uid)
+            else:
+                user_id = tuser.user_id
+            yield Attendance(user_id, decode_time(timestamp), status, punch, uid)
+    elif record_size == 16:
+        for record in records:
+            if verbose: print (codecs.encode(layout.pack(*record), 'hex'))
+            user_id, timestamp, status, punch, reserved, workcode = record
+            user_id = str(user_id)
+            tuser = index.find_user_id(user_id)
+            if not tuser:
+                if verbose: print("no uid {}", user_id)
+                uid = str(user_id)
+                tuser = index.find_uid(user_id)
+                if not tuser:
+                    uid = str(user_id)
+                else:
+                    uid = tuser.uid
+                    user_id = tuser.user_id
+            else:
+                uid = tuser.uid
+            yield Attendance(user_id, decode_time(timestamp), status, punch, uid)
+    else:
+        for record in records:
+            if verbose: print (codecs.encode(layout.pack(*record), 'hex'))
+            uid, user_id, status, timestamp, punch, space = record
+            user_id = (user_id.split(b'\x00')[0]).decode(errors='ignore')
+            yield Attendance(user_id, decode_time(timestamp), status, punch, uid)
+
+
+def decode_attendance_batch(data, record_size, index, batch=None, verbose=False):
+    """
+    decode raw attendance records into an AttendanceBatch, without an
+    object per record: users are resolved once per key and timestamps
+    converted once per day.
+
+    :param data: bytes-like object with the records
+    :param record_size: record size reported by the device (8, 16 or 40)
+    :param index: UserIndex used to resolve uid / user_id
+    :param batch: AttendanceBatch to append to, a new one when None
+    :param verbose: print every raw record
+    :return: AttendanceBatch
+    """
+    if batch is None:
+        batch = AttendanceBatch()
+    view = memoryview(data)
+    if record_size == 8:
+        layout, fields = _ATT_RECORD_8, (0, 2, 1, 3)    # key, timestamp, status, punch
+    elif record_size == 16:
+        layout, fields = _ATT_RECORD_16, (0, 1, 2, 3)
+    else:
+        layout, fields = _ATT_RECORD_40, (1, 3, 2, 4)
+    if record_size == layout.size:
+        records = _iter_unpack(layout, view)
+    else: # unknown size, step by record_size but read 40 bytes
+        records = (layout.unpack_from(view, offset) for offset in range(0, len(view) - layout.size + 1, record_size))
+    key_at, time_at, status_at, punch_at = fields
+    users = {} # record key -> (user position, uid)
+    days = {} # encoded day -> seconds at midnight
+    user, uids, timestamps = batch.user, batch.uid, batch.timestamp
+    statuses, punches = batch.status, batch.punch
+    for record in records:
+        if verbose: print (codecs.encode(layout.pack(*record), 'hex'))
+        key = record[key_at]
+        resolved = users.get(key)
+        if resolved is None:
+            if record_size == 8:
+                tuser = index.find_uid(key)
+                user_id, uid = (tuser.user_id if tuser else str(key)), key
+            elif record_size == 16:
+                user_id = str(key)
+                tuser = index.find_user_id(user_id) or index.find_uid(user_id)
+                user_id, uid = (tuser.user_id, tuser.uid) if tuser else (user_id, key)
+            else:
+                user_id = (key.split(b'\x00')[0]).decode(errors='ignore')
+                uid = record[0]
+            resolved = users[key] = (batch.code(user_id), uid)
+        day, second = divmod(record[time_at], 86400)
+        midnight = days.get(day)
+        if midnight is None:
+            midnight = days[day] = to_seconds(decode_time(day * 86400))
+        user.append(resolved[0])
+        uids.append(record[0] if record_size == 40 else resolved[1])
+        timestamps.append(midnight + second)
+        statuses.append(record[status_at])
+        punches.append(record[punch_at])
+    return batch
+
+
+# user record layouts returned by CMD_USERTEMP_RRQ
+_USER_RECORD_28 = Struct('<HB5s8sIxBhI')    # uid, privilege, password, name, card, group_id, timezone, user_id
+_USER_RECORD_72 = Struct('<HB8s24sIx7sx24s') # uid, privilege, password, name, card, group_id, user_id
+# template header returned by CMD_DB_RRQ / FCT_FINGERTMP
+_TEMPLATE_HEADER = Struct('<HHbb')          # size, uid, fid, valid
+
+
+def iter_user_records(data, packet_size, encoding, verbose=False):
+    """
+    decode raw user records (without the leading total size)
+
+    :param data: bytes-like object with the records
+    :param packet_size: user packet size (28 for zk6, 72 for zk8)
+    :param encoding: user encoding
+    :param verbose: print every decoded user
+    :return: generator of User objects
+    """
+    view = memoryview(data)
+    if packet_size == 28:
+        layout = _USER_RECORD_28
+        for uid, privilege, password, name, card, group_id, timezone, user_id in _iter_unpack(layout, view):
+            password = (password.split(b'\x00')[0]).decode(encoding, errors='ignore')
+            name = (name.split(b'\x00')[0]).decode(encoding, errors='ignore').strip()
+            group_id = str(group_id)
+            user_id = str(user_id)
+            #TODO: check card value and find in ver8
+            if not name:
+                name = "NN-%s" % user_id
+            if verbose: print("[6]user:",uid, privilege, password, name, card, group_id, timezone, user_id)
+            yield User(uid, name, privilege, password, group_id, user_id, card)
+    else:
+        layout = _USER_RECORD_72
+        for uid, privilege, password, name, card, group_id, user_id in _iter_unpack(layout, view):
+            password = (password.split(b'\x00')[0]).decode(encoding, errors='ignore')
+            name = (name.split(b'\x00')[0]).decode(encoding, errors='ignore').strip()
+            group_id = (group_id.split(b'\x00')[0]).decode(encoding, errors='ignore').strip()
+            user_id = (user_id.split(b'\x00')[0]).decode(encoding, errors='ignore')
+            if not name:
+                name = "NN-%s" % user_id
+            yield User(uid, name, privilege, password, group_id, user_id, card)
+
+
+def _numpy_layout(fields):
+    """
+    packed numpy structured dtype from [(name, format)], None names are
+    padding bytes left out of the fields
+    """
+    names, formats, offsets, offset = [], [], [], 0
+    for name, fmt in fields:
+        if name:
+            names.append(name)
+            formats.append(fmt)
+            offsets.append(offset)
+        offset += numpy.dtype(fmt).itemsize
+    return numpy.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': offset})
+
+
+if numpy is not None:
+    # the attendance / user record layouts above as numpy dtypes
+    ATTENDANCE_RECORD_DTYPES = {
+        8: _numpy_layout([('uid', '<u2'), ('status', 'u1'), ('timestamp', '<u4'), ('punch', 'u1')]),
+        16: _numpy_layout([('user_id', '<u4'), ('timestamp', '<u4'), ('status', 'u1'), ('punch', 'u1'),
+                           (None, 'V2'), ('workcode', '<u4')]),
+        40: _numpy_layout([('uid', '<u2'), ('user_id', 'S24'), ('status', 'u1'), ('timestamp', '<u4'),
+                           ('punch', 'u1'), (None, 'V8')]),
+    }
+    USER_RECORD_DTYPES = {
+        28: _numpy_layout([('uid', '<u2'), ('privilege', 'u1'), ('password', 'S5'), ('name', 'S8'),
+                           ('card', '<u4'), (None, 'V1'), ('group_id', 'u1'), ('timezone', '<i2'),
+                           ('user_id', '<u4')]),
+        72: _numpy_layout([('uid', '<u2'), ('privilege', 'u1'), ('password', 'S8'), ('name', 'S24'),
+                           ('card', '<u4'), (None, 'V1'), ('group_id', 'S7'), (None, 'V1'),
+                           ('user_id', 'S24')]),
+    }
+    # get_attendance_array / get_users_array results
+    ATTENDANCE_ARRAY_DTYPE = numpy.dtype([('uid', '<u4'), ('user_id', 'U24'), ('timestamp', 'datetime64[s]'),
+                                          ('status', 'u1'), ('punch', 'u1')])
+    USER_ARRAY_DTYPE = numpy.dtype([('uid', '<u2'), ('name', 'U24'), ('privilege', 'u1'), ('password', 'U8'),
+                                    ('group_id', 'U7'), ('user_id', 'U24'), ('card', '<u4')])
+
+
+def _require_numpy(name):
+    if numpy is None:
+        raise ImportError('numpy is required for %s' % name)
+
+
+def decode_time_array(t):
+    """
+    vectorized decode_time: encoded timestamps to datetime64[s]
+
+    invalid dates (day 31 of a 30 days month) roll over to the next month
+    instead of raising like decode_time.
+    """
+    _require_numpy('decode_time_array')
+    t = numpy.asarray(t, dtype=numpy.int64)
+    seconds, t = t % 86400, t // 86400
+    day, t = t % 31, t // 31
+    month, year = t % 12, t // 12 # year from 2000
+    months = ((year + 30) * 12 + month).astype('datetime64[M]') # from 1970-01
+    return months.astype('datetime64[D]') + day + seconds.astype('timedelta64[s]')
+
+
+def _decode_strings(values, encoding):
+    """
+    S fields up to their first null byte, decoded
+    """
+    values = numpy.array(values) # contiguous copy, cleared after the first null
+    raw = values.view(numpy.uint8).reshape(len(values), values.dtype.itemsize)
+    raw[numpy.cumsum(raw == 0, axis=1) > 0] = 0
+    return numpy.char.decode(values, encoding, errors='ignore')
+
+
+def attendance_array(data, record_size, index):
+    """
+    decode raw attendance records (without the leading total size) into a
+    numpy array of ATTENDANCE_ARRAY_DTYPE, the records read in place with
+    ATTENDANCE_RECORD_DTYPES. users are resolved once per distinct key,
+    like iter_attendance_records.
+
+    :param data: bytes-like object with the records
+    :param record_size: record size reported by the device (8, 16 or 40)
+    :param index: UserIndex used to resolve uid / user_id
+    :return: numpy structured array
+    """
+    _require_numpy('attendance_array')
+    layout = ATTENDANCE_RECORD_DTYPES[record_size]
+    records = numpy.frombuffer(data, dtype=layout, count=len(data) // record_size)
+    result = numpy.zeros(len(records), dtype=ATTENDANCE_ARRAY_DTYPE)
+    result['timestamp'] = decode_time_array(records['timestamp'])
+    result['status'] = records['status']
+    result['punch'] = records['punch']
+    if record_size == 40:
+        result['uid'] = records['uid']
+        result['user_id'] = _decode_strings(records['user_id'], 'utf-8')
+        return result
+    keys, inverse = numpy.unique(records['uid' if record_size == 8 else 'user_id'], return_inverse=True)
+    uids, user_ids = [], []
+    for key in keys.tolist():
+        if record_size == 8:
+            tuser = index.find_uid(key)
+            user_ids.append(tuser.user_id if tuser else str(key))
+            uids.append(key)
+        else:
+            tuser = index.find_user_id(str(key)) or index.find_uid(str(key))
+            user_ids.append(tuser.user_id if tuser else str(key))
+            uids.append(tuser.uid if tuser else key)
+    result['uid'] = numpy.array(uids, dtype=numpy.uint32)[inverse]
+    result['user_id'] = numpy.array(user_ids, dtype='U24')[inverse]
+    return result
+
+
+def user_array(data, packet_size, encoding):
+    """
+    decode raw user records (without the leading total size) into a numpy
+    array of USER_ARRAY_DTYPE, the records read in place with
+    USER_RECORD_DTYPES
+
+    :param data: bytes-like object with the records
+    :param packet_size: user packet size (28 for zk6, 72 for zk8)
+    :param encoding: user encoding
+    :return: numpy structured array
+    """
+    _require_numpy('user_array')
+    packet_size = 28 if packet_size == 28 else 72
+    records = numpy.frombuffer(data, dtype=USER_RECORD_DTYPES[packet_size], count=len(data) // packet_size)
+    result = numpy.zeros(len(records), dtype=USER_ARRAY_DTYPE)
+    for name in ('uid', 'privilege', 'card'):
+        result[name] = records[name]
+    result['password'] = _decode_strings(records['password'], encoding)
+    if packet_size == 28:
+        result['group_id'] = records['group_id'].astype('U7')
+        result['user_id'] = records['user_id'].astype('U24')
+    else:
+        result['group_id'] = numpy.char.strip(_decode_strings(records['group_id'], encoding))
+        result['user_id'] = _decode_strings(records['user_id'], encoding)
+    names = numpy.char.strip(_decode_strings(records['name'], encoding))
+    result['name'] = numpy.where(names == '', numpy.char.add('NN-', result['user_id']), names)
+    return result
+
+
+class AttendanceDecoder(object):
+    """
+    push decoder for the CMD_ATTLOG_RRQ buffer: feed it the chunks as they
+    arrive, it keeps the partial records between them.
+    """
+
+    def __init__(self, records, index, verbose=False, record_size=None, batch=False):
+        self.records = records
+        self.index = index
+        self.verbose = verbose
+        self.record_size = record_size # None: computed from the leading total size
+        self.batch = batch # decode into AttendanceBatch instead of lists
+        self.unknown = [] # chunks of an unknown layout, decoded at the end
+        self.pending = b''
+
+    def decode(self, data):
+        """
+        :return: list of Attendance, or AttendanceBatch in batch mode
+        """
+        if self.batch:
+            return decode_attendance_batch(data, self.record_size, self.index, verbose=self.verbose)
+        return list(iter_attendance_records(data, self.record_size, self.index, self.verbose))
+
+    def feed(self, chunk):
+        """
+        :return: list of Attendance (or AttendanceBatch) decoded so far
+        """
+        data = bytearray(self.pending) + chunk if self.pending else chunk # bytes + memoryview fails on python 2
+        offset = 0
+        empty = AttendanceBatch() if self.batch else []
+        if self.record_size is None:
+            if len(data) < 4:
+                self.pending = _bytes(data)
+                return empty
+            total_size = unpack("I", data[:4])[0]
+            self.record_size = total_size // self.records
+            if self.verbose: print ("record_size is ", self.record_size)
+            offset = 4
+        if self.record_size not in (8, 16, 40):
+            self.unknown.append(_bytes(data[offset:]))
+            self.pending = b''
+            return empty
+        complete = offset + (len(data) - offset) // self.record_size * self.record_size
+        self.pending = _bytes(data[complete:])
+        return self.decode(memoryview(data)[offset:complete])
+
+    def close(self):
+        """
+        :return: list of Attendance (or AttendanceBatch) left (unknown layouts)
+        """
+        if self.record_size is None:
+            if self.verbose: print ("WRN: no attendance data")
+            return AttendanceBatch() if self.batch else []
+        if not self.unknown:
+            return AttendanceBatch() if self.batch else []
+        return self.decode(b''.join(self.unknown))
+
+
+class UserDecoder(object):
+    """
+    push decoder for the CMD_USERTEMP_RRQ buffer, also tracks the values
+    needed to compute next_uid / next_user_id
+    """
+
+    def __init__(self, users, encoding, verbose=False):
+        self.users = users
+        self.encoding = encoding
+        self.verbose = verbose
+        self.user_packet_size = None
+        self.packet_size = None
+        self.max_uid = 0
+        self.user_ids = set()
+        self.received = 0
+        self.pending = b''
+
+    def feed(self, chunk):
+        """
+        :return: list of User decoded so far
+        """
+        self.received += len(chunk)
+        data = bytearray(self.pending) + chunk if self.pending else chunk
+        offset = 0
+        if self.packet_size is None:
+            if len(data) < 4:
+                self.pending = _bytes(data)
+                return []
+            total_size = unpack("I",data[:4])[0]
+            self.user_packet_size = total_size / self.users
+            if not self.user_packet_size in [28, 72]:
+                if self.verbose: print("WRN packet size would be  %i" % self.user_packet_size)
+            self.packet_size = 28 if self.user_packet_size == 28 else 72
+            offset = 4
+        complete = offset + (len(data) - offset) // self.packet_size * self.packet_size
+        self.pending = _bytes(data[complete:])
+        users = list(iter_user_records(memoryview(data)[offset:complete], self.user_packet_size, self.encoding, self.verbose))
+        for user in users:
+            if user.uid > self.max_uid: self.max_uid = user.uid
+            self.user_ids.add(user.user_id)
+        return users
+
+    def next_ids(self):
+        """
+        :return: (next_uid, next_user_id) or None when no user data arrived
+        """
+        if self.verbose: print("user size {}".format(self.received))
+        if self.received <= 4:
+            print("WRN: missing user data")
+            return None
+        max_uid = self.max_uid + 1
+        next_user_id = str(max_uid)
+        while next_user_id in self.user_ids:
+            max_uid += 1
+            next_user_id = str(max_uid)
+        return self.max_uid + 1, next_user_id
+
+
+class TemplateDecoder(object):
+    """
+    push decoder for the CMD_DB_RRQ / FCT_FINGERTMP buffer
+    """
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.total_size = None
+        self.pending = b''
+
+    def feed(self, chunk):
+        """
+        :return: list of Finger decoded so far
+        """
+        data = bytearray(self.pending) + chunk if self.pending else chunk
+        offset = 0
+        if self.total_size is None:
+            if len(data) < 4:
+                self.pending = _bytes(data)
+                return []
+            self.total_size = unpack('i', data[0:4])[0]
+            if self.verbose: print ("get template total size {}".format(self.total_size))
+            offset = 4
+        fingers = []
+        view = memoryview(data)
+        while self.total_size > 0 and len(data) - offset >= _TEMPLATE_HEADER.size:
+            size, uid, fid, valid = _TEMPLATE_HEADER.unpack_from(view, offset)
+            if size < _TEMPLATE_HEADER.size or len(data) - offset < size:
+                break
+            finger = Finger(uid, fid, valid, _bytes(view[offset + 6:offset + size]))
+            if self.verbose: print(finger)
+            fingers.append(finger)
+            offset += size
+            self.total_size -= size
+        self.pending = _bytes(data[offset:])
+        return fingers
+
+    def close(self):
+        if self.total_size is None:
+            if self.verbose: print("WRN: no user data")
+        return []
+
+
+def iter_live_events(data, index):
+    """
+    decode the payload of a CMD_REG_EVENT (EF_ATTLOG) packet
+
+    :param data: packet payload (without headers)
+    :param index: UserIndex used to resolve the uid
+    :return: generator of Attendance objects
+    """
+    while len(data) >= 10:
+        if len(data) == 10:
+            user_id, status, punch, timehex = unpack('<HBB6s', data)
+            data = data[10:]
+        elif len(data) == 12:
+            user_id, status, punch, timehex = unpack('<IBB6s', data)
+            data = data[12:]
+        elif len(data) == 14:
+            user_id, status, punch, timehex, _other = unpack('<HBB6s4s', data)
+            data = data[14:]
+        elif len(data) == 32:
+            user_id,  status, punch, timehex = unpack('<24sBB6s', data[:32])
+            data = data[32:]
+        elif len(data) == 36:
+            user_id,  status, punch, timehex, _other = unpack('<24sBB6s4s', data[:36])
+            data = data[36:]
+        elif len(data) == 37:
+            user_id,  status, punch, timehex, _other = unpack('<24sBB6s5s', data[:37])
+            data = data[37:]
+        elif len(data) >= 52:
+            user_id,  status, punch, timehex, _other = unpack('<24sBB6s20s', data[:52])
+            data = data[52:]
+        if isinstance(user_id, int):
+            user_id = str(user_id)
+        else:
+            user_id = (user_id.split(b'\x00')[0]).decode(errors='ignore')
+        timestamp = decode_timehex(timehex)
+        tuser = index.find_user_id(user_id)
+        if not tuser:
+            uid = int(user_id)
+        else:
+            uid = tuser.uid
+        yield Attendance(user_id, timestamp, status, punch, uid)
+
+
 class ZK_helper(object):
     """
     ZK helper class
     """
 
-    def __init__(self, ip, port=4370):
+    def __init__(self, ip, port=4370, timeout=1.0):
         """
         Construct a new 'ZK_helper' object.
+
+        :param timeout: seconds allowed to every probe (may be below 1)
         """
         self.address = (ip, port)
         self.ip = ip
         self.port = port
+        self.timeout = timeout
+        self.client = None
+        self.tcp_result = None
+
+    def __probe_tcp(self):
+        """
+        open a TCP connection to the device port within timeout, keeping
+        it (see take_socket) when it succeeds
 
-    def test_ping(self):
+        :return: connect_ex result
         """
-        Returns True if host responds to a ping request
+        self.close()
+        client = socket(AF_INET, SOCK_STREAM)
+        client.settimeout(self.timeout)
+        try:
+            res = client.connect_ex(self.address)
+        except Exception:
+            res = errno.ETIMEDOUT
+        if res == 0:
+            self.client = client
+        else:
+            client.close()
+        self.tcp_result = res
+        return res
 
+    def test_ping(self, udp=False):
+        """
+        Returns True if host answers in time, probing the device port in
+        process instead of running ping: a connection refused also proves
+        the host is up (UDP only devices)
+
+        :param udp: probe with test_udp instead, for sessions that will not
+            use TCP (firewalls may drop the TCP connection silently)
         :return: bool
         """
-        import subprocess, platform
-        # Ping parameters as function of OS
-        ping_str = "-n 1" if  platform.system().lower()=="windows" else "-c 1 -W 5"
-        args = "ping " + " " + ping_str + " " + self.ip
-        need_sh = False if  platform.system().lower()=="windows" else True
-        # Ping
-        return subprocess.call(args,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE,
-                            shell=need_sh) == 0
+        if udp:
+            return self.test_udp()
+        res = self.__probe_tcp()
+        return res == 0 or res in _REFUSED
 
     def test_tcp(self):
         """
-        test TCP connection
+        test TCP connection, reusing the connection opened by test_ping
+
+        :return: 0 if the device accepts TCP connections
+        """
+        if self.client is not None and self.tcp_result == 0:
+            return 0
+        return self.__probe_tcp()
+
+    def take_socket(self):
         """
+        hand over the connected TCP probe socket (None if there is none)
+        """
+        client, self.client = self.client, None
+        self.tcp_result = None
+        return client
 
-        self.client = socket(AF_INET, SOCK_STREAM)
-        self.client.settimeout(10)
-        res = self.client.connect_ex(self.address)
-        self.client.close()
-        return res
+    def close(self):
+        """
+        close the probe socket if it was not taken
+        """
+        client = self.take_socket()
+        if client is not None:
+            try:
+                client.close()
+            except Exception:
+                pass
 
     def test_udp(self):
         """
-        test UDP connection
+        test UDP connection, sending CMD_CONNECT within timeout (the session
+        it opens is closed right away)
+
+        :return: bool
         """
-        self.client = socket(AF_INET, SOCK_DGRAM)
-        self.client.settimeout(10)
+        client = socket(AF_INET, SOCK_DGRAM)
+        client.settimeout(self.timeout)
+        try:
+            client.sendto(create_header(const.CMD_CONNECT, b'', 0, const.USHRT_MAX - 1), self.address)
+            data = client.recv(1024)
+            if len(data) < 8:
+                return False
+            command, _checksum, session_id, reply_id = unpack('<4H', data[:8])
+            if command not in [const.CMD_ACK_OK, const.CMD_ACK_UNAUTH]:
+                return False
+            client.sendto(create_header(const.CMD_EXIT, b'', session_id, reply_id), self.address)
+            return True
+        except Exception:
+            return False
+        finally:
+            client.close()
 
 
 class ZK(object):
     """
     ZK main class
     """
-    def __init__(self, ip, port=4370, timeout=60, password=0, force_udp=False, ommit_ping=False, verbose=False, encoding='UTF-8'):
+    def __init__(self, ip, port=4370, timeout=60, password=0, force_udp=False, ommit_ping=False, verbose=False, encoding='UTF-8', read_pipeline=0, probe_timeout=1.0, capabilities=None, write_pipeline=0, reconnects=0, instrument=None, transport=None):
         """
         Construct a new 'ZK' object.
 
@@ -122,6 +994,22 @@ class ZK(object):
         :param omit_ping: check ip using ping before connect
         :param verbose: showing log while run the commands
         :param encoding: user encoding
+        :param read_pipeline: number of buffer chunk requests kept in flight
+            while reading (0 or 1: one request at a time)
+        :param probe_timeout: seconds allowed to the reachability and TCP
+            probes done by connect (may be below 1)
+        :param capabilities: profile saved from get_capabilities() in a
+            previous session, skips the probes it answers (dropped when the
+            firmware version changed)
+        :param write_pipeline: number of CMD_DATA chunks sent before
+            waiting for their CMD_ACK_OK while uploading (0 or 1: one at a time)
+        :param reconnects: times a buffered read reconnects after losing the
+            connection, then continues from the first missing chunk
+        :param instrument: zk.instrument.Instrument receiving the commands,
+            chunks, retries and decode times of the session (see
+            zk.instrument.CommandStats)
+        :param transport: zk.transport.Transport creating the sockets, to
+            record the session (Recorder) or replay a recorded one (Replayer)
         """
         User.encoding = encoding
         self.__address = (ip, port)
@@ -133,10 +1021,13 @@ class ZK(object):
         self.__reply_id = const.USHRT_MAX - 1
         self.__data_recv = None
         self.__data = None
+        self.__pending = b'' # received bytes not read yet (see __recv_into)
+        self.__datagram = None # udp receive buffer
 
         self.is_connect = False
         self.is_enabled = True
         self.helper = ZK_helper(ip, port)
+        self.helper.timeout = probe_timeout
         self.force_udp = force_udp
         self.ommit_ping = ommit_ping
         self.verbose = verbose
@@ -159,6 +1050,19 @@ class ZK(object):
         self.next_user_id='1'
         self.user_packet_size = 28 # default zk6
         self.end_live_capture = False
+        self.read_pipeline = read_pipeline
+        self.write_pipeline = write_pipeline
+        self.reconnects = reconnects
+        self.instrument = instrument
+        self.transport = transport
+        self.write_chunk = None # CMD_DATA size, set by the first upload (see _send_with_buffer)
+        self.__save_usertemps = True # cleared when _CMD_SAVE_USERTEMPS is rejected
+        self.__user_index = None # UserIndex cached for the session
+        self.__user_count = 0 # users on the terminal according to the cache
+        self.record_size = None
+        self.attendance_position = None
+        self.attendance_incremental = False
+        self.capabilities = dict(capabilities or {})
 
     def __nonzero__(self):
         """
@@ -167,72 +1071,62 @@ class ZK(object):
         return self.is_connect
 
     def __create_socket(self):
-        if self.tcp:
-            self.__sock = socket(AF_INET, SOCK_STREAM)
+        try:
+            self.__sock.close() # the one of a previous session
+        except Exception:
+            pass
+        if self.transport is not None:
+            self.__sock = self.transport.socket(self.tcp, self.__open_socket)
             self.__sock.settimeout(self.__timeout)
-            self.__sock.connect_ex(self.__address)
         else:
-            self.__sock = socket(AF_INET, SOCK_DGRAM)
-            self.__sock.settimeout(self.__timeout)
+            self.__sock = self.__open_socket()
+
+    def __close_socket(self):
+        """
+        close the session socket and the probe one if it was not taken
+        """
+        self.helper.close()
+        try:
+            self.__sock.close()
+        except Exception:
+            pass
+
+    def __open_socket(self):
+        probe = self.helper.take_socket()
+        if not isinstance(probe, _SOCKET_TYPE):
+            probe = None
+        if self.tcp and probe is not None:
+            # the connection opened by the probe becomes the session socket
+            sock = probe
+            sock.settimeout(self.__timeout)
+        elif self.tcp:
+            sock = socket(AF_INET, SOCK_STREAM)
+            sock.settimeout(self.__timeout)
+            sock.connect_ex(self.__address)
+        else:
+            if probe is not None:
+                probe.close()
+            sock = socket(AF_INET, SOCK_DGRAM)
+            sock.settimeout(self.__timeout)
+        return sock
 
     def __create_tcp_top(self, packet):
         """
         witch the complete packet set top header
         """
-        length = len(packet)
-        top = pack('<HHI', const.MACHINE_PREPARE_DATA_1, const.MACHINE_PREPARE_DATA_2, length)
-        return top + packet
+        return create_tcp_top(packet)
 
     def __create_header(self, command, command_string, session_id, reply_id):
         """
         Puts a the parts that make up a packet together and packs them into a byte string
         """
-        buf = pack('<4H', command, 0, session_id, reply_id) + command_string
-        buf = unpack('8B' + '%sB' % len(command_string), buf)
-        checksum = unpack('H', self.__create_checksum(buf))[0]
-        reply_id += 1
-        if reply_id >= const.USHRT_MAX:
-            reply_id -= const.USHRT_MAX
-
-        buf = pack('<4H', command, checksum, session_id, reply_id)
-        return buf + command_string
-
-    def __create_checksum(self, p):
-        """
-        Calculates the checksum of the packet to be sent to the time clock
-        Copied from zkemsdk.c
-        """
-        l = len(p)
-        checksum = 0
-        while l > 1:
-            checksum += unpack('H', pack('BB', p[0], p[1]))[0]
-            p = p[2:]
-            if checksum > const.USHRT_MAX:
-                checksum -= const.USHRT_MAX
-            l -= 2
-        if l:
-            checksum = checksum + p[-1]
-
-        while checksum > const.USHRT_MAX:
-            checksum -= const.USHRT_MAX
-
-        checksum = ~checksum
-
-        while checksum < 0:
-            checksum += const.USHRT_MAX
-
-        return pack('H', checksum)
+        return create_header(command, command_string, session_id, reply_id)
 
     def __test_tcp_top(self, packet):
         """
         return size!
         """
-        if len(packet)<=8:
-            return 0
-        tcp_header = unpack('<HHI', packet[:8])
-        if tcp_header[0] == const.MACHINE_PREPARE_DATA_1 and tcp_header[1] == const.MACHINE_PREPARE_DATA_2:
-            return tcp_header[2]
-        return 0
+        return test_tcp_top(packet)
 
     def __send_command(self, command, command_string=b'', response_size=8):
         """
@@ -242,6 +1136,10 @@ class ZK(object):
             raise ZKErrorConnection("instance are not connected.")
 
         buf = self.__create_header(command, command_string, self.__session_id, self.__reply_id)
+        self.__pending = b''
+        instrument = self.instrument
+        if instrument is not None:
+            started = clock()
         try:
             if self.tcp:
                 top = self.__create_tcp_top(buf)
@@ -257,7 +1155,12 @@ class ZK(object):
                 self.__data_recv = self.__sock.recv(response_size)
                 self.__header = unpack('<4H', self.__data_recv[:8])
         except Exception as e:
+            if instrument is not None:
+                instrument.command(command, None, len(buf), 0, clock() - started)
             raise ZKNetworkError(str(e))
+        if instrument is not None:
+            instrument.command(command, self.__header[0], len(buf) + 8 * self.tcp,
+                               len(self.__data_recv) + 8 * self.tcp, clock() - started)
 
         self.__response = self.__header[0]
         self.__reply_id = self.__header[3]
@@ -272,6 +1175,92 @@ class ZK(object):
             'code': self.__response
         }
 
+    def __send_packet(self, command, command_string=b''):
+        """
+        send a command without waiting for the reply
+
+        :return: reply_id used by the terminal to answer it
+        """
+        buf = self.__create_header(command, command_string, self.__session_id, self.__reply_id)
+        self.__reply_id = unpack('<4H', buf[:8])[3]
+        try:
+            if self.tcp:
+                self.__sock.sendall(self.__create_tcp_top(buf))
+            else:
+                self.__sock.sendto(buf, self.__address)
+        except Exception as e:
+            raise ZKNetworkError(str(e))
+        return self.__reply_id
+
+    def __recv_packet(self):
+        """
+        receive exactly one packet from the terminal
+
+        :return: command, reply_id, data
+        """
+        command, reply_id, size = self.__recv_header()
+        data = self.__recieve_raw_data(size)
+        return command, reply_id, data
+
+    def __recv_header(self):
+        """
+        receive the headers of the next packet, its payload is read next
+        with __recv_into (for udp from the datagram kept in __pending)
+
+        :return: command, reply_id, payload size
+        """
+        if self.tcp:
+            header = bytearray(16)
+            self.__recv_into(memoryview(header))
+            magic1, magic2, length, command, _checksum, _session_id, reply_id = unpack('<HHI4H', header)
+            if magic1 != const.MACHINE_PREPARE_DATA_1 or magic2 != const.MACHINE_PREPARE_DATA_2 or length < 8:
+                raise ZKErrorResponse("TCP packet invalid")
+            return command, reply_id, length - 8
+        if self.__datagram is None:
+            self.__datagram = bytearray(0x10000)
+        size = self.__sock.recv_into(self.__datagram)
+        if size < 8:
+            raise ZKErrorResponse("UDP packet invalid")
+        command, _checksum, _session_id, reply_id = unpack_from('<4H', self.__datagram)
+        self.__pending = memoryview(self.__datagram)[8:size]
+        return command, reply_id, size - 8
+
+    def __recv_into(self, view):
+        """
+        fill view with the next bytes received: first the ones left in
+        __pending by the previous reply, then from the socket (tcp only,
+        an udp payload is always whole in __pending)
+        """
+        size = len(view)
+        filled = 0
+        pending = self.__pending
+        if pending:
+            filled = min(len(pending), size)
+            view[:filled] = pending[:filled]
+            self.__pending = pending[filled:]
+        while filled < size:
+            if not self.tcp:
+                raise ZKErrorResponse("UDP packet too short")
+            recieved = self.__sock.recv_into(view[filled:], size - filled)
+            if not recieved:
+                raise ZKNetworkError("connection closed by the device")
+            if self.verbose: print ("partial recv {}".format(recieved))
+            filled += recieved
+
+    def __drain(self, wait=1):
+        """
+        discard every pending reply
+        """
+        self.__pending = b''
+        self.__sock.settimeout(wait)
+        try:
+            while self.__sock.recv(0xFFFF):
+                pass
+        except Exception:
+            pass
+        finally:
+            self.__sock.settimeout(self.__timeout)
+
     def __ack_ok(self):
         """
         event ack ok
@@ -312,37 +1301,13 @@ class ZK(object):
 
         copied from zkemsdk.c - DecodeTime
         """
-
-        t = unpack("<I", t)[0]
-        second = t % 60
-        t = t // 60
-
-        minute = t % 60
-        t = t // 60
-
-        hour = t % 24
-        t = t // 24
-
-        day = t % 31 + 1
-        t = t // 31
-
-        month = t % 12 + 1
-        t = t // 12
-
-        year = t + 2000
-
-        d = datetime(year, month, day, hour, minute, second)
-
-        return d
+        return decode_time(unpack("<I", t)[0])
 
     def __decode_timehex(self, timehex):
         """
         timehex string of six bytes
         """
-        year, month, day, hour, minute, second = unpack("6B", timehex)
-        year += 2000
-        d = datetime(year, month, day, hour, minute, second)
-        return d
+        return decode_timehex(timehex)
 
     def __encode_time(self, t):
         """
@@ -363,27 +1328,46 @@ class ZK(object):
         :return: bool
         """
         self.end_live_capture = False
-        if not self.ommit_ping and not self.helper.test_ping():
+        self.__user_index = None
+        replay = self.transport is not None and self.transport.tcp is not None
+        if not replay and not self.ommit_ping and not self.helper.test_ping(self.force_udp):
+            self.__close_socket()
             raise ZKNetworkError("can't reach device (ping %s)" % self.__address[0])
-        if not self.force_udp and self.helper.test_tcp() == 0:
-            self.user_packet_size = 72 # default zk8
-        self.__create_socket()
-        self.__session_id = 0
-        self.__reply_id = const.USHRT_MAX - 1
-        cmd_response = self.__send_command(const.CMD_CONNECT)
-        self.__session_id = self.__header[2]
-        if cmd_response.get('code') == const.CMD_ACK_UNAUTH:
-            if self.verbose: print ("try auth")
-            command_string = make_commkey(self.__password, self.__session_id)
-            cmd_response = self.__send_command(const.CMD_AUTH, command_string)
-        if cmd_response.get('status'):
-            self.is_connect = True
-            return self
-        else:
-            if cmd_response["code"] == const.CMD_ACK_UNAUTH:
-                raise ZKErrorResponse("Unauthenticated")
-            if self.verbose: print ("connect err response {} ".format(cmd_response["code"]))
-            raise ZKErrorResponse("Invalid response: Can't connect")
+        try:
+            seeded = bool(self.capabilities.get('firmware')) and 'tcp' in self.capabilities
+            if replay:
+                # the capture was recorded over this protocol, nothing to probe
+                self.tcp = self.transport.tcp
+                self.user_packet_size = 72 if self.tcp else 28
+            elif seeded and not self.force_udp:
+                self.tcp = self.capabilities['tcp']
+                self.user_packet_size = self.capabilities.get('user_packet_size', 72 if self.tcp else 28)
+            elif not self.force_udp and self.helper.test_tcp() == 0:
+                self.user_packet_size = 72 # default zk8
+            self.__create_socket()
+            self.__session_id = 0
+            self.__reply_id = const.USHRT_MAX - 1
+            cmd_response = self.__send_command(const.CMD_CONNECT)
+            self.__session_id = self.__header[2]
+            if cmd_response.get('code') == const.CMD_ACK_UNAUTH:
+                if self.verbose: print ("try auth")
+                command_string = make_commkey(self.__password, self.__session_id)
+                cmd_response = self.__send_command(const.CMD_AUTH, command_string)
+            if cmd_response.get('status'):
+                self.is_connect = True
+                if seeded:
+                    self.__check_capabilities()
+                return self
+            else:
+                if cmd_response["code"] == const.CMD_ACK_UNAUTH:
+                    raise ZKErrorResponse("Unauthenticated")
+                if self.verbose: print ("connect err response {} ".format(cmd_response["code"]))
+                raise ZKErrorResponse("Invalid response: Can't connect")
+        except Exception:
+            # the probe and session sockets are not handed to anyone
+            self.is_connect = False
+            self.__close_socket()
+            raise
 
     def disconnect(self):
         """
@@ -391,7 +1375,13 @@ class ZK(object):
 
         :return: bool
         """
-        cmd_response = self.__send_command(const.CMD_EXIT)
+        try:
+            cmd_response = self.__send_command(const.CMD_EXIT)
+        except Exception:
+            # the connection is gone, nothing left to close it for
+            self.is_connect = False
+            self.__close_socket()
+            raise
         if cmd_response.get('status'):
             self.is_connect = False
             if self.__sock:
@@ -400,6 +1390,54 @@ class ZK(object):
         else:
             raise ZKErrorResponse("can't disconnect")
 
+    def __check_capabilities(self):
+        """
+        drop the seeded profile when the firmware version or the identity
+        (serial number, the mac when the profile has none) changed: another
+        terminal may have taken the address the profile was saved for
+        """
+        seeded = dict((key, self.capabilities.pop(key, None)) for key in ('firmware', 'serialnumber', 'mac'))
+        checks = [('firmware', self.get_firmware_version), ('serialnumber', self.get_serialnumber)]
+        if not seeded['serialnumber'] and seeded['mac']:
+            checks.append(('mac', self.get_mac))
+        current = {}
+        for key, read in checks:
+            try:
+                current[key] = read() # not in the profile any more: read live
+            except ZKErrorResponse:
+                current[key] = None
+        if any(current[key] != seeded[key] for key in current):
+            if self.verbose: print ("terminal changed {} -> {}, profile dropped".format(seeded, current))
+            self.capabilities = dict((key, value) for key, value in current.items() if value)
+            self.user_packet_size = 72 if self.tcp else 28
+            self.write_chunk = None
+        elif seeded['mac'] and 'mac' not in current:
+            self.capabilities['mac'] = seeded['mac']
+
+    def get_capabilities(self):
+        """
+        facts that never change for a device (transport, packet sizes,
+        formats, firmware), to be saved and given back to the constructor
+
+        :return: dict
+        """
+        self.get_firmware_version()
+        self.get_serialnumber()
+        self.get_mac()
+        self.get_platform()
+        self.get_extend_fmt()
+        self.get_user_extend_fmt()
+        try:
+            self.get_pin_width()
+        except ZKErrorResponse:
+            pass
+        self.capabilities['tcp'] = self.tcp
+        self.capabilities['user_packet_size'] = int(self.user_packet_size)
+        self.capabilities['encoding'] = self.encoding
+        if self.record_size is not None:
+            self.capabilities['record_size'] = self.record_size
+        return dict(self.capabilities)
+
     def enable_device(self):
         """
         re-enable the connected device and allow user activity in device again
@@ -430,17 +1468,24 @@ class ZK(object):
         """
         :return: the firmware version
         """
+        if 'firmware' in self.capabilities:
+            return self.capabilities['firmware']
         cmd_response = self.__send_command(const.CMD_GET_VERSION,b'', 1024)
         if cmd_response.get('status'):
             firmware_version = self.__data.split(b'\x00')[0]
-            return firmware_version.decode()
+            self.capabilities['firmware'] = firmware_version.decode()
+            return self.capabilities['firmware']
         else:
             raise ZKErrorResponse("Can't read frimware version")
 
-    def get_serialnumber(self):
+    def get_serialnumber(self, live=False):
         """
+        :param live: read it from the terminal even when the capability
+            profile has it (checks the identity of the terminal)
         :return: the serial number
         """
+        if 'serialnumber' in self.capabilities and not live:
+            return self.capabilities['serialnumber']
         command = const.CMD_OPTIONS_RRQ
         command_string = b'~SerialNumber\x00'
         response_size = 1024
@@ -448,7 +1493,8 @@ class ZK(object):
         if cmd_response.get('status'):
             serialnumber = self.__data.split(b'=', 1)[-1].split(b'\x00')[0]
             serialnumber = serialnumber.replace(b'=', b'')
-            return serialnumber.decode() # string?
+            self.capabilities['serialnumber'] = serialnumber.decode() # string?
+            return self.capabilities['serialnumber']
         else:
             raise ZKErrorResponse("Can't read serial number")
 
@@ -456,6 +1502,8 @@ class ZK(object):
         """
         :return: the platform name
         """
+        if 'platform' in self.capabilities:
+            return self.capabilities['platform']
         command = const.CMD_OPTIONS_RRQ
         command_string = b'~Platform\x00'
         response_size = 1024
@@ -464,7 +1512,8 @@ class ZK(object):
         if cmd_response.get('status'):
             platform = self.__data.split(b'=', 1)[-1].split(b'\x00')[0]
             platform = platform.replace(b'=', b'')
-            return platform.decode()
+            self.capabilities['platform'] = platform.decode()
+            return self.capabilities['platform']
         else:
             raise ZKErrorResponse("Can't read platform name")
 
@@ -472,6 +1521,8 @@ class ZK(object):
         """
         :return: the machine's mac address
         """
+        if 'mac' in self.capabilities:
+            return self.capabilities['mac']
         command = const.CMD_OPTIONS_RRQ
         command_string = b'MAC\x00'
         response_size = 1024
@@ -479,7 +1530,8 @@ class ZK(object):
         cmd_response = self.__send_command(command, command_string, response_size)
         if cmd_response.get('status'):
             mac = self.__data.split(b'=', 1)[-1].split(b'\x00')[0]
-            return mac.decode()
+            self.capabilities['mac'] = mac.decode()
+            return self.capabilities['mac']
         else:
             raise ZKErrorResponse("can't read mac address")
 
@@ -544,6 +1596,8 @@ class ZK(object):
         """
         determine extend fmt
         """
+        if 'extend_fmt' in self.capabilities:
+            return self.capabilities['extend_fmt']
         command = const.CMD_OPTIONS_RRQ
         command_string = b'~ExtendFmt\x00'
         response_size = 1024
@@ -551,7 +1605,8 @@ class ZK(object):
         cmd_response = self.__send_command(command, command_string, response_size)
         if cmd_response.get('status'):
             fmt = (self.__data.split(b'=', 1)[-1].split(b'\x00')[0])
-            return safe_cast(fmt, int, 0) if fmt else 0
+            self.capabilities['extend_fmt'] = safe_cast(fmt, int, 0) if fmt else 0
+            return self.capabilities['extend_fmt']
         else:
             self._clear_error(command_string)
             return None
@@ -560,6 +1615,8 @@ class ZK(object):
         """
         determine user extend fmt
         """
+        if 'user_extend_fmt' in self.capabilities:
+            return self.capabilities['user_extend_fmt']
         command = const.CMD_OPTIONS_RRQ
         command_string = b'~UserExtFmt\x00'
         response_size = 1024
@@ -567,7 +1624,8 @@ class ZK(object):
         cmd_response = self.__send_command(command, command_string, response_size)
         if cmd_response.get('status'):
             fmt = (self.__data.split(b'=', 1)[-1].split(b'\x00')[0])
-            return safe_cast(fmt, int, 0) if fmt else 0
+            self.capabilities['user_extend_fmt'] = safe_cast(fmt, int, 0) if fmt else 0
+            return self.capabilities['user_extend_fmt']
         else:
             self._clear_error(command_string)
             return None
@@ -626,13 +1684,16 @@ class ZK(object):
         """
         :return: the PIN width
         """
+        if 'pin_width' in self.capabilities:
+            return self.capabilities['pin_width']
         command = const.CMD_GET_PINWIDTH
         command_string = b' P'
         response_size = 9
         cmd_response = self.__send_command(command, command_string, response_size)
         if cmd_response.get('status'):
             width = self.__data.split(b'\x00')[0]
-            return bytearray(width)[0]
+            self.capabilities['pin_width'] = bytearray(width)[0]
+            return self.capabilities['pin_width']
         else:
             raise ZKErrorResponse("can0t get pin width")
 
@@ -658,25 +1719,11 @@ class ZK(object):
         cmd_response = self.__send_command(command,b'', response_size)
         if cmd_response.get('status'):
             if self.verbose: print(codecs.encode(self.__data,'hex'))
-            size = len(self.__data)
-            if len(self.__data) >= 80:
-                fields = unpack('20i', self.__data[:80])
-                self.users = fields[4]
-                self.fingers = fields[6]
-                self.records = fields[8]
-                self.dummy = fields[10] #???
-                self.cards = fields[12]
-                self.fingers_cap = fields[14]
-                self.users_cap = fields[15]
-                self.rec_cap = fields[16]
-                self.fingers_av = fields[17]
-                self.users_av = fields[18]
-                self.rec_av = fields[19]
-                self.__data = self.__data[80:]
-            if len(self.__data) >= 12: #face info
-                fields = unpack('3i', self.__data[:12]) #dirty hack! we need more information
-                self.faces = fields[0]
-                self.faces_cap = fields[2]
+            for field, value in decode_sizes(self.__data).items():
+                setattr(self, field, value)
+            if self.__user_index is not None and self.users != self.__user_count:
+                if self.verbose: print ("user count changed, dropping the user index")
+                self.__user_index = None
             return True
         else:
             raise ZKErrorResponse("can't read sizes")
@@ -892,7 +1939,20 @@ class ZK(object):
         :param card: card
         :return: bool
         """
-        command = const.CMD_USER_WRQ
+        user, command_string = self.__pack_user_wrq(uid, name, privilege, password, group_id, user_id, card)
+        response_size = 1024 #TODO check response?
+        cmd_response = self.__send_command(const.CMD_USER_WRQ, command_string, response_size)
+        if self.verbose: print("Response: %s" % cmd_response)
+        if not cmd_response.get('status'):
+            raise ZKErrorResponse("Can't set user")
+        self.refresh_data()
+        self.__user_written(user.uid, user.user_id)
+        self.__user_indexed(user)
+
+    def __pack_user_wrq(self, uid, name, privilege, password, group_id, user_id, card):
+        """
+        :return: User as written, CMD_USER_WRQ command string
+        """
         if uid is None:
             uid = self.next_uid
             if not user_id:
@@ -904,29 +1964,95 @@ class ZK(object):
             privilege = const.USER_DEFAULT
         privilege = int(privilege)
         if self.user_packet_size == 28: #self.firmware == 6:
-            if not group_id:
-                group_id = 0
             try:
-                command_string = pack('HB5s8sIxBHI', uid, privilege, password.encode(self.encoding, errors='ignore'), name.encode(self.encoding, errors='ignore'), card, int(group_id), 0, int(user_id))
+                command_string = pack_user(uid, name, privilege, password, group_id, user_id, card, 28, self.encoding)
             except Exception as e:
                 if self.verbose: print("s_h Error pack: %s" % e)
                 if self.verbose: print("Error pack: %s" % sys.exc_info()[0])
                 raise ZKErrorResponse("Can't pack user")
         else:
-            name_pad = name.encode(self.encoding, errors='ignore').ljust(24, b'\x00')[:24]
-            card_str = pack('<I', int(card))[:4]
-            command_string = pack('HB8s24s4sx7sx24s', uid, privilege, password.encode(self.encoding, errors='ignore'), name_pad, card_str, group_id.encode(), user_id.encode())
-        response_size = 1024 #TODO check response?
-        cmd_response = self.__send_command(command, command_string, response_size)
-        if self.verbose: print("Response: %s" % cmd_response)
-        if not cmd_response.get('status'):
-            raise ZKErrorResponse("Can't set user")
-        self.refresh_data()
+            command_string = pack_user(uid, name, privilege, password, group_id, user_id, card, 72, self.encoding)
+        return User(uid, name, privilege, password, group_id, user_id, card), command_string
+
+    def __user_indexed(self, user=None, uid=None):
+        """
+        keep the cached user index in sync with a written (user) or
+        deleted (uid) user
+        """
+        if self.__user_index is None:
+            return
+        if user is not None:
+            if self.__user_index.add(user):
+                self.__user_count += 1
+        elif self.__user_index.remove(uid) is not None:
+            self.__user_count -= 1
+
+    def get_user_index(self, check=True):
+        """
+        uid / user_id lookups of the terminal users (UserIndex), cached for
+        the session. built by get_users / iter_users, kept up to date by
+        set_user(s), save_user_template and delete_user(s), and downloaded
+        again when read_sizes reports another user count.
+
+        :param check: call read_sizes first to validate the cache
+        :return: UserIndex
+        """
+        if self.__user_index is not None and check:
+            self.read_sizes()
+        if self.__user_index is None:
+            self.get_users()
+        return self.__user_index or UserIndex()
+
+    def __user_written(self, uid, user_id):
         if self.next_uid == uid:
             self.next_uid += 1 # better recalculate again
         if self.next_user_id == user_id:
             self.next_user_id = str(self.next_uid)
 
+    def set_users(self, users, high_rate=False):
+        """
+        create or update many users with a single CMD_REFRESHDATA
+
+        the CMD_USER_WRQ commands are streamed (see write_pipeline) and
+        every ACK is checked. with high_rate the batch is uploaded in one
+        buffer with _CMD_SAVE_USERTEMPS instead, falling back to
+        CMD_USER_WRQ when the terminal doesn't support it. the buffer has
+        no templates: most firmwares delete the fingerprints of the users
+        it holds, use it only for users without any.
+
+        :param users: iterable of User (uid None: next free uid)
+        :param high_rate: upload the users with _CMD_SAVE_USERTEMPS
+        :return: number of users written
+        """
+        written = [] # (User, CMD_USER_WRQ command string)
+        next_uid, next_user_id = self.next_uid, self.next_user_id
+        try:
+            for user in users:
+                if not isinstance(user, User):
+                    raise ZKErrorResponse("Invalid user in users list")
+                written.append(self.__pack_user_wrq(user.uid, user.name, user.privilege, user.password, user.group_id, user.user_id, user.card))
+                self.__user_written(written[-1][0].uid, written[-1][0].user_id) # users without uid get the next free one
+        finally:
+            self.next_uid, self.next_user_id = next_uid, next_user_id
+        if not written:
+            return 0
+        if high_rate:
+            try:
+                self.HR_save_usertemplates([(user, []) for user, _command_string in written])
+                high_rate = True
+            except ZKErrorResponse as e:
+                if self.verbose: print ("_CMD_SAVE_USERTEMPS failed ({}), sending CMD_USER_WRQ".format(e))
+                self.__save_usertemps = False
+                high_rate = False
+        if not high_rate:
+            self.__send_commands([(const.CMD_USER_WRQ, command_string) for _user, command_string in written], "Can't set user")
+            self.refresh_data()
+        for user, _command_string in written:
+            self.__user_written(user.uid, user.user_id)
+            if not high_rate:
+                self.__user_indexed(user) # HR_save_usertemplates did it
+        return len(written)
+
     def save_user_template(self, user, fingers=[]):
         """
         save user and template
@@ -935,16 +2061,11 @@ class ZK(object):
         :param fingers: list of finger. (The maximum index 0-9)
         """
         if not isinstance(user, User):
-            users = self.get_users()
-            tusers = list(filter(lambda x: x.uid==user, users))
-            if len(tusers) == 1:
-                user = tusers[0]
-            else:
-                tusers = list(filter(lambda x: x.user_id==str(user), users))
-                if len(tusers) == 1:
-                    user = tusers[0]
-                else:
-                    raise ZKErrorResponse("Can't find user")
+            users = self.get_user_index()
+            tuser = users.find_uid(user) or users.find_user_id(str(user))
+            if tuser is None:
+                raise ZKErrorResponse("Can't find user")
+            user = tuser
         if isinstance(fingers, Finger):
             fingers = [fingers]
         self.HR_save_usertemplates ([(user, fingers)])
@@ -955,27 +2076,29 @@ class ZK(object):
 
         :param [user,[fingers]]
         """
-        upack = b""
-        fpack = b""
-        table = b""
+        upack = []
+        fpack = []
+        table = []
         fnum = 0x10
         tstart = 0
         for user, fingers in usertemplates:
             if not isinstance(user, User):
                 raise ZKErrorResponse("Invalid user in usertemplates list")
             if self.user_packet_size == 28:
-                upack += user.repack29()
+                upack.append(user.repack29())
             else:
-                upack += user.repack73()
+                upack.append(user.repack73())
             for finger in fingers:
                 if not isinstance(finger, Finger):
                     raise ZKErrorResponse("Invalid finger template in usertemplates list")
                 tfp = finger.repack_only()
-                table += pack("<bHbI", 2, user.uid, fnum + finger.fid, tstart)
+                table.append(pack("<bHbI", 2, user.uid, fnum + finger.fid, tstart))
                 tstart += len(tfp)
-                fpack += tfp
-        head = pack("III", len(upack), len(table), len(fpack))
-        packet = head + upack + table + fpack
+                fpack.append(tfp)
+        upack = b''.join(upack)
+        table = b''.join(table)
+        head = pack("III", len(upack), len(table), tstart)
+        packet = b''.join([head, upack, table] + fpack)
         self._send_with_buffer(packet)
         command = const._CMD_SAVE_USERTEMPS
         command_string = pack('<IHH', 12,0,8)
@@ -983,9 +2106,49 @@ class ZK(object):
         if not cmd_response.get('status'):
             raise ZKErrorResponse("Can't save usertemplates")
         self.refresh_data()
+        for user, _fingers in usertemplates:
+            self.__user_indexed(user)
 
     def _send_with_buffer(self, buffer):
-        MAX_CHUNK = 1024
+        """
+        upload a buffer (CMD_PREPARE_DATA and CMD_DATA chunks)
+
+        over UDP chunks keep the 1024 bytes of older firmwares (one datagram
+        each). over TCP the first upload larger than that probes whether
+        the terminal takes chunks as large as the buffered reads use: the
+        first one is sent alone and given probe_timeout to be acknowledged.
+        the size found is kept in capabilities (write_chunk). if the
+        terminal rejects an upload, times out or drops the connection (the
+        session is opened again), it is restarted without pipelining, then
+        with 1024 bytes chunks, and the working settings are kept.
+        """
+        if self.write_chunk is None:
+            self.write_chunk = self.capabilities.get('write_chunk', 0xFFc0) if self.tcp else 1024
+        while True:
+            probe = self.tcp and 'write_chunk' not in self.capabilities and len(buffer) > 1024
+            try:
+                return self.__send_buffer(buffer, probe)
+            except (ZKErrorResponse, timeout) as e:
+                error = e
+                self.__drain()
+            except (ZKNetworkError, socket_error) as e:
+                error = e
+                self.__reopen_session()
+            if probe and 'write_chunk' not in self.capabilities:
+                self.write_chunk = 1024 # the first chunk was refused
+            elif self.write_pipeline > 1:
+                self.write_pipeline = 0
+            elif self.write_chunk > 1024:
+                self.write_chunk = 1024
+            else:
+                raise error
+            if self.tcp:
+                self.capabilities['write_chunk'] = self.write_chunk
+            if self.verbose: print ("upload failed ({}), retrying with {} bytes chunks, pipeline {}".format(error, self.write_chunk, self.write_pipeline))
+            if self.instrument is not None:
+                self.instrument.retry(const.CMD_DATA, 'upload')
+
+    def __send_buffer(self, buffer, probe=False):
         size = len(buffer)
         self.free_data()
         command = const.CMD_PREPARE_DATA
@@ -993,23 +2156,86 @@ class ZK(object):
         cmd_response = self.__send_command(command, command_string)
         if not cmd_response.get('status'):
             raise ZKErrorResponse("Can't prepare data")
-        remain = size % MAX_CHUNK
-        packets = (size - remain) // MAX_CHUNK
-        start = 0
-        for _wlk in range(packets):
-            self.__send_chunk(buffer[start:start+MAX_CHUNK])
-            start += MAX_CHUNK
-        if remain:
-            self.__send_chunk(buffer[start:start+remain])
+        chunks = range(0, size, self.write_chunk)
+        if probe:
+            self.__sock.settimeout(self.helper.timeout)
+            try:
+                self.__send_chunk(buffer[:self.write_chunk])
+            finally:
+                self.__sock.settimeout(self.__timeout)
+            self.capabilities['write_chunk'] = self.write_chunk
+            chunks = chunks[1:]
+        if self.write_pipeline > 1 and len(chunks) > 1:
+            self.__send_pipelined([(const.CMD_DATA, buffer[start:start + self.write_chunk]) for start in chunks], set())
+        else:
+            for start in chunks:
+                self.__send_chunk(buffer[start:start + self.write_chunk])
 
     def __send_chunk(self, command_string):
-        command = const.CMD_DATA
-        cmd_response = self.__send_command(command, command_string)
-        if cmd_response.get('status'):
+        instrument = self.instrument
+        if instrument is not None:
+            started = clock()
+        reply_id = self.__send_packet(const.CMD_DATA, command_string)
+        response, reply, _data = self.__recv_packet()
+        if response == const.CMD_ACK_OK and reply == reply_id:
+            if instrument is not None:
+                instrument.chunk(const.CMD_DATA, len(command_string), clock() - started)
             return True
         else:
             raise ZKErrorResponse("Can't send chunk")
 
+    def __send_pipelined(self, commands, done):
+        """
+        send commands keeping up to write_pipeline of them waiting for
+        their CMD_ACK_OK, matched by reply_id
+
+        :param commands: list of (command, command_string)
+        :param done: set, gets the index of every acknowledged command
+        """
+        instrument = self.instrument
+        queue = deque(range(len(commands)))
+        in_flight = {} # reply_id: (index, sent at)
+        while queue or in_flight:
+            while queue and len(in_flight) < self.write_pipeline:
+                index = queue.popleft()
+                in_flight[self.__send_packet(*commands[index])] = index, instrument and clock()
+            response, reply_id, _data = self.__recv_packet()
+            if reply_id not in in_flight:
+                raise ZKErrorResponse("unexpected reply id %i" % reply_id)
+            if response != const.CMD_ACK_OK:
+                raise ZKErrorResponse("pipelined write rejected (%i)" % response)
+            index, started = in_flight.pop(reply_id)
+            if instrument is not None:
+                command, command_string = commands[index]
+                instrument.chunk(command, len(command_string), clock() - started)
+            done.add(index)
+
+    def __send_commands(self, commands, error):
+        """
+        send commands checking every reply, pipelined when write_pipeline
+        is set. if the terminal rejects the pipeline, pending replies are
+        discarded and the commands not acknowledged are sent one by one.
+
+        :param commands: list of (command, command_string)
+        :param error: message of the ZKErrorResponse raised by a rejection
+        """
+        done = set()
+        if self.write_pipeline > 1 and len(commands) > 1:
+            try:
+                return self.__send_pipelined(commands, done)
+            except (ZKErrorResponse, timeout) as e:
+                if self.verbose: print ("pipelined write failed ({}), sending serially".format(e))
+                if self.instrument is not None:
+                    self.instrument.retry(commands[0][0], 'pipeline')
+                self.write_pipeline = 0 # don't try again on this session
+                self.__drain()
+        for index, (command, command_string) in enumerate(commands):
+            if index in done:
+                continue
+            cmd_response = self.__send_command(command, command_string, 1024)
+            if not cmd_response.get('status'):
+                raise ZKErrorResponse(error)
+
     def delete_user_template(self, uid=0, temp_id=0, user_id=''):
         """
         Delete specific template
@@ -1027,11 +2253,10 @@ class ZK(object):
             else:
                 return False # probably empty!
         if not uid:
-            users = self.get_users()
-            users = list(filter(lambda x: x.user_id==str(user_id), users))
-            if not users:
+            user = self.get_user_index().find_user_id(str(user_id))
+            if user is None:
                 return False
-            uid = users[0].uid
+            uid = user.uid
         command = const.CMD_DELETE_USERTEMP
         command_string = pack('hb', uid, temp_id)
         cmd_response = self.__send_command(command, command_string)
@@ -1049,20 +2274,40 @@ class ZK(object):
         :return: bool
         """
         if not uid:
-            users = self.get_users()
-            users = list(filter(lambda x: x.user_id==str(user_id), users))
-            if not users:
+            user = self.get_user_index().find_user_id(str(user_id))
+            if user is None:
                 return False
-            uid = users[0].uid
+            uid = user.uid
         command = const.CMD_DELETE_USER
         command_string = pack('h', uid)
         cmd_response = self.__send_command(command, command_string)
         if not cmd_response.get('status'):
             raise ZKErrorResponse("Can't delete user")
         self.refresh_data()
+        self.__user_indexed(uid=uid)
         if uid == (self.next_uid - 1):
             self.next_uid = uid
 
+    def delete_users(self, users):
+        """
+        delete many users with a single CMD_REFRESHDATA, streaming the
+        CMD_DELETE_USER commands (see write_pipeline)
+
+        :param users: iterable of uid or User
+        :return: number of users deleted
+        """
+        uids = [user.uid if isinstance(user, User) else int(user) for user in users]
+        if not uids:
+            return 0
+        self.__send_commands([(const.CMD_DELETE_USER, pack('h', uid)) for uid in uids], "Can't delete user")
+        self.refresh_data()
+        for uid in uids:
+            self.__user_indexed(uid=uid)
+        for uid in sorted(uids, reverse=True):
+            if uid == (self.next_uid - 1):
+                self.next_uid = uid
+        return len(uids)
+
     def get_user_template(self, uid = '', temp_id=0, user_id=''):
         """
         :param uid: user ID that are generated from device
@@ -1070,11 +2315,10 @@ class ZK(object):
         :return: list Finger object of the selected user
         """
         if not uid:
-            users = self.get_users()
-            users = list(filter(lambda x: x.user_id==str(user_id), users))
-            if not users:
+            user = self.get_user_index().find_user_id(str(user_id))
+            if user is None:
                 return False
-            uid = users[0].uid
+            uid = user.uid
         for _retries in range(3):
             command = const._CMD_GET_USERTEMP # command secret!!! GET_USER_TEMPLATE
             command_string = pack('hb', uid, temp_id)
@@ -1082,7 +2326,7 @@ class ZK(object):
             cmd_response = self.__send_command(command, command_string, response_size)
             data = self.__recieve_chunk()
             if data is not None:
-                resp = data[:-1]
+                resp = _bytes(data[:-1])
                 if resp[-6:] == b'\x00\x00\x00\x00\x00\x00': # padding? bug?
                     resp = resp[:-6]
                 return Finger(uid, temp_id, 1, resp)
@@ -1095,86 +2339,79 @@ class ZK(object):
         """
         :return: list of Finger object
         """
+        return list(self.iter_templates())
+
+    def iter_templates(self):
+        """
+        decode templates as every chunk arrives, without keeping the whole
+        template table in memory
+
+        :return: generator of Finger object
+        """
         self.read_sizes()
         if self.fingers == 0:
-            return []
-        templates = []
-        templatedata, size = self.read_with_buffer(const.CMD_DB_RRQ, const.FCT_FINGERTMP)
-        if size < 4:
-            if self.verbose: print("WRN: no user data")
-            return []
-        total_size = unpack('i', templatedata[0:4])[0]
-        if self.verbose: print ("get template total size {}, size {} len {}".format(total_size, size, len(templatedata)))
-        templatedata = templatedata[4:]
-        while total_size:
-            size, uid, fid, valid = unpack('HHbb',templatedata[:6])
-            template = unpack("%is" % (size-6), templatedata[6:size])[0]
-            finger = Finger(uid, fid, valid, template)
-            if self.verbose: print(finger)
-            templates.append(finger)
-            templatedata = templatedata[size:]
-            total_size -= size
-        return templates
+            return
+        decoder = TemplateDecoder(self.verbose)
+        for chunk in self.__iter_buffer(const.CMD_DB_RRQ, const.FCT_FINGERTMP):
+            fingers = self.__decode('templates', decoder, chunk)
+            for finger in fingers:
+                yield finger
+        decoder.close()
 
     def get_users(self):
         """
         :return: list of User object
         """
+        return list(self.iter_users())
+
+    def iter_users(self):
+        """
+        decode users as every chunk arrives, without keeping the whole
+        user table in memory. next_uid and next_user_id are updated once
+        the generator is exhausted.
+
+        :return: generator of User object
+        """
         self.read_sizes()
+        index = UserIndex()
         if self.users == 0:
             self.next_uid = 1
             self.next_user_id='1'
-            return []
-        users = []
-        max_uid = 0
+            self.__user_index, self.__user_count = index, 0
+            return
+        decoder = UserDecoder(self.users, self.encoding, self.verbose)
+        for chunk in self.__iter_buffer(const.CMD_USERTEMP_RRQ, const.FCT_USER):
+            users = self.__decode('users', decoder, chunk)
+            index.extend(users)
+            for user in users:
+                yield user
+            self.user_packet_size = decoder.user_packet_size
+        next_ids = decoder.next_ids()
+        if next_ids is None:
+            return
+        self.next_uid, self.next_user_id = next_ids
+        self.__user_index, self.__user_count = index, self.users
+
+    def get_users_array(self):
+        """
+        return the users as a numpy structured array (uid, name, privilege,
+        password, group_id, user_id, card) decoded in place. needs numpy.
+
+        :return: numpy array of USER_ARRAY_DTYPE
+        """
+        _require_numpy('get_users_array')
+        self.read_sizes()
+        if self.users == 0:
+            return numpy.zeros(0, dtype=USER_ARRAY_DTYPE)
         userdata, size = self.read_with_buffer(const.CMD_USERTEMP_RRQ, const.FCT_USER)
-        if self.verbose: print("user size {} (= {})".format(size, len(userdata)))
         if size <= 4:
-            print("WRN: missing user data")
-            return []
-        total_size = unpack("I",userdata[:4])[0]
+            if self.verbose: print("WRN: missing user data")
+            return numpy.zeros(0, dtype=USER_ARRAY_DTYPE)
+        total_size = unpack("I", userdata[:4])[0]
         self.user_packet_size = total_size / self.users
         if not self.user_packet_size in [28, 72]:
             if self.verbose: print("WRN packet size would be  %i" % self.user_packet_size)
-        userdata = userdata[4:]
-        if self.user_packet_size == 28:
-            while len(userdata) >= 28:
-                uid, privilege, password, name, card, group_id, timezone, user_id = unpack('<HB5s8sIxBhI',userdata.ljust(28, b'\x00')[:28])
-                if uid > max_uid: max_uid = uid
-                password = (password.split(b'\x00')[0]).decode(self.encoding, errors='ignore')
-                name = (name.split(b'\x00')[0]).decode(self.encoding, errors='ignore').strip()
-                group_id = str(group_id)
-                user_id = str(user_id)
-                #TODO: check card value and find in ver8
-                if not name:
-                    name = "NN-%s" % user_id
-                user = User(uid, name, privilege, password, group_id, user_id, card)
-                users.append(user)
-                if self.verbose: print("[6]user:",uid, privilege, password, name, card, group_id, timezone, user_id)
-                userdata = userdata[28:]
-        else:
-            while len(userdata) >= 72:
-                uid, privilege, password, name, card, group_id, user_id = unpack('<HB8s24sIx7sx24s', userdata.ljust(72, b'\x00')[:72])
-                password = (password.split(b'\x00')[0]).decode(self.encoding, errors='ignore')
-                name = (name.split(b'\x00')[0]).decode(self.encoding, errors='ignore').strip()
-                group_id = (group_id.split(b'\x00')[0]).decode(self.encoding, errors='ignore').strip()
-                user_id = (user_id.split(b'\x00')[0]).decode(self.encoding, errors='ignore')
-                if uid > max_uid: max_uid = uid
-                if not name:
-                    name = "NN-%s" % user_id
-                user = User(uid, name, privilege, password, group_id, user_id, card)
-                users.append(user)
-                userdata = userdata[72:]
-        max_uid += 1
-        self.next_uid = max_uid
-        self.next_user_id = str(max_uid)
-        while True:
-            if any(u for u in users if u.user_id == self.next_user_id):
-                max_uid += 1
-                self.next_user_id = str(max_uid)
-            else:
-                break
-        return users
+        return user_array(memoryview(userdata)[4:], self.user_packet_size, self.encoding)
 
     def cancel_capture(self):
         """
@@ -1229,12 +2466,10 @@ class ZK(object):
         command = const.CMD_STARTENROLL
         done = False
         if  not user_id:
-            users = self.get_users()
-            users = list(filter(lambda x: x.uid==uid, users))
-            if len(users) >= 1:
-                user_id = users[0].user_id
-            else:
+            user = self.get_user_index().find_uid(uid)
+            if user is None:
                 return False
+            user_id = user.user_id
         if self.tcp:
             command_string = pack('<24sbb',str(user_id).encode(), temp_id, 1)
         else:
@@ -1317,7 +2552,7 @@ class ZK(object):
         try live capture of events
         """
         was_enabled = self.is_enabled
-        users = self.get_users()
+        users = self.get_user_index()
         self.cancel_capture()
         self.verify_user()
         if not self.is_enabled:
@@ -1345,39 +2580,8 @@ class ZK(object):
                 if not len(data):
                     if self.verbose: print ("empty")
                     continue
-                while len(data) >= 10:
-                    if len(data) == 10:
-                        user_id, status, punch, timehex = unpack('<HBB6s', data)
-                        data = data[10:]
-                    elif len(data) == 12:
-                        user_id, status, punch, timehex = unpack('<IBB6s', data)
-                        data = data[12:]
-                    elif len(data) == 14:
-                        user_id, status, punch, timehex, _other = unpack('<HBB6s4s', data)
-                        data = data[14:]
-                    elif len(data) == 32:
-                        user_id,  status, punch, timehex = unpack('<24sBB6s', data[:32])
-                        data = data[32:]
-                    elif len(data) == 36:
-                        user_id,  status, punch, timehex, _other = unpack('<24sBB6s4s', data[:36])
-                        data = data[36:]
-                    elif len(data) == 37:
-                        user_id,  status, punch, timehex, _other = unpack('<24sBB6s5s', data[:37])
-                        data = data[37:]
-                    elif len(data) >= 52:
-                        user_id,  status, punch, timehex, _other = unpack('<24sBB6s20s', data[:52])
-                        data = data[52:]
-                    if isinstance(user_id, int):
-                        user_id = str(user_id)
-                    else:
-                        user_id = (user_id.split(b'\x00')[0]).decode(errors='ignore')
-                    timestamp = self.__decode_timehex(timehex)
-                    tuser = list(filter(lambda x: x.user_id == user_id, users))
-                    if not tuser:
-                        uid = int(user_id)
-                    else:
-                        uid = tuser[0].uid
-                    yield Attendance(user_id, timestamp, status, punch, uid)
+                for attendance in iter_live_events(data, users):
+                    yield attendance
             except timeout:
                 if self.verbose: print ("time out")
                 yield None # return to keep watching
@@ -1401,74 +2605,24 @@ class ZK(object):
         cmd_response = self.__send_command(command, command_string)
         if cmd_response.get('status'):
             self.next_uid = 1
+            self.__user_index = None
             return True
         else:
             raise ZKErrorResponse("can't clear data")
 
-    def __recieve_tcp_data(self, data_recv, size):
-        """ data_recv, raw tcp packet
-         must analyze tcp_length
-
-         must return data, broken
-         """
-        data = []
-        tcp_length = self.__test_tcp_top(data_recv)
-        if self.verbose: print ("tcp_length {}, size {}".format(tcp_length, size))
-        if tcp_length <= 0:
-            if self.verbose: print ("Incorrect tcp packet")
-            return None, b""
-        if (tcp_length - 8) < size:
-            if self.verbose: print ("tcp length too small... retrying")
-            resp, bh = self.__recieve_tcp_data(data_recv, tcp_length - 8)
-            data.append(resp)
-            size -= len(resp)
-            if self.verbose: print ("new tcp DATA packet to fill misssing {}".format(size))
-            data_recv = bh + self.__sock.recv(size + 16 )
-            if self.verbose: print ("new tcp DATA starting with {} bytes".format(len(data_recv)))
-            resp, bh = self.__recieve_tcp_data(data_recv, size)
-            data.append(resp)
-            if self.verbose: print ("for misssing {} recieved {} with extra {}".format(size, len(resp), len(bh)))
-            return b''.join(data), bh
-        recieved = len(data_recv)
-        if self.verbose: print ("recieved {}, size {}".format(recieved, size))
-        response = unpack('HHHH', data_recv[8:16])[0]
-        if recieved >= (size + 32):
-            if response == const.CMD_DATA:
-                resp = data_recv[16 : size + 16]
-                if self.verbose: print ("resp complete len {}".format(len(resp)))
-                return resp, data_recv[size + 16:]
-            else:
-                if self.verbose: print("incorrect response!!! {}".format(response))
-                return None, b""
-        else:
-            if self.verbose: print ("try DATA incomplete (actual valid {})".format(recieved-16))
-            data.append(data_recv[16 : size + 16 ])
-            size -= recieved - 16
-            broken_header = b""
-            if size < 0:
-                broken_header = data_recv[size:]
-                if self.verbose: print ("broken", (broken_header).encode('hex'))
-            if size > 0:
-                data_recv = self.__recieve_raw_data(size)
-                data.append(data_recv)
-            return b''.join(data), broken_header
-
     def __recieve_raw_data(self, size):
         """ partial data ? """
-        data = []
         if self.verbose: print ("expecting {} bytes raw data".format(size))
-        while size > 0:
-            data_recv = self.__sock.recv(size)
-            recieved = len(data_recv)
-            if self.verbose: print ("partial recv {}".format(recieved))
-            if recieved < 100 and self.verbose: print ("   recv {}".format(codecs.encode(data_recv, 'hex')))
-            data.append(data_recv)
-            size -= recieved
-            if self.verbose: print ("still need {}".format(size))
-        return b''.join(data)
-
-    def __recieve_chunk(self):
-        """ recieve a chunk """
+        data = bytearray(size)
+        self.__recv_into(memoryview(data))
+        return data
+
+    def __recieve_chunk(self, view=None):
+        """
+        recieve a chunk, into view (a memoryview) when given
+
+        :return: the chunk received, the filled part of view or None
+        """
         if self.__response == const.CMD_DATA:
             if self.tcp:
                 if self.verbose: print ("_rc_DATA! is {} bytes, tcp length is {}".format(len(self.__data), self.__tcp_length))
@@ -1476,94 +2630,208 @@ class ZK(object):
                     need = (self.__tcp_length - 8) - len(self.__data)
                     if self.verbose: print ("need more data: {}".format(need))
                     more_data = self.__recieve_raw_data(need)
-                    return b''.join([self.__data, more_data])
+                    data = self.__data + more_data # more_data is a bytearray, b''.join refuses it on python 2
                 else:
                     if self.verbose: print ("Enough data")
-                    return self.__data
+                    data = self.__data
             else:
                 if self.verbose: print ("_rc len is {}".format(len(self.__data)))
-                return self.__data
+                data = self.__data
+            if view is None:
+                return data
+            size = min(len(data), len(view))
+            view[:size] = data[:size]
+            return view[:size]
         elif self.__response == const.CMD_PREPARE_DATA:
-            data = []
             size = self.__get_data_size()
             if self.verbose: print ("recieve chunk: prepare data size is {}".format(size))
+            if view is None or len(view) != size:
+                view = memoryview(bytearray(size))
             if self.tcp:
-                if len(self.__data) >= (8 + size):
-                    data_recv = self.__data[8:]
-                else:
-                    data_recv = self.__data[8:] + self.__sock.recv(size + 32)
-                resp, broken_header = self.__recieve_tcp_data(data_recv, size)
-                data.append(resp)
-                # get CMD_ACK_OK
-                if len(broken_header) < 16:
-                    data_recv = broken_header + self.__sock.recv(16)
-                else:
-                    data_recv = broken_header
-                if len(data_recv) < 16:
-                    print ("trying to complete broken ACK %s /16" % len(data_recv))
-                    if self.verbose: print (data_recv.encode('hex'))
-                    data_recv += self.__sock.recv(16 - len(data_recv)) #TODO: CHECK HERE_!
-                if not self.__test_tcp_top(data_recv):
-                    if self.verbose: print ("invalid chunk tcp ACK OK")
-                    return None
-                response = unpack('HHHH', data_recv[8:16])[0]
-                if response == const.CMD_ACK_OK:
-                    if self.verbose: print ("chunk tcp ACK OK!")
-                    return b''.join(data)
-                if self.verbose: print("bad response %s" % data_recv)
-                if self.verbose: print (codecs.encode(data,'hex'))
-                return None
-
-                return resp
-            while True:
-                data_recv = self.__sock.recv(1024+8)
-                response = unpack('<4H', data_recv[:8])[0]
-                if self.verbose: print ("# packet response is: {}".format(response))
-                if response == const.CMD_DATA:
-                    data.append(data_recv[8:])
-                    size -= 1024
-                elif response == const.CMD_ACK_OK:
-                    break
-                else:
-                    if self.verbose: print ("broken!")
-                    break
-                if self.verbose: print ("still needs %s" % size)
-            return b''.join(data)
+                # the reply may already hold the start of the data packets
+                self.__pending = memoryview(self.__tcp_data_recv)[8 + self.__tcp_length:]
+            try:
+                filled = self.__recieve_data(view)
+            finally:
+                self.__pending = b''
+            return None if filled is None else view[:filled]
         else:
             if self.verbose: print ("invalid response %s" % self.__response)
             return None
 
-    def __read_chunk(self, start, size):
+    def __recieve_data(self, view):
+        """
+        receive the CMD_DATA packets following a CMD_PREPARE_DATA straight
+        into view, and the final CMD_ACK_OK
+
+        :return: bytes received, None when the reply is broken (an udp
+            reply missing datagrams is short, not broken)
+        """
+        if not self.tcp:
+            return self.__recieve_datagrams(view)
+        size = len(view)
+        filled = 0
+        while filled < size:
+            response, _reply_id, length = self.__recv_header()
+            if self.verbose: print ("# packet response is: {}".format(response))
+            if response != const.CMD_DATA:
+                if self.verbose: print ("broken! response %i" % response)
+                return None
+            part = min(length, size - filled)
+            self.__recv_into(view[filled:filled + part])
+            if length > part:
+                self.__recieve_raw_data(length - part) # more than prepared
+            filled += part
+            if self.verbose: print ("still needs %s" % (size - filled))
+        response, _reply_id, length = self.__recv_header()
+        if response != const.CMD_ACK_OK:
+            if self.verbose: print ("bad response %i, expected ACK OK" % response)
+            return None
+        self.__recieve_raw_data(length)
+        if self.verbose: print ("chunk ACK OK!")
+        return filled
+
+    def __recieve_datagrams(self, view):
         """
-        read a chunk from buffer
+        udp __recieve_data: each CMD_DATA datagram is received straight into
+        view, its 8 bytes header over the end of the previous one (saved
+        and put back)
+        """
+        size = len(view)
+        filled = 0
+        if self.__datagram is None:
+            self.__datagram = bytearray(0x10000)
+        while True:
+            if 8 <= filled < size:
+                target, saved = view[filled - 8:], _bytes(view[filled - 8:filled])
+            else:
+                target, saved = memoryview(self.__datagram), None
+            recieved = self.__sock.recv_into(target)
+            if recieved < 8:
+                raise ZKErrorResponse("UDP packet invalid")
+            response = unpack_from('<H', target)[0]
+            if saved is not None:
+                target[:8] = saved
+            if self.verbose: print ("# packet response is: {}".format(response))
+            if response == const.CMD_ACK_OK:
+                return filled # short when datagrams were lost
+            if response != const.CMD_DATA or filled >= size:
+                if self.verbose: print ("broken! response %i" % response)
+                return None
+            if saved is None:
+                part = min(recieved - 8, size - filled)
+                view[filled:filled + part] = target[8:8 + part]
+                recieved = part + 8
+            filled += recieved - 8
+
+    def __read_chunk(self, start, size, view=None):
+        """
+        read a chunk from buffer, into view (a memoryview of size bytes)
+        when given
+
+        :return: the chunk, a memoryview
         """
+        if view is None:
+            view = memoryview(bytearray(size))
+        instrument = self.instrument
         for _retries in range(3):
+            if instrument is not None:
+                started = clock()
             command = const._CMD_READ_BUFFER
             command_string = pack('<ii', start, size)
             if self.tcp:
-                response_size = size + 32
+                response_size = 16 # the CMD_PREPARE_DATA, the data is received into view
             else:
                 response_size = 1024 + 8
             cmd_response = self.__send_command(command, command_string, response_size)
-            data = self.__recieve_chunk()
-            if data is not None:
+            data = self.__recieve_chunk(view)
+            if data is not None and (self.tcp or len(data) == size):
+                if instrument is not None:
+                    instrument.chunk(command, len(data), clock() - started)
                 return data
+            if instrument is not None:
+                instrument.retry(command, 'chunk')
+            if data is not None:
+                # a datagram was lost, drop what is left of the reply and ask again
+                if self.verbose: print ("incomplete chunk %i:[%i] got %i" % (start, size, len(data)))
+                self.__drain(min(1, self.__timeout))
         else:
             raise ZKErrorResponse("can't read chunk %i:[%i]" % (start, size))
 
-    def read_with_buffer(self, command, fct=0 ,ext=0):
+    def __read_chunks_pipelined(self, chunks, into=None):
         """
-        Test read info with buffered command (ZK6: 1503)
+        read buffer chunks keeping up to read_pipeline _CMD_READ_BUFFER
+        requests in flight. replies are matched to their request by reply_id
+        and received straight into the place of their chunk. if the terminal
+        rejects it, pending replies are discarded and the missing chunks are
+        read one by one.
+
+        :param chunks: list of (start, size)
+        :param into: memoryview of the whole buffer, by offset (None: a
+            bytearray per chunk)
+        :return: generator of memoryview, one item per chunk, in offset order
+        """
+        instrument = self.instrument
+        queue = deque(chunks)
+        in_flight = {} # reply_id: [start, size, prepared size, received, view, sent at]
+        done = {}
+        position = 0
+        try:
+            while queue or in_flight:
+                while queue and len(in_flight) < self.read_pipeline:
+                    start, size = queue.popleft()
+                    reply_id = self.__send_packet(const._CMD_READ_BUFFER, pack('<ii', start, size))
+                    view = memoryview(bytearray(size)) if into is None else into[start:start + size]
+                    in_flight[reply_id] = [start, size, None, 0, view, instrument and clock()]
+                response, reply_id, length = self.__recv_header()
+                request = in_flight.get(reply_id)
+                if request is None:
+                    raise ZKErrorResponse("unexpected reply id %i" % reply_id)
+                if response == const.CMD_PREPARE_DATA:
+                    request[2] = unpack('I', self.__recieve_raw_data(length)[:4])[0]
+                    continue
+                if response == const.CMD_DATA:
+                    if length > request[1] - request[3]:
+                        raise ZKErrorResponse("chunk %i:[%i] overflow" % (request[0], request[1]))
+                    self.__recv_into(request[4][request[3]:request[3] + length])
+                    request[3] += length
+                    if request[2] is not None:
+                        continue # wait for CMD_ACK_OK
+                elif response != const.CMD_ACK_OK:
+                    raise ZKErrorResponse("pipelined read rejected (%i)" % response)
+                else:
+                    self.__recieve_raw_data(length)
+                del in_flight[reply_id]
+                if request[3] != request[1]:
+                    raise ZKErrorResponse("incomplete chunk %i:[%i] got %i" % (request[0], request[1], request[3]))
+                if instrument is not None:
+                    instrument.chunk(const._CMD_READ_BUFFER, request[3], clock() - request[5])
+                done[request[0]] = request[4]
+                while position < len(chunks) and chunks[position][0] in done:
+                    yield done.pop(chunks[position][0])
+                    position += 1
+        except (ZKErrorResponse, timeout) as e:
+            if self.verbose: print ("pipelined read failed ({}), reading serially".format(e))
+            if instrument is not None:
+                instrument.retry(const._CMD_READ_BUFFER, 'pipeline')
+            self.read_pipeline = 0 # don't try again on this session
+            self.__drain()
+            for start, size in chunks[position:]:
+                if start in done:
+                    yield done.pop(start)
+                else:
+                    yield self.__read_chunk(start, size, None if into is None else into[start:start + size])
+
+    def __prepare_buffer(self, command, fct=0 ,ext=0):
+        """
+        prepare a buffered read (ZK6: 1503)
+
+        :return: (size, data), data is the whole buffer when the terminal
+            sent it right away (then there is nothing to read nor free)
         """
-        if self.tcp:
-            MAX_CHUNK = 0xFFc0
-        else:
-            MAX_CHUNK = 16 * 1024
         command_string = pack('<bhii', 1, command, fct, ext)
         if self.verbose: print ("rwb cs", command_string)
         response_size = 1024
-        data = []
-        start = 0
         cmd_response = self.__send_command(const._CMD_PREPARE_BUFFER, command_string, response_size)
         if not cmd_response.get('status'):
             raise ZKErrorResponse("RWB Not supported")
@@ -1574,94 +2842,302 @@ class ZK(object):
                     need = (self.__tcp_length - 8) - len(self.__data)
                     if self.verbose: print ("need more data: {}".format(need))
                     more_data = self.__recieve_raw_data(need)
-                    return b''.join([self.__data, more_data]), len(self.__data) + len(more_data)
+                    data = self.__data + more_data
                 else:
                     if self.verbose: print ("Enough data")
-                    size = len(self.__data)
-                    return self.__data, size
+                    data = self.__data
             else:
-                size = len(self.__data)
-                return self.__data, size
+                data = self.__data
+            return len(data), data
         size = unpack('I', self.__data[1:5])[0]
         if self.verbose: print ("size fill be %i" % size)
+        return size, None
+
+    def __iter_chunks(self, start, end, buffer=None, into=None):
+        """
+        read the bytes start:end of a prepared buffer. when the transfer
+        breaks, up to reconnects times the session is opened again, the
+        buffer prepared again and the read continues where it stopped.
+
+        :param buffer: (command, fct, ext, size) of the prepared buffer,
+            None to never reconnect
+        :param into: memoryview the chunks are received into, by offset
+            (None: a bytearray per chunk)
+        :return: generator of memoryview, one item per chunk received
+        """
+        drops = 0
+        while start < end:
+            try:
+                for chunk in self.__iter_range(start, end, into):
+                    start += len(chunk)
+                    yield chunk
+            except Exception as e:
+                if buffer is None or drops >= self.reconnects:
+                    raise
+                drops += 1
+                if self.verbose: print ("buffered read broken at {} ({}), reconnecting".format(start, e))
+                if self.instrument is not None:
+                    self.instrument.retry(buffer[0], 'reconnect')
+                self.__reopen_buffer(*buffer)
+
+    def __reopen_session(self):
+        """
+        open a new session after the connection was lost, the device
+        disabled again when it was
+        """
+        was_enabled = self.is_enabled
+        try:
+            self.__sock.close()
+        except Exception:
+            pass
+        self.is_connect = False
+        self.connect()
+        if not was_enabled:
+            self.disable_device()
+
+    def __reopen_buffer(self, command, fct, ext, size):
+        """
+        open a new session and prepare the same buffer again
+        """
+        self.__reopen_session()
+        new_size, data = self.__prepare_buffer(command, fct, ext)
+        if data is not None or new_size != size:
+            raise ZKErrorResponse("buffer changed from %i to %i bytes while reconnecting" % (size, new_size))
+
+    def __decode(self, kind, decoder, chunk):
+        """
+        decoder.feed(chunk), timed for the instrument
+        """
+        if self.instrument is None:
+            return decoder.feed(chunk)
+        started = clock()
+        records = decoder.feed(chunk)
+        self.instrument.decode(kind, len(records), clock() - started)
+        return records
+
+    def __iter_range(self, start, end, into=None):
+        """
+        read the bytes start:end of a prepared buffer, chunk by chunk
+        """
+        if self.tcp:
+            MAX_CHUNK = 0xFFc0
+        else:
+            MAX_CHUNK = 16 * 1024
+        size = end - start
         remain = size % MAX_CHUNK
         packets = (size-remain) // MAX_CHUNK # should be size /16k
         if self.verbose: print ("rwb: #{} packets of max {} bytes, and extra {} bytes remain".format(packets, MAX_CHUNK, remain))
-        for _wlk in range(packets):
-            data.append(self.__read_chunk(start,MAX_CHUNK))
-            start += MAX_CHUNK
-        if remain:
-            data.append(self.__read_chunk(start, remain))
-            start += remain
+        if self.read_pipeline > 1 and packets + bool(remain) > 1:
+            chunks = [(offset, MAX_CHUNK) for offset in range(start, start + packets * MAX_CHUNK, MAX_CHUNK)]
+            if remain:
+                chunks.append((start + packets * MAX_CHUNK, remain))
+            for chunk in self.__read_chunks_pipelined(chunks, into):
+                start += len(chunk)
+                yield chunk
+        else:
+            for _wlk in range(packets):
+                yield self.__read_chunk(start, MAX_CHUNK, None if into is None else into[start:start + MAX_CHUNK])
+                start += MAX_CHUNK
+            if remain:
+                yield self.__read_chunk(start, remain, None if into is None else into[start:start + remain])
+                start += remain
+        if self.verbose: print ("_read w/chunk up to %i bytes" % start)
+
+    def __iter_buffer(self, command, fct=0 ,ext=0):
+        """
+        read info with buffered command (ZK6: 1503), chunk by chunk
+
+        :return: generator of bytes-like objects, one item per chunk received
+        """
+        size, data = self.__prepare_buffer(command, fct, ext)
+        if data is not None:
+            yield data
+            return
+        for chunk in self.__iter_chunks(0, size, (command, fct, ext, size)):
+            yield chunk
+        self.free_data()
+
+    def read_with_buffer(self, command, fct=0 ,ext=0, spool=None):
+        """
+        Test read info with buffered command (ZK6: 1503)
+
+        :param spool: path of a file keeping the bytes received. a read
+            that failed half way continues from it when the buffer still
+            has the same size; the file is removed once complete
+        :return: (data, size), without spool data is a bytearray allocated
+            from the prepared size and filled in place
+        """
+        size, data = self.__prepare_buffer(command, fct, ext)
+        if spool is None:
+            if data is None:
+                # every chunk is received in its place, the buffer is never joined
+                data = bytearray(size)
+                for _chunk in self.__iter_chunks(0, size, (command, fct, ext, size), memoryview(data)):
+                    pass
+                self.free_data()
+            return data, len(data)
+        if data is not None:
+            if os.path.exists(spool):
+                os.remove(spool)
+            return data, len(data)
+        header = _SPOOL_HEADER.pack(b'ZKSP', size, command, fct, ext)
+        done = 0
+        if os.path.exists(spool):
+            with open(spool, 'rb') as f:
+                if f.read(len(header)) == header:
+                    done = min(os.path.getsize(spool) - len(header), size)
+        if self.verbose and done: print ("resuming buffered read from spool at %i/%i" % (done, size))
+        with open(spool, 'r+b' if done else 'w+b') as f:
+            f.write(header)
+            f.seek(len(header) + done)
+            f.truncate()
+            for chunk in self.__iter_chunks(done, size, (command, fct, ext, size)):
+                f.write(chunk)
+                f.flush()
+            f.seek(len(header))
+            data = f.read()
+        os.remove(spool)
         self.free_data()
-        if self.verbose: print ("_read w/chunk %i bytes" % start)
-        return b''.join(data), start
+        return data, len(data)
 
-    def get_attendance(self):
+    def get_attendance(self, position=None):
         """
         return attendance record
 
+        :param position: only the records after it (see iter_attendance)
         :return: List of Attendance object
         """
+        return list(self.iter_attendance(position))
+
+    def iter_attendance(self, position=None):
+        """
+        decode attendance records as every chunk arrives, without keeping
+        the whole log in memory
+
+        once the generator is exhausted attendance_position holds the index
+        of the next record and a copy of the last one. given back as
+        position, only the records past it are read (attendance_incremental
+        is True), as long as the log still has that record at that index:
+        after the log was cleared or rotated the whole log is read.
+
+        :param position: attendance_position of a previous download
+        :return: generator of Attendance object
+        """
+        for attendances in self.__iter_attendance_chunks(position, False):
+            for attendance in attendances:
+                yield attendance
+
+    def get_attendance_batch(self, position=None):
+        """
+        return attendance records in a single AttendanceBatch
+
+        :param position: only the records after it (see iter_attendance)
+        :return: AttendanceBatch
+        """
+        batch = AttendanceBatch()
+        for chunk in self.iter_attendance_batches(position):
+            batch.extend(chunk)
+        return batch
+
+    def get_attendance_array(self):
+        """
+        return attendance records as a numpy structured array (uid,
+        user_id, timestamp as datetime64[s], status, punch), the buffer
+        decoded in place without a Python object per record. needs numpy.
+
+        :return: numpy array of ATTENDANCE_ARRAY_DTYPE
+        """
+        _require_numpy('get_attendance_array')
         self.read_sizes()
         if self.records == 0:
-            return []
-        users = self.get_users()
-        if self.verbose: print (users)
-        attendances = []
+            return numpy.zeros(0, dtype=ATTENDANCE_ARRAY_DTYPE)
+        users = self.get_user_index(check=False) # validated by read_sizes
         attendance_data, size = self.read_with_buffer(const.CMD_ATTLOG_RRQ)
         if size < 4:
             if self.verbose: print ("WRN: no attendance data")
-            return []
+            return numpy.zeros(0, dtype=ATTENDANCE_ARRAY_DTYPE)
         total_size = unpack("I", attendance_data[:4])[0]
-        record_size = total_size // self.records
-        if self.verbose: print ("record_size is ", record_size)
-        attendance_data = attendance_data[4:]
-        if record_size == 8:
-            while len(attendance_data) >= 8:
-                uid, status, timestamp, punch = unpack('HB4sB', attendance_data.ljust(8, b'\x00')[:8])
-                if self.verbose: print (codecs.encode(attendance_data[:8], 'hex'))
-                attendance_data = attendance_data[8:]
-                tuser = list(filter(lambda x: x.uid == uid, users))
-                if not tuser:
-                    user_id = str(uid)
-                else:
-                    user_id = tuser[0].user_id
-                timestamp = self.__decode_time(timestamp)
-                attendance = Attendance(user_id, timestamp, status, punch, uid)
-                attendances.append(attendance)
-        elif record_size == 16:
-            while len(attendance_data) >= 16:
-                user_id, timestamp, status, punch, reserved, workcode = unpack('<I4sBB2sI', attendance_data.ljust(16, b'\x00')[:16])
-                user_id = str(user_id)
-                if self.verbose: print(codecs.encode(attendance_data[:16], 'hex'))
-                attendance_data = attendance_data[16:]
-                tuser = list(filter(lambda x: x.user_id == user_id, users))
-                if not tuser:
-                    if self.verbose: print("no uid {}", user_id)
-                    uid = str(user_id)
-                    tuser = list(filter(lambda x: x.uid == user_id, users))
-                    if not tuser:
-                        uid = str(user_id)
-                    else:
-                        uid = tuser[0].uid
-                        user_id = tuser[0].user_id
-                else:
-                    uid = tuser[0].uid
-                timestamp = self.__decode_time(timestamp)
-                attendance = Attendance(user_id, timestamp, status, punch, uid)
-                attendances.append(attendance)
+        self.record_size = total_size // self.records
+        if self.record_size not in ATTENDANCE_RECORD_DTYPES:
+            raise ZKErrorResponse("unknown attendance record size %i" % self.record_size)
+        return attendance_array(memoryview(attendance_data)[4:], self.record_size, users)
+
+    def iter_attendance_batches(self, position=None):
+        """
+        like iter_attendance, an AttendanceBatch per received chunk instead
+        of an Attendance per record
+
+        :param position: attendance_position of a previous download
+        :return: generator of AttendanceBatch
+        """
+        for batch in self.__iter_attendance_chunks(position, True):
+            if len(batch):
+                yield batch
+
+    def __iter_attendance_chunks(self, position, batch):
+        """
+        :return: generator of the records decoded from every chunk, lists
+            of Attendance or AttendanceBatch (batch)
+        """
+        self.attendance_incremental = False
+        self.attendance_position = None
+        self.read_sizes()
+        if self.records == 0:
+            self.attendance_position = {'index': 0, 'record': ''}
+            return
+        records = self.records
+        users = self.get_user_index(check=False) # validated by read_sizes
+        size, data = self.__prepare_buffer(const.CMD_ATTLOG_RRQ)
+        start = self.__attendance_tail(size, records, position)
+        decoder = AttendanceDecoder(records, users, self.verbose, batch=batch)
+        last = bytearray()
+        if start:
+            # the tail starts with the last record already downloaded. it is
+            # checked with a read of its own, before any pipelined request is
+            # sent for the tail or the whole log
+            record_size = (size - 4) // records
+            anchor = codecs.decode(position['record'], 'hex')
+            if data is not None:
+                first = memoryview(data)[start:start + record_size]
+            else:
+                first = self.__read_chunk(start, record_size)
+            if _bytes(first) == anchor:
+                if self.verbose: print ("reading attendance from record %i" % position['index'])
+                self.attendance_incremental = True
+                decoder = AttendanceDecoder(records, users, self.verbose, record_size, batch)
+                self.record_size = record_size
+                last = bytearray(anchor)
+                start += record_size
+            else:
+                if self.verbose: print ("attendance log rotated, reading all")
+                start = 0
+        if data is not None: # sent right away, nothing to read nor free
+            chunks = iter([memoryview(data)[start:]])
         else:
-            while len(attendance_data) >= 40:
-                uid, user_id, status, timestamp, punch, space = unpack('<H24sB4sB8s', attendance_data.ljust(40, b'\x00')[:40])
-                if self.verbose: print (codecs.encode(attendance_data[:40], 'hex'))
-                user_id = (user_id.split(b'\x00')[0]).decode(errors='ignore')
-                timestamp = self.__decode_time(timestamp)
-
-                attendance = Attendance(user_id, timestamp, status, punch, uid)
-                attendances.append(attendance)
-                attendance_data = attendance_data[record_size:]
-        return attendances
+            chunks = self.__iter_chunks(start, size, (const.CMD_ATTLOG_RRQ, 0, 0, size))
+        for chunk in chunks:
+            yield self.__decode('attendance', decoder, chunk)
+            self.record_size = decoder.record_size
+            last = (last + bytearray(chunk[-40:]))[-40:] # 40: largest record
+        yield decoder.close()
+        if data is None:
+            self.free_data()
+        if self.record_size in (8, 16, 40) and len(last) >= self.record_size:
+            last = bytes(last[-self.record_size:])
+            self.attendance_position = {'index': records, 'record': codecs.encode(last, 'hex').decode('ascii')}
+
+    def __attendance_tail(self, size, records, position):
+        """
+        :return: offset of the last record already downloaded, 0 to read
+            the whole log
+        """
+        index = (position or {}).get('index') or 0
+        if not index or not position.get('record') or index > records:
+            return 0
+        record_size, extra = divmod(size - 4, records)
+        if extra or record_size not in (8, 16, 40) or len(position['record']) != record_size * 2:
+            return 0
+        return 4 + (index - 1) * record_size
 
     def clear_attendance(self):
         """
@@ -13,3 +13,7 @@ class ZKErrorResponse(ZKError):
 
 class ZKNetworkError(ZKError):
     pass
+
+
+class ZKReplayError(ZKNetworkError):
+    pass
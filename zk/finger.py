@@ -4,6 +4,7 @@ import codecs
 
 
 class Finger(object):
+    __slots__ = ('size', 'uid', 'fid', 'valid', 'template')
 
     def __init__(self, uid, fid, valid, template):
         self.size = len(template) # template only
@@ -11,8 +12,13 @@ class Finger(object):
         self.fid = int(fid)
         self.valid = int(valid)
         self.template = template
-        #self.mark = str().encode("hex")
-        self.mark = codecs.encode(template[:8], 'hex') + b'...' + codecs.encode(template[-8:], 'hex')
+
+    @property
+    def mark(self):
+        """
+        first and last 8 bytes of the template in hex, only for display
+        """
+        return codecs.encode(self.template[:8], 'hex') + b'...' + codecs.encode(self.template[-8:], 'hex')
 
     def repack(self): #full
         return pack("<HHbb%is" % (self.size), self.size+6, self.uid, self.fid, self.valid, self.template)
@@ -39,7 +45,13 @@ class Finger(object):
         }
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, Finger):
+            return NotImplemented
+        return (self.uid, self.fid, self.valid, self.template) == (other.uid, other.fid, other.valid, other.template)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
 
     def __str__(self):
         return "<Finger> [uid:{:>3}, fid:{}, size:{:>4} v:{} t:{}]".format(self.uid, self.fid, self.size, self.valid, self.mark)
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+protocol instrumentation: ZK(instrument=...) reports every command, chunk,
+retry and decode to an Instrument. with the default instrument=None the
+only cost is one attribute test per event.
+
+    from zk import ZK
+    from zk.instrument import CommandStats
+
+    stats = CommandStats()
+    conn = ZK('192.168.1.201', instrument=stats).connect()
+    conn.get_attendance()
+    print (stats.format())
+"""
+from bisect import bisect_left
+from threading import Lock
+import time
+
+from . import const
+
+try:
+    clock = time.perf_counter
+except AttributeError: # python 2
+    clock = time.time
+
+# upper bounds (seconds) of the latency histogram buckets, the last one is open
+BUCKETS = (0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+           0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+_NAMES = {}
+for _name in dir(const):
+    if _name.lstrip('_').startswith('CMD_') and isinstance(getattr(const, _name), int):
+        _NAMES.setdefault(getattr(const, _name), _name.lstrip('_'))
+
+
+def command_name(command):
+    """
+    :return: name of a command id ('CMD_CONNECT'), the number when unknown
+    """
+    return _NAMES.get(command, str(command))
+
+
+class Instrument(object):
+    """
+    receives the protocol events of a ZK session, every method does nothing.
+    subclass it and override the events needed; they are called from the
+    thread using the session, keep them short.
+    """
+
+    def command(self, command, response, sent, received, seconds):
+        """
+        a command answered (or not) by the terminal
+
+        :param command: command id sent
+        :param response: command id of the reply, None on network error
+        :param sent: bytes sent
+        :param received: bytes of the first reply packet
+        :param seconds: time until the reply
+        """
+
+    def chunk(self, command, size, seconds):
+        """
+        a buffered read chunk received (_CMD_READ_BUFFER) or an upload chunk
+        acknowledged (CMD_DATA)
+
+        :param size: bytes of payload
+        :param seconds: time from the request to the complete chunk, for
+            pipelined chunks from the request to the last packet
+        """
+
+    def retry(self, command, reason):
+        """
+        a request repeated: 'chunk' (incomplete UDP chunk), 'pipeline' (the
+        pipelined transfer fell back to serial), 'reconnect' (the session was
+        opened again to continue a buffered read) or 'upload' (the upload was
+        restarted with smaller settings)
+        """
+
+    def decode(self, kind, records, seconds):
+        """
+        a downloaded chunk decoded
+
+        :param kind: 'attendance', 'users' or 'templates'
+        :param records: records decoded from the chunk
+        """
+
+
+def _histogram():
+    return [0] * (len(BUCKETS) + 1)
+
+
+class CommandStats(Instrument):
+    """
+    thread safe aggregator: per command counts, bytes, latency histograms,
+    chunks, retries and decode time
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.commands = {} # command: [count, errors, sent, received, seconds, max, histogram]
+            self.chunks = {}   # command: [count, bytes, seconds, histogram]
+            self.retries = {}  # (command, reason): count
+            self.decodes = {}  # kind: [chunks, records, seconds]
+
+    def command(self, command, response, sent, received, seconds):
+        with self._lock:
+            stats = self.commands.get(command)
+            if stats is None:
+                stats = self.commands[command] = [0, 0, 0, 0, 0.0, 0.0, _histogram()]
+            stats[0] += 1
+            if response is None or response not in (const.CMD_ACK_OK, const.CMD_PREPARE_DATA, const.CMD_DATA):
+                stats[1] += 1
+            stats[2] += sent
+            stats[3] += received
+            stats[4] += seconds
+            if seconds > stats[5]:
+                stats[5] = seconds
+            stats[6][bisect_left(BUCKETS, seconds)] += 1
+
+    def chunk(self, command, size, seconds):
+        with self._lock:
+            stats = self.chunks.get(command)
+            if stats is None:
+                stats = self.chunks[command] = [0, 0, 0.0, _histogram()]
+            stats[0] += 1
+            stats[1] += size
+            stats[2] += seconds
+            stats[3][bisect_left(BUCKETS, seconds)] += 1
+
+    def retry(self, command, reason):
+        with self._lock:
+            key = (command, reason)
+            self.retries[key] = self.retries.get(key, 0) + 1
+
+    def decode(self, kind, records, seconds):
+        with self._lock:
+            stats = self.decodes.get(kind)
+            if stats is None:
+                stats = self.decodes[kind] = [0, 0, 0.0]
+            stats[0] += 1
+            stats[1] += records
+            stats[2] += seconds
+
+    @staticmethod
+    def percentile(histogram, fraction):
+        """
+        :return: upper bound of the bucket holding the fraction (0-1) of
+            the samples, None for the open bucket or no samples
+        """
+        total = sum(histogram)
+        if not total:
+            return None
+        seen = 0
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if seen >= fraction * total:
+                return BUCKETS[bucket] if bucket < len(BUCKETS) else None
+
+    def summary(self):
+        """
+        :return: dict with the 'commands', 'chunks', 'retries' and 'decodes'
+            statistics keyed by name, json serializable
+        """
+        with self._lock:
+            commands = dict((command_name(command), {
+                'count': count, 'errors': errors, 'sent': sent, 'received': received,
+                'seconds': seconds, 'max': top, 'p50': self.percentile(histogram, 0.5),
+                'p99': self.percentile(histogram, 0.99), 'histogram': list(histogram),
+            }) for command, (count, errors, sent, received, seconds, top, histogram) in self.commands.items())
+            chunks = dict((command_name(command), {
+                'count': count, 'bytes': size, 'seconds': seconds,
+                'p50': self.percentile(histogram, 0.5), 'histogram': list(histogram),
+            }) for command, (count, size, seconds, histogram) in self.chunks.items())
+            retries = dict(('%s/%s' % (command_name(command), reason), count)
+                           for (command, reason), count in self.retries.items())
+            decodes = dict((kind, {'chunks': chunks_, 'records': records, 'seconds': seconds})
+                           for kind, (chunks_, records, seconds) in self.decodes.items())
+        return {'buckets': list(BUCKETS), 'commands': commands, 'chunks': chunks,
+                'retries': retries, 'decodes': decodes}
+
+    def format(self):
+        """
+        :return: the summary as a text table, latencies in milliseconds
+        """
+        summary = self.summary()
+        ms = lambda seconds: '-' if seconds is None else '%.1f' % (seconds * 1000)
+        lines = ['{:<24} {:>7} {:>6} {:>10} {:>12} {:>9} {:>8} {:>8} {:>8}'.format(
+            'command', 'count', 'errors', 'sent', 'received', 'total ms', 'p50 ms', 'p99 ms', 'max ms')]
+        for name, stats in sorted(summary['commands'].items(), key=lambda item: -item[1]['seconds']):
+            lines.append('{:<24} {:>7} {:>6} {:>10} {:>12} {:>9} {:>8} {:>8} {:>8}'.format(
+                name, stats['count'], stats['errors'], stats['sent'], stats['received'],
+                ms(stats['seconds']), ms(stats['p50']), ms(stats['p99']), ms(stats['max'])))
+        for name, stats in sorted(summary['chunks'].items()):
+            lines.append('chunks {:<17} {:>7} {:>12} bytes {:>9} ms'.format(
+                name, stats['count'], stats['bytes'], ms(stats['seconds'])))
+        for name, count in sorted(summary['retries'].items()):
+            lines.append('retries {:<16} {:>7}'.format(name, count))
+        for kind, stats in sorted(summary['decodes'].items()):
+            lines.append('decode {:<17} {:>7} chunks {:>9} records {:>9} ms'.format(
+                kind, stats['chunks'], stats['records'], ms(stats['seconds'])))
+        return '\n'.join(lines)
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+record and replay of the raw packets of ZK sessions
+
+ZK(transport=Recorder(path)) talks to the terminal as usual and saves every
+socket opened, every byte sent and received (as received: split packets,
+broken headers...) and every timeout to a capture file.
+ZK(transport=Replayer(path)) runs the same calls with no terminal
+attached, the sockets answer from the capture.
+
+    recorder = Recorder('t1.zkcap')
+    conn = ZK('192.168.1.201', transport=recorder).connect()
+    conn.get_attendance()
+    conn.disconnect()
+    recorder.close()
+
+    conn = ZK('192.168.1.201', transport=Replayer('t1.zkcap')).connect()
+    conn.get_attendance() # same records, from the capture
+
+capture format: b'ZKCAP' and a version byte, then one event per entry,
+header <BHdI (kind, socket number, seconds since the recording started,
+payload length) and the payload. paths ending with .gz are gzip files.
+"""
+from collections import deque
+from socket import timeout
+from struct import Struct
+from threading import Lock
+import gzip
+import time
+
+from .exception import ZKReplayError
+
+MAGIC = b'ZKCAP\x01'
+EVENT = Struct('<BHdI')
+
+OPEN = 1    # payload: b'T' (tcp) or b'U' (udp)
+SEND = 2    # bytes sent
+RECV = 3    # bytes received by one recv call
+TIMEOUT = 4 # recv timed out
+ERROR = 5   # recv failed, payload: the error message
+CLOSE = 6
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def iter_capture(path):
+    """
+    :return: generator of (kind, socket number, seconds, payload)
+    """
+    with _open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ZKReplayError("%s is not a capture file" % path)
+        while True:
+            header = f.read(EVENT.size)
+            if not header:
+                return
+            if len(header) < EVENT.size:
+                raise ZKReplayError("truncated capture file %s" % path)
+            kind, number, seconds, length = EVENT.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                raise ZKReplayError("truncated capture file %s" % path)
+            yield kind, number, seconds, payload
+
+
+class Transport(object):
+    """
+    creates the sockets of a ZK session (see ZK.__create_socket)
+
+    tcp is None when the protocol is chosen by the usual probes, True or
+    False when the transport imposes it (a replayed capture)
+    """
+    tcp = None
+
+    def socket(self, tcp, make):
+        """
+        :param tcp: protocol of the session
+        :param make: function returning the socket ZK would use
+        :return: socket like object
+        """
+        return make()
+
+
+class Recorder(Transport):
+    """
+    saves the traffic of the sockets to a capture file, close() it at the
+    end. several sessions (reconnects) may share the same recorder.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = _open(path, 'wb')
+        self._file.write(MAGIC)
+        self._lock = Lock()
+        self._started = time.time()
+        self._sockets = 0
+
+    def write(self, kind, number, payload=b''):
+        with self._lock:
+            self._file.write(EVENT.pack(kind, number, time.time() - self._started, len(payload)))
+            self._file.write(payload)
+
+    def socket(self, tcp, make):
+        with self._lock:
+            number = self._sockets
+            self._sockets += 1
+        self.write(OPEN, number, b'T' if tcp else b'U')
+        return RecordingSocket(make(), self, number)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class RecordingSocket(object):
+    """
+    socket writing its traffic to a Recorder
+    """
+
+    def __init__(self, sock, recorder, number):
+        self._sock = sock
+        self._recorder = recorder
+        self._number = number
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def send(self, data):
+        sent = self._sock.send(data)
+        self._recorder.write(SEND, self._number, bytes(data[:sent]))
+        return sent
+
+    def sendall(self, data):
+        self._sock.sendall(data)
+        self._recorder.write(SEND, self._number, bytes(data))
+
+    def sendto(self, data, address):
+        sent = self._sock.sendto(data, address)
+        self._recorder.write(SEND, self._number, bytes(data))
+        return sent
+
+    def recv(self, size):
+        try:
+            data = self._sock.recv(size)
+        except timeout:
+            self._recorder.write(TIMEOUT, self._number)
+            raise
+        except Exception as e:
+            self._recorder.write(ERROR, self._number, str(e).encode('utf-8', 'replace'))
+            raise
+        self._recorder.write(RECV, self._number, data)
+        return data
+
+    def recv_into(self, buffer, nbytes=0):
+        try:
+            size = self._sock.recv_into(buffer, nbytes)
+        except timeout:
+            self._recorder.write(TIMEOUT, self._number)
+            raise
+        except Exception as e:
+            self._recorder.write(ERROR, self._number, str(e).encode('utf-8', 'replace'))
+            raise
+        self._recorder.write(RECV, self._number, memoryview(buffer)[:size].tobytes())
+        return size
+
+    def close(self):
+        self._recorder.write(CLOSE, self._number)
+        self._sock.close()
+
+
+class Replayer(Transport):
+    """
+    sockets answering from a capture file, in the order they were opened
+
+    :param verify: check that the bytes sent are the recorded ones (raises
+        ZKReplayError on the first difference)
+    """
+
+    def __init__(self, path, verify=True):
+        self.path = path
+        self.verify = verify
+        self._sessions = deque()
+        sockets = {}
+        for kind, number, _seconds, payload in iter_capture(path):
+            if kind == OPEN:
+                sockets[number] = ReplaySocket(payload == b'T', verify)
+                self._sessions.append(sockets[number])
+            elif number in sockets:
+                sockets[number].load(kind, payload)
+        self.tcp = self._sessions[0].tcp if self._sessions else None
+
+    def socket(self, tcp, make):
+        if not self._sessions:
+            raise ZKReplayError("no more sockets in %s" % self.path)
+        sock = self._sessions.popleft()
+        if sock.tcp != tcp:
+            raise ZKReplayError("capture socket is %s" % ('tcp' if sock.tcp else 'udp'))
+        return sock
+
+
+class ReplaySocket(object):
+    """
+    socket replaying a recorded one. a tcp recv returns at most the bytes
+    of the recorded recv (the original packet boundaries are kept whatever
+    the sizes asked), an udp recv returns the next datagram.
+    """
+
+    def __init__(self, tcp, verify=True):
+        self.tcp = tcp
+        self.verify = verify
+        self.closed = False
+        self._incoming = deque() # bytes, or (TIMEOUT or ERROR, message)
+        self._outgoing = deque() # recorded sends
+        self._timeout = None
+
+    def load(self, kind, payload):
+        if kind == RECV:
+            self._incoming.append(payload)
+        elif kind in (TIMEOUT, ERROR):
+            self._incoming.append((kind, payload.decode('utf-8', 'replace')))
+        elif kind == SEND:
+            self._outgoing.append(payload)
+
+    def settimeout(self, value):
+        self._timeout = value
+
+    def gettimeout(self):
+        return self._timeout
+
+    def connect_ex(self, address):
+        return 0
+
+    def send(self, data):
+        self._check(data)
+        return len(data)
+
+    def sendall(self, data):
+        self._check(data)
+
+    def sendto(self, data, address):
+        self._check(data)
+        return len(data)
+
+    def _check(self, data):
+        if not self.verify:
+            return
+        data = bytes(data)
+        while data:
+            if not self._outgoing:
+                raise ZKReplayError("sending more than recorded: %r" % data[:16])
+            expected = self._outgoing.popleft()
+            if self.tcp and len(expected) > len(data) and expected.startswith(data):
+                self._outgoing.appendleft(expected[len(data):])
+                return
+            part, data = data[:len(expected)], data[len(expected):]
+            if part != expected or (data and not self.tcp):
+                raise ZKReplayError("sent %r, recorded %r" % (part[:16], expected[:16]))
+
+    def recv(self, size):
+        if not self._incoming:
+            raise timeout("capture exhausted")
+        data = self._incoming.popleft()
+        if isinstance(data, tuple):
+            kind, message = data
+            if kind == TIMEOUT:
+                raise timeout("timed out")
+            raise ZKReplayError(message)
+        if self.tcp and len(data) > size:
+            self._incoming.appendleft(data[size:])
+        return data[:size]
+
+    def recv_into(self, buffer, nbytes=0):
+        view = memoryview(buffer)
+        data = self.recv(nbytes or len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.closed = True
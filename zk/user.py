@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from struct import pack #, unpack
 class User(object):
+    __slots__ = ('uid', 'name', 'privilege', 'password', 'group_id', 'user_id', 'card')
     encoding = 'UTF-8'
 
     def __init__(self, uid, name, privilege, password='', group_id='', user_id='', card=0):
@@ -25,6 +26,17 @@ class User(object):
             card=json['card']
         )
 
+    def json_pack(self): #packs for json
+        return {
+            "uid": self.uid,
+            "name": self.name,
+            "privilege": self.privilege,
+            "password": self.password,
+            "group_id": self.group_id,
+            "user_id": self.user_id,
+            "card": self.card
+        }
+
     def repack29(self): # with 02 for zk6 (size 29)
         return pack("<BHB5s8sIxBhI", 2, self.uid, self.privilege, self.password.encode(User.encoding, errors='ignore'), self.name.encode(User.encoding, errors='ignore'), self.card, int(self.group_id) if self.group_id else 0, 0, int(self.user_id))
 
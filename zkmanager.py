@@ -423,6 +423,12 @@ class DataState:
     def set_last_att_ts(self, key, dt):
         self._data.setdefault('att_last_ts', {})[key] = dt.isoformat()
         self._save()
+    def get_att_position(self, key):
+        # índice y último registro descargado (ZK.attendance_position)
+        return self._data.get('att_position', {}).get(key)
+    def set_att_position(self, key, position):
+        self._data.setdefault('att_position', {})[key] = position
+        self._save()
     def get_user_ids(self, key):
         ids = self._data.get('user_ids', {}).get(key, [])
         return set(ids)
@@ -817,14 +823,18 @@ class LogsTab(QtWidgets.QWidget):
             return
         key = f"{data['ip']}:{data['port']}"
         last_ts = self.state.get_last_att_ts(key)
+        position = self.state.get_att_position(key)
         self.status.setText('Conectando y preparando previsualización...')
         def task():
             zk = ZK(data['ip'], port=data['port'], password=data['password'], ommit_ping=False, verbose=False)
             zk.connect()
             zk.disable_device()
-            att = zk.get_attendance()
+            # solo los registros posteriores a la última descarga (todo el log si se borró o rotó)
+            att = zk.get_attendance(position)
             # calcular nuevas
-            if last_ts:
+            if zk.attendance_incremental:
+                new_items = att
+            elif last_ts:
                 new_items = [a for a in att if a.timestamp > last_ts]
             else:
                 new_items = att
@@ -832,7 +842,8 @@ class LogsTab(QtWidgets.QWidget):
             for a in att:
                 if (max_ts is None) or (a.timestamp > max_ts):
                     max_ts = a.timestamp
-            return {'zk': zk, 'all': att, 'new': new_items, 'max_ts': max_ts}
+            return {'zk': zk, 'all': att, 'new': new_items, 'max_ts': max_ts,
+                    'total': zk.records, 'position': zk.attendance_position}
         worker = Worker(task)
         worker.signals.finished.connect(lambda res: self._preview_and_confirm(res, data))
         worker.signals.error.connect(lambda e: self._error_and_cleanup(e))
@@ -850,7 +861,7 @@ class LogsTab(QtWidgets.QWidget):
             self.table.setItem(r,2, QtWidgets.QTableWidgetItem(str(a.timestamp)))
             self.table.setItem(r,3, QtWidgets.QTableWidgetItem(str(a.status)))
             self.table.setItem(r,4, QtWidgets.QTableWidgetItem(str(a.punch)))
-        self.status.setText(f"Nuevos: {len(att_new)} de {len(att_all)} totales")
+        self.status.setText(f"Nuevos: {len(att_new)} de {res.get('total', len(att_all))} totales")
         reply = QtWidgets.QMessageBox.question(self,'Confirmar descarga', f"¿Descargar {len(att_new)} nuevos registros?")
         if reply != QtWidgets.QMessageBox.Yes:
             # enable y desconectar
@@ -880,6 +891,8 @@ class LogsTab(QtWidgets.QWidget):
             key = f"{data['ip']}:{data['port']}"
             if res['max_ts']:
                 self.state.set_last_att_ts(key, res['max_ts'])
+            if res['position']:
+                self.state.set_att_position(key, res['position'])
             try:
                 zk.enable_device()
             finally: